@@ -0,0 +1,285 @@
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+
+import run as client
+
+# Processes a directory of scans, one sub-folder per scan, with many jobs in flight at once:
+# every scan is uploaded, submitted as an asynchronous job and polled with backoff until it
+# finishes. Results are appended to a JSONL file as they arrive and the task folders are
+# removed. An interrupted batch resumes from the JSONL file: finished scans are skipped and
+# submitted jobs are polled again instead of being resubmitted.
+#
+#   python batch.py /data/scans --output results.jsonl --in-flight 32
+#   python batch.py /data/scans --output results.jsonl --mock # without RunPod
+
+RUNPOD_API_URL = 'https://api.runpod.ai/v2'
+
+# Final job states of the RunPod API
+FINAL_STATUSES = ('COMPLETED', 'FAILED', 'CANCELLED', 'TIMED_OUT')
+
+IN_FLIGHT = int(os.getenv('BATCH_IN_FLIGHT', 16))
+POLL_INTERVAL = 1.0 # seconds, doubled after every poll up to MAX_POLL_INTERVAL
+MAX_POLL_INTERVAL = 30.0
+MAX_POLL_ERRORS = 5 # consecutive failed status requests before a job is given up
+
+# The same scan always gets the same task id, so that a resumed upload skips the files which
+# are in the bucket already
+TASK_NAMESPACE = uuid.UUID('5b0e7c1e-4f4d-4c43-9a56-7d1c2f0b9e61')
+
+def get_task_id(scan_p: str) -> str:
+  return str(uuid.uuid5(TASK_NAMESPACE, os.path.abspath(scan_p)))
+
+# The RunPod serverless endpoint, over its REST API. Takes an aiohttp session.
+class RunPodEndpoint:
+  def __init__(self, endpoint_id: str, api_key: str, session):
+    self.url = f'{RUNPOD_API_URL}/{endpoint_id}'
+    self.headers = {'Authorization': f'Bearer {api_key}'}
+    self.session = session
+
+  async def submit(self, input: dict) -> str:
+    async with self.session.post(f'{self.url}/run', json={'input': input}, headers=self.headers) as response:
+      response.raise_for_status()
+      return (await response.json())['id']
+
+  # Returns the job state ('status', 'output' or 'error'), None if the job is unknown
+  async def status(self, job_id: str) -> dict:
+    async with self.session.get(f'{self.url}/status/{job_id}', headers=self.headers) as response:
+      if response.status == 404:
+        return None
+      response.raise_for_status()
+      return await response.json()
+
+  async def cancel(self, job_id: str) -> None:
+    async with self.session.post(f'{self.url}/cancel/{job_id}', headers=self.headers) as response:
+      response.raise_for_status()
+
+# A stand-in for the RunPod endpoint which runs `handler` (a RunPod handler function) in threads,
+# `workers` jobs at a time, and reports the job states the way the RunPod API does
+class MockEndpoint:
+  def __init__(self, handler, workers: int = 4):
+    self.handler = handler
+    self.workers = workers
+    self._jobs: dict[str, dict] = {}
+    self._semaphore: asyncio.Semaphore = None
+
+  async def _run(self, job_id: str, input: dict) -> None:
+    async with self._semaphore:
+      self._jobs[job_id] = {'id': job_id, 'status': 'IN_PROGRESS'}
+      if self._jobs[job_id]['status'] == 'CANCELLED':
+        return
+
+      try:
+        output = await asyncio.to_thread(self.handler, {'id': job_id, 'input': input})
+        job = {'id': job_id, 'status': 'COMPLETED', 'output': output}
+      except Exception as e:
+        job = {'id': job_id, 'status': 'FAILED', 'error': str(e)}
+
+      # The handler thread can't be stopped, a cancelled job only discards its result
+      if self._jobs[job_id]['status'] != 'CANCELLED':
+        self._jobs[job_id] = job
+
+  async def submit(self, input: dict) -> str:
+    if self._semaphore is None:
+      self._semaphore = asyncio.Semaphore(self.workers)
+
+    job_id = str(uuid.uuid4())
+    self._jobs[job_id] = {'id': job_id, 'status': 'IN_QUEUE'}
+    asyncio.get_running_loop().create_task(self._run(job_id, input))
+    return job_id
+
+  async def status(self, job_id: str) -> dict:
+    job = self._jobs.get(job_id)
+    return dict(job) if job is not None else None
+
+  async def cancel(self, job_id: str) -> None:
+    if job_id not in self._jobs:
+      raise Exception(f'unknown job {job_id}')
+    if self._jobs[job_id]['status'] not in FINAL_STATUSES:
+      self._jobs[job_id] = {'id': job_id, 'status': 'CANCELLED'}
+
+# A handler for the mock endpoint: checks that the task was uploaded, takes `duration` seconds
+# and fails `failure_rate` of the tasks, answering like the server's handler
+def make_mock_handler(duration: float = 1.0, failure_rate: float = 0.0):
+  def handler(event: dict) -> dict:
+    id = event['input']['id']
+    files = client._list_files(client._get_source_bucket(), f'tasks/{id}/')
+    time.sleep(duration * random.uniform(0.5, 1.5))
+
+    if not files or random.random() < failure_rate:
+      return {'status': 'error', 'id': id, 'error': 'no views to assemble' if not files else 'mock failure'}
+    return {'status': 'completed', 'id': id, 'foot_size': round(random.uniform(0.22, 0.3), 4), 'cache': 'disabled'}
+
+  return handler
+
+# Reads the last record of every scan from a results file
+def load_progress(output_p: str) -> dict[str, dict]:
+  progress = {}
+  if not os.path.exists(output_p):
+    return progress
+
+  with open(output_p, 'r') as f:
+    for line in f:
+      try:
+        record = json.loads(line)
+      except json.JSONDecodeError:
+        continue # a line cut short by the interruption
+      progress[record['scan']] = record
+
+  return progress
+
+class BatchRunner:
+  def __init__(self, endpoint, output_p: str, in_flight: int = IN_FLIGHT, resize: bool = client.RESIZE_IMAGES,
+               cleanup: bool = True, retry_failed: bool = False, timeout: float = None):
+    self.endpoint = endpoint
+    self.output_p = output_p
+    self.in_flight = in_flight
+    self.resize = resize
+    self.cleanup = cleanup
+    self.retry_failed = retry_failed
+    self.timeout = timeout
+
+    self.counts = {'completed': 0, 'failed': 0, 'skipped': 0}
+    self._total = 0
+    self._output = None
+
+  def _write(self, record: dict) -> None:
+    self._output.write(json.dumps(record) + '\n')
+    self._output.flush()
+
+  # Polls the job with exponential backoff until it finishes. Returns None if the job is unknown.
+  async def _wait(self, job_id: str, started: float) -> dict:
+    interval, errors = POLL_INTERVAL, 0
+    while True:
+      await asyncio.sleep(interval * random.uniform(0.8, 1.2))
+      interval = min(interval * 2, MAX_POLL_INTERVAL)
+
+      try:
+        job = await self.endpoint.status(job_id)
+        errors = 0
+      except Exception as e:
+        errors += 1
+        if errors >= MAX_POLL_ERRORS:
+          return {'status': 'FAILED', 'error': f'status requests failed ({str(e)})'}
+        continue
+
+      if job is None or job['status'] in FINAL_STATUSES:
+        return job
+      if self.timeout is not None and time.time() - started > self.timeout:
+        return {'status': 'TIMED_OUT', 'error': f'no result after {self.timeout:.0f}s', 'cancelled': await self._cancel(job_id)}
+
+  # Cancels a job which is given up on, so that it stops reading the task folder. Returns False
+  # if the endpoint couldn't be asked to.
+  async def _cancel(self, job_id: str) -> bool:
+    try:
+      await self.endpoint.cancel(job_id)
+      return True
+    except Exception as e:
+      print(f'failed to cancel job {job_id} ({str(e)})\n', end='')
+      return False
+
+  # Uploads, submits and waits for the scan. Returns the job state and the uploaded paths.
+  async def _process(self, scan: str, scan_p: str, id: str, last: dict) -> tuple[str, dict, float, list[str]]:
+    paths = None
+    job_id, started = None, time.time()
+    if last is not None and last['event'] == 'submitted':
+      job_id, started = last['job_id'], last['time']
+
+    job = None
+    while job is None:
+      if job_id is None:
+        paths = await asyncio.to_thread(client.upload_data, scan_p, id, self.resize, verbose=False)
+        job_id, started = await self.endpoint.submit({'id': id}), time.time()
+        self._write({'event': 'submitted', 'scan': scan, 'id': id, 'job_id': job_id, 'time': started})
+
+      job = await self._wait(job_id, started)
+      if job is None:
+        print(f'{scan}: job {job_id} is unknown to the endpoint, resubmitting\n', end='')
+        job_id = None
+
+    return job_id, job, started, paths
+
+  async def _run_scan(self, scan: str, scan_p: str, last: dict, semaphore: asyncio.Semaphore) -> None:
+    async with semaphore:
+      id = get_task_id(scan_p)
+      job_id, paths, started = last.get('job_id') if last else None, None, time.time()
+      try:
+        job_id, job, started, paths = await self._process(scan, scan_p, id, last)
+      except Exception as e:
+        job = {'status': 'FAILED', 'error': str(e)}
+
+      output = job.get('output')
+      if job['status'] == 'COMPLETED' and isinstance(output, dict) and output.get('status') == 'completed':
+        event = 'completed'
+        record = {'event': event, 'scan': scan, 'id': id, 'job_id': job_id, 'output': output}
+      else:
+        event = 'failed'
+        error = job.get('error') or (output.get('error') if isinstance(output, dict) else None) or job['status']
+        record = {'event': event, 'scan': scan, 'id': id, 'job_id': job_id, 'status': job['status'], 'error': error}
+
+      record['elapsed_s'] = time.time() - started
+      self._write(record)
+      self.counts[event] += 1
+      print(f"[{sum(self.counts.values())}/{self._total}] {scan}: {event}\n", end='')
+
+      # A timed out job which couldn't be cancelled may still be reading the task folder
+      if self.cleanup and job.get('cancelled', True):
+        try:
+          await asyncio.to_thread(client.cleanup_data, id, paths)
+        except Exception as e:
+          print(f'{scan}: failed to remove the task folder ({str(e)})\n', end='')
+
+  # Runs every scan folder of `scans_p` which hasn't finished in an earlier run
+  async def run(self, scans_p: str) -> dict:
+    progress = load_progress(self.output_p)
+    scans = sorted(e.name for e in os.scandir(scans_p) if e.is_dir())
+    self._total = len(scans)
+
+    semaphore = asyncio.Semaphore(self.in_flight)
+    tasks = []
+    with open(self.output_p, 'a') as self._output:
+      for scan in scans:
+        last = progress.get(scan)
+        if last is not None and (last['event'] == 'completed' or (last['event'] == 'failed' and not self.retry_failed)):
+          self.counts['skipped'] += 1
+          continue
+        tasks.append(self._run_scan(scan, os.path.join(scans_p, scan), last, semaphore))
+
+      start = time.time()
+      await asyncio.gather(*tasks)
+
+    return {**self.counts, 'wall_s': time.time() - start}
+
+async def main(args) -> None:
+  client.init_cloud(client.SUPABASE_URL, client.SUPABASE_API_KEY)
+
+  if args.mock:
+    endpoint = MockEndpoint(make_mock_handler(args.mock_duration, args.mock_failure_rate), args.mock_workers)
+    runner = BatchRunner(endpoint, args.output, args.in_flight, args.resize, args.cleanup, args.retry_failed, args.timeout)
+    print(await runner.run(args.scans))
+    return
+
+  import aiohttp
+  async with aiohttp.ClientSession() as session:
+    endpoint = RunPodEndpoint(client.RUNPOD_ENDPOINT_ID, client.RUNPOD_API_KEY, session)
+    runner = BatchRunner(endpoint, args.output, args.in_flight, args.resize, args.cleanup, args.retry_failed, args.timeout)
+    print(await runner.run(args.scans))
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('scans', help='a folder with one sub-folder per scan')
+  parser.add_argument('--output', default='results.jsonl')
+  parser.add_argument('--in-flight', type=int, default=IN_FLIGHT, help='scans uploaded or processed at once')
+  parser.add_argument('--timeout', type=float, default=None, help='seconds after which a job is given up')
+  parser.add_argument('--resize', action=argparse.BooleanOptionalAction, default=client.RESIZE_IMAGES)
+  parser.add_argument('--cleanup', action=argparse.BooleanOptionalAction, default=True)
+  parser.add_argument('--retry-failed', action='store_true')
+  parser.add_argument('--mock', action='store_true', help='run the jobs on a local mock endpoint')
+  parser.add_argument('--mock-workers', type=int, default=4)
+  parser.add_argument('--mock-duration', type=float, default=1.0)
+  parser.add_argument('--mock-failure-rate', type=float, default=0.0)
+  asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,56 @@
+import struct
+import numpy as np
+
+# Reads the server's 'fmsh' meshes, see server/src/detail/mesh_codec.py for the layout.
+# Results store the vertices as offsets from a template mesh, which is downloaded once.
+
+MAGIC = b'FMSH'
+FORMAT_VERSION = 1
+
+FLAG_DELTA = 2
+FLAG_FACES_U16 = 4
+
+_HEADER = struct.Struct('<4sBBHII')
+_QUANT = struct.Struct('<6f')
+_REFERENCE_BYTES = 16
+
+def read_header(data: bytes) -> dict:
+  magic, version, flags, _, num_verts, num_faces = _HEADER.unpack_from(data)
+  if magic != MAGIC:
+    raise Exception('not an fmsh mesh')
+  if version != FORMAT_VERSION:
+    raise Exception(f'unsupported fmsh version {version}')
+
+  delta = bool(flags & FLAG_DELTA)
+  reference = data[_HEADER.size:_HEADER.size + _REFERENCE_BYTES].hex()
+  return {
+    'delta': delta,
+    'flags': flags,
+    'num_verts': num_verts,
+    'num_faces': num_faces,
+    'template_id': reference if delta else None,
+    'topology_id': None if delta else reference,
+  }
+
+# Returns the (N, 3) float32 vertices and the (F, 3) int32 faces. `template` is the decoded
+# template (vertices, faces), needed by meshes stored as offsets from it.
+def decode_mesh(data: bytes, template: tuple = None) -> tuple[np.ndarray, np.ndarray]:
+  header = read_header(data)
+
+  offset = _HEADER.size + _REFERENCE_BYTES
+  quant = np.array(_QUANT.unpack_from(data, offset), dtype=np.float64)
+  offset += _QUANT.size
+
+  q = np.frombuffer(data, dtype='<i2', count=header['num_verts'] * 3, offset=offset).reshape(-1, 3)
+  offset += q.nbytes
+  values = quant[:3] + q * quant[3:]
+
+  if header['delta']:
+    if template is None:
+      raise Exception(f"the mesh needs the template {header['template_id']}")
+    verts, faces = template
+    return (verts + values).astype(np.float32), faces
+
+  dtype = '<u2' if header['flags'] & FLAG_FACES_U16 else '<i4'
+  faces = np.frombuffer(data, dtype=dtype, count=header['num_faces'] * 3, offset=offset).reshape(-1, 3)
+  return values.astype(np.float32), faces.astype(np.int32)
@@ -0,0 +1,23 @@
+import io
+from PIL import Image
+
+# The size the server decodes images to at its default resolution quality, (W, H). Larger
+# images are downscaled by the server anyway, so uploading them only costs uplink time.
+TARGET_IMAGE_SIZE = (960, 1280)
+JPEG_QUALITY = 90
+
+# Re-encodes an image as a JPEG no larger than `size`, keeping its aspect ratio. The ARKit
+# intrinsics don't change: the server expresses them relative to the image size.
+# The encoding is deterministic, so unchanged files keep their hash across uploads.
+def prepare_image(path: str, size: tuple[int, int] = TARGET_IMAGE_SIZE, quality: int = JPEG_QUALITY) -> bytes:
+  with Image.open(path) as image:
+    image.draft('RGB', size)
+    image = image.convert('RGB')
+
+    if image.width > size[0] or image.height > size[1]:
+      scale = min(size[0] / image.width, size[1] / image.height)
+      image = image.resize((round(image.width * scale), round(image.height * scale)), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
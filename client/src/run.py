@@ -1,5 +1,7 @@
 import os
+import json
 import uuid
+import hashlib
 import runpod
 from dotenv import load_dotenv
 
@@ -8,18 +10,37 @@ load_dotenv()
 
 from supabase import Client, create_client
 
+from mesh import decode_mesh
+from prepare import prepare_image, TARGET_IMAGE_SIZE, JPEG_QUALITY
+from concurrent.futures import ThreadPoolExecutor
+
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_API_KEY = os.getenv('SUPABASE_API_KEY')
 SUPABASE_SOURCE_BUCKET_ID = os.getenv('SUPABASE_SOURCE_BUCKET_ID')
+SUPABASE_RESULT_BUCKET_ID = os.getenv('SUPABASE_RESULT_BUCKET_ID')
 
 RUNPOD_API_KEY = os.getenv('RUNPOD_API_KEY')
 RUNPOD_ENDPOINT_ID = os.getenv('RUNPOD_ENDPOINT_ID')
 
 IMAGE_FOLDER = os.getenv('IMAGE_FOLDER')
 
+# Re-encode the images at the server's target resolution before uploading them
+RESIZE_IMAGES = os.getenv('RESIZE_IMAGES', '1') == '1'
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', JPEG_QUALITY))
+
+UPLOAD_CONCURRENCY = int(os.getenv('UPLOAD_CONCURRENCY', 8))
+
+# Page size of the storage listings and the largest number of files removed by one request
+LIST_PAGE_SIZE = 1000
+REMOVE_BATCH_SIZE = 1000
+
 supabase: Client = None
 serverless: runpod.Endpoint = None
 
+# Decoded mesh templates by path, they are shared by all results. The path holds a digest of
+# the template encoding, so a changed template gets a new path and is never served from here.
+templates: dict[str, tuple] = {}
+
 def _get_extension(filename: str) -> str:
   return os.path.splitext(filename)[1]
 
@@ -36,41 +57,91 @@ def init_runpod(key: str, endpoint: str) -> None:
 def create_unique_task_id() -> str:
   return str(uuid.uuid4())
 
-def upload_data(images_p: str, id: str) -> None:
-  # Get the SupaBase bucket
-  bucket = supabase.storage.from_(SUPABASE_SOURCE_BUCKET_ID)
-  
+def _get_source_bucket():
+  return supabase.storage.from_(SUPABASE_SOURCE_BUCKET_ID)
+
+# Lists every file of a folder, the storage API returns at most one page per call
+def _list_files(bucket, folder_path: str) -> list[dict]:
+  files, offset = [], 0
+  while True:
+    page = bucket.list(folder_path, {'limit': LIST_PAGE_SIZE, 'offset': offset})
+    files += page
+    if len(page) < LIST_PAGE_SIZE:
+      return files
+    offset += len(page)
+
+# The etags of plain uploads are the MD5 of their content
+def _get_etag(f: dict) -> str:
+  etag = (f.get('metadata') or {}).get('eTag')
+  return etag.strip('"') if etag else None
+
+def _read_file(source_p: str, resize: bool) -> bytes:
+  if resize and source_p.endswith(('.png', '.jpg')):
+    return prepare_image(source_p, TARGET_IMAGE_SIZE, IMAGE_QUALITY)
+
+  with open(source_p, 'rb') as f:
+    return f.read()
+
+# Uploads the scan images and their ARKit files into the task folder, `concurrency` at a time.
+# Files which are already there with the same content are skipped. Returns the uploaded paths.
+def upload_data(images_p: str, id: str, resize: bool = RESIZE_IMAGES, concurrency: int = UPLOAD_CONCURRENCY, verbose: bool = True) -> list[str]:
+  bucket = _get_source_bucket()
   task_folder_path = f'tasks/{id}/'
 
-  # List source file names
-  source_file_names = [
-    filename.rsplit('.', 1)[0]
-    for filename
-    in os.listdir(images_p)
-    if filename.endswith(('.png', '.jpg'))
-  ]
+  # Source files by their upload name, the images are uploaded as .jpg
+  sources = {}
+  for filename in os.listdir(images_p):
+    if filename.endswith(('.png', '.jpg')):
+      name = filename.rsplit('.', 1)[0]
+      sources[f'{name}.jpg'] = os.path.join(images_p, filename)
+      sources[f'{name}.json'] = os.path.join(images_p, f'{name}.json')
 
-  # Create image and arkit file names
-  image_file_names = list(map(lambda x: f'{x}.jpg', source_file_names))
-  arkit_file_names = list(map(lambda x: f'{x}.json', source_file_names))
+  existing = {f['name']: _get_etag(f) for f in _list_files(bucket, task_folder_path)}
 
-  # Upload the files
-  all_file_names = image_file_names + arkit_file_names
-  for fname in all_file_names:
-    fpath = os.path.join(images_p, fname)
+  def upload(fname: str) -> str:
+    data = _read_file(sources[fname], resize)
 
-    # Do something with the file...
-    with open(fpath, 'rb') as f:
-      bucket.upload(task_folder_path + fname, f)
-      print(f'Uploaded {fname}')
+    # Printed with a single write, so that the lines of concurrent uploads don't interleave
+    if existing.get(fname) == hashlib.md5(data).hexdigest():
+      message = f'Skipped {fname}, already uploaded'
+    else:
+      bucket.upload(task_folder_path + fname, data, {'upsert': 'true'})
+      message = f'Uploaded {fname} ({len(data)} bytes)'
 
-def cleanup_data(id: str) -> None:
-  # Get the SupaBase bucket
-  bucket = supabase.storage.from_(SUPABASE_SOURCE_BUCKET_ID)
+    if verbose:
+      print(message + '\n', end='')
+    return task_folder_path + fname
 
-  task_folder_path = f'tasks/{id}/'
-  files = bucket.list(task_folder_path)
-  bucket.remove([task_folder_path + f['name'] for f in files])
+  with ThreadPoolExecutor(max_workers=concurrency) as pool:
+    return list(pool.map(upload, sorted(sources)))
+
+# Removes the task folder. With the paths returned by upload_data the folder isn't listed.
+def cleanup_data(id: str, paths: list[str] = None) -> None:
+  bucket = _get_source_bucket()
+
+  if paths is None:
+    task_folder_path = f'tasks/{id}/'
+    paths = [task_folder_path + f['name'] for f in _list_files(bucket, task_folder_path)]
+
+  for i in range(0, len(paths), REMOVE_BATCH_SIZE):
+    bucket.remove(paths[i:i + REMOVE_BATCH_SIZE])
+
+# Downloads the result of a task: the foot size, the keypoints and the mesh as 'verts' and 'faces'
+def download_result(id: str) -> dict:
+  bucket = supabase.storage.from_(SUPABASE_RESULT_BUCKET_ID)
+
+  result = json.loads(bucket.download(f'tasks/{id}/result.json'))
+  if result['mesh'] is None:
+    return result
+
+  template = None
+  if result['template'] is not None:
+    if result['template'] not in templates:
+      templates[result['template']] = decode_mesh(bucket.download(result['template']))
+    template = templates[result['template']]
+
+  result['verts'], result['faces'] = decode_mesh(bucket.download(result['mesh']), template)
+  return result
 
 def run_endpoint(id: str) -> None:
   try:
@@ -84,6 +155,12 @@ def run_endpoint(id: str) -> None:
     )
 
     print(run_request)
+
+    if run_request and run_request.get('result') is not None:
+      result = download_result(id)
+      print(f"Foot size: {result['foot_size']}")
+      if 'verts' in result:
+        print(f"Mesh: {len(result['verts'])} vertices, {len(result['faces'])} faces")
   except TimeoutError:
     print("Job timed out.")
 
@@ -92,6 +169,6 @@ if __name__ == "__main__":
   init_runpod(RUNPOD_API_KEY, RUNPOD_ENDPOINT_ID)
 
   id = create_unique_task_id()
-  upload_data(IMAGE_FOLDER, id)
+  paths = upload_data(IMAGE_FOLDER, id)
   run_endpoint(id)
-  cleanup_data(id)
\ No newline at end of file
+  cleanup_data(id, paths)
\ No newline at end of file
@@ -0,0 +1,97 @@
+# Checks that the batched ARKit camera conversion (detail.process_arkit) is bit-for-bit identical
+# to the per-camera conversion it replaced: R, T and C in float64 before the float32 cast, and
+# R, T, C and the intrinsics of the returned ARKitSource. Covers no cameras, a single camera,
+# synthetic scans and poses at the euler angle limits. Raises on the first difference.
+#
+#   cd server && python -m bench.arkit_check --views 200 --seeds 5
+import argparse
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+from . import harness, synthetic
+
+harness.setup_paths()
+
+from detail.process_arkit import (
+  TRANSF_A2P, ROTATE_90_X, ROTATE_NEG90_Z, ROTATE_180_Z,
+  convert_cameras, process_arkit, stack_cameras,
+)
+
+# The per-camera conversion as it was before the batching, without the intrinsics downscaling,
+# which was dropped when the intrinsics moved to pixels of the camera images
+def _reference_camera(camera: dict) -> dict:
+  C = np.array([camera['x'], camera['y'], camera['z']])
+  C = ROTATE_90_X @ C
+  C = ROTATE_180_Z @ C
+
+  R = TRANSF_A2P @ Rotation.from_euler('xyz', [camera['angleX'], camera['angleY'], camera['angleZ']]).as_matrix().T
+  R = (R.T @ ROTATE_NEG90_Z).T
+  R = (ROTATE_90_X @ R.T).T
+  R = (ROTATE_180_Z @ R.T).T
+
+  T = (-R @ C[:, None])[..., 0]
+  return {'R': R, 'T': T, 'C': C, 'pp': np.array([camera['oy'], camera['ox']]), 'f': camera['fx']}
+
+def _reference(data: dict) -> dict[str, np.ndarray]:
+  cameras = [_reference_camera(camera) for camera in data.values()]
+  shapes = {'R': (3, 3), 'T': (3,), 'C': (3,), 'pp': (2,), 'f': ()}
+  return {k: np.array([c[k] for c in cameras], dtype=np.float64).reshape(len(cameras), *shape) for k, shape in shapes.items()}
+
+# Cameras at the limits of the euler angles, including gimbal lock
+def _edge_cameras() -> dict[str, dict]:
+  angles = [0.0, np.pi / 2, -np.pi / 2, np.pi, -np.pi, 1e-9, np.pi - 1e-9]
+  cameras = {}
+  for i, (ax, ay, az) in enumerate((ax, ay, az) for ax in angles for ay in angles for az in angles[:3]):
+    cameras[f'{i:04d}.jpg'] = {
+      'x': 0.1 * i, 'y': -0.2, 'z': 1e-3 * i, 'angleX': ax, 'angleY': ay, 'angleZ': az,
+      'fx': 1400.0, 'ox': 960.0, 'oy': 720.0,
+    }
+  return cameras
+
+def _check_equal(name: str, a: np.ndarray, b: np.ndarray) -> None:
+  if a.shape != b.shape or a.dtype != b.dtype or not np.array_equal(a, b):
+    raise Exception(f'arkit check failed: {name} differs from the per-camera conversion')
+
+def check(name: str, data: dict) -> None:
+  reference = _reference(data)
+
+  if data:
+    R, T, C = convert_cameras(stack_cameras(data)[1])
+    for k, v in {'R': R, 'T': T, 'C': C}.items():
+      _check_equal(f'{name} float64 {k}', v, reference[k])
+
+  source = process_arkit(None, custom_loader=lambda: data)
+  if source.filename != list(data.keys()):
+    raise Exception(f'arkit check failed: {name} filenames differ')
+  for k in reference:
+    _check_equal(f'{name} {k}', getattr(source, k), reference[k].astype(np.float32))
+
+  print(f'ok: {name} ({len(data)} cameras)')
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--views', type=int, default=200)
+  parser.add_argument('--seeds', type=int, default=5)
+  args = parser.parse_args()
+
+  scan = synthetic.make_arkit(args.views)
+  check('no cameras', {})
+  check('one camera', dict(list(scan.items())[:1]))
+  check('edge angles', _edge_cameras())
+  for seed in range(args.seeds):
+    check(f'synthetic scan {seed}', synthetic.make_arkit(args.views, seed))
+
+  # Random poses over the whole angle range, not only around a ring
+  rng = np.random.default_rng(0)
+  random = {
+    f'{i:04d}.jpg': {
+      **camera,
+      'angleX': float(rng.uniform(-np.pi, np.pi)), 'angleY': float(rng.uniform(-np.pi, np.pi)), 'angleZ': float(rng.uniform(-np.pi, np.pi)),
+      'x': float(rng.normal()), 'y': float(rng.normal()), 'z': float(rng.normal()),
+    }
+    for i, camera in enumerate(scan.values())
+  }
+  check('random poses', random)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,87 @@
+# Compares building the FOUND batch of a request (make_batch) with a new buffer arena per
+# request, which allocates every tensor the way make_batch always did, against an arena reused
+# across requests (detail.buffers). Reports the latency, the buffers allocated per request, the
+# CUDA caching allocator's allocations per request and the host to device copy time per request.
+# The predictions start on the host, like the SAM2 masks.
+#
+#   cd server && python -m bench.batch_buffers --views 16 --repeats 20 --output results/buffers.json
+import argparse
+import torch
+import numpy as np
+
+from . import harness, synthetic
+
+harness.setup_paths()
+
+from data import parse_arkit
+from detail.buffers import BufferArena
+from detail.make_batch import make_batch
+from detail.config import FOUND_IMAGE_SIZE
+
+class _BatchArgs:
+  def __init__(self, device: torch.device, image_size):
+    self.device = device
+    self.image_size = image_size
+
+def _allocations(device: torch.device) -> int:
+  if device.type != 'cuda':
+    return 0
+  return torch.cuda.memory_stats(device).get('allocation.all.allocated', 0)
+
+def _run(get_arena, args, predictions: dict, source_arkit, repeats: int) -> dict:
+  device = args.device
+  counts = {'arena_allocations': 0, 'device_allocations': 0, 'h2d_ms': 0.0, 'h2d_bytes': 0}
+
+  def request() -> None:
+    arena = get_arena()
+    before, allocations = arena.stats(), _allocations(device)
+    make_batch(args, predictions, source_arkit, arena)
+    after = arena.stats()
+
+    counts['device_allocations'] += _allocations(device) - allocations
+    counts['arena_allocations'] += after['allocations'] - before['allocations']
+    counts['h2d_ms'] += after['h2d_ms'] - before['h2d_ms']
+    counts['h2d_bytes'] += after['h2d_bytes'] - before['h2d_bytes']
+
+  request() # warmup, which sizes a reused arena
+  counts = dict.fromkeys(counts, 0)
+  result = harness.measure(request, repeats=repeats, warmup=0, device=device)
+  result.update({k: v / repeats for k, v in counts.items()})
+  return result
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--views', type=int, default=16)
+  parser.add_argument('--prediction-size', type=int, nargs=2, default=[480, 640], help='prediction size (W, H)')
+  parser.add_argument('--repeats', type=int, default=20)
+  parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+  parser.add_argument('--output', default=None)
+  args = parser.parse_args()
+
+  device = torch.device(args.device)
+  predictions = synthetic.make_predictions(args.views, tuple(args.prediction_size))
+  source_arkit = parse_arkit(synthetic.arkit_content(synthetic.make_arkit(args.views)))
+  batch_args = _BatchArgs(device, np.array(FOUND_IMAGE_SIZE))
+
+  reused = BufferArena(device)
+  settings = {
+    'new arena per request': lambda: BufferArena(device),
+    'reused arena': lambda: reused,
+  }
+
+  results = {}
+  for name, get_arena in settings.items():
+    results[name] = _run(get_arena, batch_args, predictions, source_arkit, args.repeats)
+
+  harness.print_results(f'batch buffers ({args.views} views, {device.type})', results)
+  for name, r in results.items():
+    print(
+      f"{name:>32}: {r['arena_allocations']:.1f} arena and {r['device_allocations']:.1f} allocator allocations, "
+      f"{r['h2d_ms']:.3f} ms host to device per request"
+    )
+
+  if args.output:
+    harness.save_results(args.output, 'batch_buffers', results, {k: v for k, v in vars(args).items() if k != 'output'})
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,73 @@
+# Compares loading a checkpoint into a model by reading it into memory, as torch.load does by
+# default, with the memory-mapped load_checkpoint used at startup. Uses a synthetic checkpoint of
+# about the size of SAM2 Hiera-L unless a real one is given. The memory is the private memory
+# only: the mapped checkpoint pages belong to the page cache, which can drop them after the load.
+#
+#   cd server && python -m bench.checkpoint_load --size-mb 900
+#   cd server && python -m bench.checkpoint_load --checkpoint /app/sam2/checkpoints/sam2.1_hiera_large.pt
+import os
+import ctypes
+import argparse
+import tempfile
+import torch
+
+from . import harness
+
+harness.setup_paths()
+
+from detail.loader import load_checkpoint
+
+LAYER_SIZE = 1024
+
+def _make_state(size_mb: int) -> dict:
+  num_layers = max(1, size_mb * 1024 ** 2 // (LAYER_SIZE * LAYER_SIZE * 4))
+  return {f'module.layers.{i}.weight': torch.randn(LAYER_SIZE, LAYER_SIZE) for i in range(num_layers)}
+
+def _read_into_memory(path: str) -> dict:
+  checkpoint = torch.load(path, map_location='cpu', weights_only=False)
+  state = checkpoint.get('model', checkpoint)
+  return {k[len('module.'):] if k.startswith('module.') else k: v for k, v in state.items()}
+
+def _copy_into(state: dict, target: dict, device: torch.device) -> None:
+  # Stands in for load_state_dict, copying every tensor into preallocated parameters
+  for k, v in state.items():
+    if k not in target:
+      target[k] = torch.empty(v.shape, dtype=v.dtype, device=device)
+    target[k].copy_(v)
+
+# glibc keeps the freed tensors of a load in its heap, where they'd hide the next load's memory
+def _trim_heap() -> None:
+  ctypes.CDLL('libc.so.6').malloc_trim(0)
+
+def _load(load, path: str, target: dict, device: torch.device) -> None:
+  _copy_into(load(path), target, device)
+  _trim_heap()
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--size-mb', type=int, default=900)
+  parser.add_argument('--checkpoint', default=None)
+  parser.add_argument('--repeats', type=int, default=3)
+  parser.add_argument('--device', default='cpu')
+  parser.add_argument('--output', default=None)
+  args = parser.parse_args()
+
+  device = torch.device(args.device)
+  with tempfile.TemporaryDirectory() as root:
+    path = args.checkpoint
+    if path is None:
+      path = os.path.join(root, 'checkpoint.pt')
+      torch.save({'model': _make_state(args.size_mb)}, path)
+
+    target = {}
+    results = {
+      'read into memory': harness.measure(lambda: _load(_read_into_memory, path, target, device), repeats=args.repeats, device=device, anonymous=True),
+      'memory-mapped': harness.measure(lambda: _load(load_checkpoint, path, target, device), repeats=args.repeats, device=device, anonymous=True),
+    }
+
+  harness.print_results('checkpoint loading', results)
+  if args.output:
+    harness.save_results(args.output, 'checkpoint_load', results, {'checkpoint': args.checkpoint, 'size_mb': os.path.getsize(path) / 1024 ** 2 if args.checkpoint else args.size_mb})
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,93 @@
+# Runs the client's batch mode (client/src/batch.py) on synthetic scans against the local
+# storage fake and the mock endpoint: one scan at a time, like the single-scan client, and
+# with many scans in flight. Then interrupts a batch part way and resumes it from its results
+# file, checking that every scan finishes exactly once. The client's own dependencies
+# (runpod, supabase, python-dotenv) must be installed.
+#
+#   cd server && python -m bench.client_batch --scans 32 --in-flight 16 --mock-workers 8
+import os
+import sys
+import json
+import asyncio
+import argparse
+import tempfile
+
+from . import harness, synthetic
+from .storage import LocalClient
+from .client_upload import CLIENT_SRC_P
+
+def _import_batch():
+  # The client's run module shares its name with the server's, the client folder goes first
+  sys.path.insert(0, CLIENT_SRC_P)
+  sys.modules.pop('run', None)
+  import batch
+  return batch
+
+def _read_records(path: str) -> list[dict]:
+  with open(path, 'r') as f:
+    return [json.loads(line) for line in f]
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--scans', type=int, default=32)
+  parser.add_argument('--views', type=int, default=6)
+  parser.add_argument('--in-flight', type=int, default=16)
+  parser.add_argument('--mock-workers', type=int, default=8, help='jobs the mock endpoint runs at once')
+  parser.add_argument('--mock-duration', type=float, default=0.5, help='mean seconds per job')
+  parser.add_argument('--latency', type=float, default=0.02, help='simulated storage round trip in seconds')
+  parser.add_argument('--poll-interval', type=float, default=0.1)
+  parser.add_argument('--repeats', type=int, default=1)
+  parser.add_argument('--output', default=None)
+  args = parser.parse_args()
+
+  batch = _import_batch()
+  batch.POLL_INTERVAL = args.poll_interval
+  batch.MAX_POLL_INTERVAL = args.poll_interval * 8
+
+  with tempfile.TemporaryDirectory() as root:
+    scans_p = os.path.join(root, 'scans')
+    for i in range(args.scans):
+      synthetic.write_scan_folder(os.path.join(scans_p, f'scan{i:04d}'), args.views, (480, 640), seed=i)
+
+    batch.client.supabase = LocalClient(os.path.join(root, 'storage'), args.latency)
+    batch.client.SUPABASE_SOURCE_BUCKET_ID = batch.client.SUPABASE_SOURCE_BUCKET_ID or 'source'
+
+    counter = iter(range(1 << 30))
+    def run_batch(in_flight: int) -> dict:
+      endpoint = batch.MockEndpoint(batch.make_mock_handler(args.mock_duration), args.mock_workers)
+      runner = batch.BatchRunner(endpoint, os.path.join(root, f'results{next(counter)}.jsonl'), in_flight)
+      return asyncio.run(runner.run(scans_p))
+
+    results = {
+      'one at a time': harness.measure(lambda: run_batch(1), repeats=args.repeats, warmup=0, items=args.scans),
+      f'{args.in_flight} in flight': harness.measure(lambda: run_batch(args.in_flight), repeats=args.repeats, warmup=0, items=args.scans),
+    }
+
+    # Interrupt a batch half way through, then resume it with the same endpoint
+    output_p = os.path.join(root, 'interrupted.jsonl')
+    interrupt_s = results[f'{args.in_flight} in flight']['latency_ms']['p50'] / 1000 / 2
+    async def interrupted() -> dict:
+      endpoint = batch.MockEndpoint(batch.make_mock_handler(args.mock_duration), args.mock_workers)
+      try:
+        await asyncio.wait_for(batch.BatchRunner(endpoint, output_p, args.in_flight).run(scans_p), interrupt_s)
+      except asyncio.TimeoutError:
+        pass
+      finished = sum(r['event'] == 'completed' for r in _read_records(output_p))
+      return {'finished_before_interruption': finished, **await batch.BatchRunner(endpoint, output_p, args.in_flight).run(scans_p)}
+
+    resume = asyncio.run(interrupted())
+    records = _read_records(output_p)
+    completed = [r['scan'] for r in records if r['event'] == 'completed']
+    resume['submissions'] = sum(r['event'] == 'submitted' for r in records)
+    resume['finished_once'] = len(completed) == len(set(completed)) == args.scans
+
+  harness.print_results(f'client batch ({args.scans} scans, {args.mock_workers} mock workers)', results)
+  print(f'resume: {resume}')
+
+  if args.output:
+    config = {k: v for k, v in vars(args).items() if k != 'output'}
+    config['resume'] = resume
+    harness.save_results(args.output, 'client_batch', results, config)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,77 @@
+# Times the client upload of a scan against the local storage fake over a simulated uplink:
+# one file at a time (the previous behaviour), concurrent uploads, concurrent uploads of images
+# re-encoded at the server's target resolution and a repeated upload which skips every file.
+# Every upload is followed by the bulk cleanup. The client's own dependencies (runpod, supabase, python-dotenv) must be installed.
+#
+#   cd server && python -m bench.client_upload --views 30 --latency 0.05 --bandwidth 1e6
+import os
+import sys
+import argparse
+import tempfile
+import importlib.util
+
+from . import harness, synthetic
+from .storage import LocalClient
+
+CLIENT_SRC_P = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'client', 'src')
+
+def _import_client():
+  # The client's run module shares its name with the server's, so it's loaded from its path
+  sys.path.insert(0, CLIENT_SRC_P)
+  spec = importlib.util.spec_from_file_location('client_run', os.path.join(CLIENT_SRC_P, 'run.py'))
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  return module
+
+def _folder_bytes(bucket, folder_path: str) -> int:
+  return sum(f['metadata']['size'] for f in bucket.list(folder_path, {'limit': 10000}))
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--views', type=int, default=30)
+  parser.add_argument('--repeats', type=int, default=3)
+  parser.add_argument('--latency', type=float, default=0.05, help='simulated round trip in seconds')
+  parser.add_argument('--bandwidth', type=float, default=1e6, help='simulated uplink in bytes per second')
+  parser.add_argument('--concurrency', type=int, default=8)
+  parser.add_argument('--output', default=None)
+  args = parser.parse_args()
+
+  client = _import_client()
+
+  with tempfile.TemporaryDirectory() as root:
+    scan_p = os.path.join(root, 'scan')
+    synthetic.write_scan_folder(scan_p, args.views)
+
+    client.supabase = LocalClient(os.path.join(root, 'storage'), args.latency, args.bandwidth)
+    client.SUPABASE_SOURCE_BUCKET_ID = client.SUPABASE_SOURCE_BUCKET_ID or 'source'
+    bucket = client._get_source_bucket()
+
+    results, config = {}, {}
+    counter = iter(range(1 << 30))
+    def measure(name: str, resize: bool, concurrency: int) -> None:
+      def call():
+        id = f'{name}-{next(counter)}'
+        paths = client.upload_data(scan_p, id, resize, concurrency)
+        config[f'{name} bytes'] = _folder_bytes(bucket, f'tasks/{id}/')
+        client.cleanup_data(id, paths)
+      results[name] = harness.measure(call, repeats=args.repeats, warmup=0, items=args.views)
+
+    measure('sequential', False, 1)
+    measure('concurrent', False, args.concurrency)
+    measure('concurrent + resize', True, args.concurrency)
+
+    # A retried upload of the same task finds every file in place
+    paths = client.upload_data(scan_p, 'repeat', True, args.concurrency)
+    results['repeat (all skipped)'] = harness.measure(lambda: client.upload_data(scan_p, 'repeat', True, args.concurrency), repeats=args.repeats, items=args.views)
+    client.cleanup_data('repeat', paths)
+
+  harness.print_results(f'client upload ({args.views} views, {args.latency * 1000:.0f} ms, {args.bandwidth / 1e6:.1f} MB/s)', results)
+  for key, value in config.items():
+    print(f'{key:>32}: {value / 1e6:.2f} MB')
+
+  if args.output:
+    config.update({k: v for k, v in vars(args).items() if k != 'output'})
+    harness.save_results(args.output, 'client_upload', results, config)
+
+if __name__ == '__main__':
+  main()
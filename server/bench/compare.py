@@ -0,0 +1,74 @@
+# Diffs two saved benchmark results and flags the entries which got slower, have a lower
+# throughput or a higher peak memory by more than the threshold. Exits with 1 on regressions.
+#
+#   cd server && python -m bench.compare results/baseline.json results/candidate.json --threshold 0.1
+import sys
+import argparse
+
+from . import harness
+
+# (metric, getter, True if higher is better)
+METRICS = [
+  ('p50 ms', lambda r: r['latency_ms']['p50'], False),
+  ('p95 ms', lambda r: r['latency_ms']['p95'], False),
+  ('throughput', lambda r: r['throughput'], True),
+  ('peak rss mb', lambda r: r['peak_rss_mb'], False),
+  ('peak device mb', lambda r: r.get('peak_device_mb'), False),
+]
+
+# Memory deltas and latencies below these are sampling and timer noise
+MIN_MEMORY_MB = 1.0
+MIN_LATENCY_MS = 1.0
+
+def _is_regression(name: str, base: float, new: float, higher_is_better: bool, threshold: float, too_fast: bool) -> bool:
+  if 'mb' in name:
+    if max(base, new) < MIN_MEMORY_MB:
+      return False
+  elif too_fast:
+    return False
+
+  change = (new - base) / base if base else 0.0
+  return change < -threshold if higher_is_better else change > threshold
+
+def compare(baseline: dict, candidate: dict, threshold: float) -> list[str]:
+  regressions = []
+  for key, new in candidate['results'].items():
+    base = baseline['results'].get(key)
+    if base is None or 'latency_ms' not in new or 'latency_ms' not in base:
+      continue
+
+    too_fast = max(base['latency_ms']['p50'], new['latency_ms']['p50']) < MIN_LATENCY_MS
+    cells = []
+    for name, get, higher_is_better in METRICS:
+      b, n = get(base), get(new)
+      if b is None or n is None:
+        continue
+
+      change = (n - b) / b * 100.0 if b else 0.0
+      flag = _is_regression(name, b, n, higher_is_better, threshold, too_fast)
+      cells.append(f"{name} {b:.2f} -> {n:.2f} ({change:+.1f}%){' !' if flag else ''}")
+      if flag:
+        regressions.append(f'{key}: {name}')
+
+    print(f"{key:>32}: " + ', '.join(cells))
+
+  missing = sorted(set(baseline['results']) - set(candidate['results']))
+  if missing:
+    print(f"missing from the candidate: {', '.join(missing)}")
+
+  return regressions
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument('baseline')
+  parser.add_argument('candidate')
+  parser.add_argument('--threshold', type=float, default=0.1, help='relative change counted as a regression')
+  args = parser.parse_args()
+
+  regressions = compare(harness.load_results(args.baseline), harness.load_results(args.candidate), args.threshold)
+  if regressions:
+    print(f"{len(regressions)} regressions: {', '.join(regressions)}")
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,124 @@
+# Measures the per-stage CPU latency of a scan in every precision of detail.cpu and checks the
+# outputs against fp32: the mean SNU normal angle against MAX_NORMAL_ERROR_DEG and the SAM2
+# mask IoU against MIN_MASK_IOU. FOUND always runs in fp32 and is reported for the breakdown.
+# Runs stub models (bench.stubs) unless --no-stub is given, which loads the real checkpoints
+# the way the handler does.
+#
+#   cd server && python -m bench.cpu_inference --views 8 --threads 4 8 --output results/cpu.json
+import copy
+import argparse
+import torch
+import numpy as np
+
+from . import harness, synthetic
+from .stubs import StubNNET, StubSAM2Encoder, StubSAM2Predictor, StubFOUND
+
+harness.setup_paths()
+
+import snu, sam, run
+from data import parse_arkit
+from detail.cpu import PRECISIONS, MAX_NORMAL_ERROR_DEG, MIN_MASK_IOU, configure_threads, prepare_model, normal_error_deg, mask_iou
+
+# Loads the fp32 models, which every precision is prepared from, and returns the FOUND module
+def _init_models(args, device: torch.device, plan):
+  snu_args = snu.SNUArgs(
+    root_p=run.SNU_P, weights_file_name=run.SNU_WEIGHTS, sampling_ratio=0.4, importance_ratio=0.7,
+    device=device, image_size=plan.model_size, precision='fp32',
+  )
+  sam_args = sam.SAM2Args(
+    root_p=run.SAM2_P, weights_file_name=run.SAM2_WEIGHTS, cfg_file_name=run.SAM2_CONFIG,
+    device=device, batch_size=8, precision='fp32',
+  )
+
+  if args.stub:
+    snu.model_args, sam.model_args = snu_args, sam_args
+    snu.model = StubNNET().eval()
+    sam.model = StubSAM2Predictor(StubSAM2Encoder().eval())
+    return StubFOUND(args.found_epochs, tuple(int(x) for x in plan.found_size[::-1]))
+
+  import found
+  snu.init_model(snu_args)
+  sam.init_predictor(sam_args)
+  found.init_renderer(found.FOUNDArgs(root_p=run.FOUND_P, find_dir=run.FIND_DIR, device=device, image_size=np.array(plan.found_size[::-1])))
+  return found
+
+def _set_snu(base, precision: str) -> None:
+  snu.model_args.precision = precision
+  snu.model = prepare_model(copy.deepcopy(base), precision)
+
+def _set_sam(base, precision: str) -> None:
+  sam.model_args.precision = precision
+  if isinstance(base, StubSAM2Predictor):
+    sam.model = StubSAM2Predictor(prepare_model(copy.deepcopy(base.encoder), precision))
+  else:
+    sam.model = sam.SAM2ImagePredictor(prepare_model(copy.deepcopy(base.model), precision))
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--views', type=int, default=8)
+  parser.add_argument('--quality', default='low', help='resolution quality, see detail.resolution')
+  parser.add_argument('--snu-precisions', nargs='+', default=['fp32', 'bf16'], choices=PRECISIONS)
+  parser.add_argument('--sam-precisions', nargs='+', default=['fp32', 'bf16', 'int8'], choices=PRECISIONS)
+  parser.add_argument('--threads', type=int, nargs='+', default=[torch.get_num_threads()], help='intra-op thread counts')
+  parser.add_argument('--interop-threads', type=int, default=None)
+  parser.add_argument('--repeats', type=int, default=3)
+  parser.add_argument('--found-epochs', type=int, default=50, help='iterations of the stub fit')
+  parser.add_argument('--stub', action=argparse.BooleanOptionalAction, default=True)
+  parser.add_argument('--output', default=None)
+  args = parser.parse_args()
+
+  # The inter-op count can only be set before the first parallel work
+  configure_threads(inter_op=args.interop_threads)
+
+  device = torch.device('cpu')
+  plan = run.plan_resolutions(args.quality)
+  found_model = _init_models(args, device, plan)
+  base_snu, base_sam = snu.model, sam.model
+
+  images = synthetic.make_images(args.views, plan.model_size)
+  predictions = synthetic.make_predictions(args.views, plan.model_size)
+  source_arkit = parse_arkit(synthetic.arkit_content(synthetic.make_arkit(args.views)))
+
+  results, checks = {}, {}
+  for threads in args.threads:
+    configure_threads(threads)
+
+    _set_snu(base_snu, 'fp32')
+    reference_norms = snu.process(images)['norm']
+    for precision in args.snu_precisions:
+      _set_snu(base_snu, precision)
+      outputs = []
+      results[f'snu {precision} x{threads}'] = harness.measure(
+        lambda: outputs.append(snu.process(images)['norm']), repeats=args.repeats, items=args.views
+      )
+      error = normal_error_deg(reference_norms, outputs[-1])
+      checks[f'snu {precision} x{threads}'] = {'normal_error_deg': error, 'passed': error <= MAX_NORMAL_ERROR_DEG}
+
+    _set_sam(base_sam, 'fp32')
+    reference_masks = sam.process(images)
+    for precision in args.sam_precisions:
+      _set_sam(base_sam, precision)
+      outputs = []
+      results[f'sam {precision} x{threads}'] = harness.measure(
+        lambda: outputs.append(sam.process(images)), repeats=args.repeats, items=args.views
+      )
+      iou = mask_iou(reference_masks, outputs[-1])
+      checks[f'sam {precision} x{threads}'] = {'mask_iou': iou, 'passed': iou >= MIN_MASK_IOU}
+
+    # The real fit takes long enough without a warmup call
+    results[f'found fp32 x{threads}'] = harness.measure(
+      lambda: found_model.process(predictions, source_arkit), repeats=1, warmup=int(args.stub), items=args.views
+    )
+
+  harness.print_results(f'cpu inference ({args.views} views, {args.quality} quality)', results)
+  for name, check in checks.items():
+    value = f"normal error {check['normal_error_deg']:.3f} deg" if 'normal_error_deg' in check else f"mask iou {check['mask_iou']:.4f}"
+    print(f"{name:>32}: {value}  {'pass' if check['passed'] else 'FAIL'}")
+
+  if args.output:
+    config = {k: v for k, v in vars(args).items() if k != 'output'}
+    config.update(model_size=list(plan.model_size), found_size=list(plan.found_size), checks=checks)
+    harness.save_results(args.output, 'cpu_inference', results, config)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,86 @@
+# Checks the fetch engine (detail.fetch) against the local storage fake: listings of more files
+# than a page, retries with exponential backoff on failing downloads, giving up once the retries
+# run out and the output order under random download latencies. Raises on the first failure.
+#
+#   cd server && python -m bench.fetch_check --views 60
+import time
+import random
+import argparse
+import tempfile
+from PIL import Image
+from io import BytesIO
+
+from . import harness, synthetic
+from .storage import LocalClient
+
+harness.setup_paths()
+
+from detail.fetch import FetchArgs, LIST_PAGE_SIZE, fetch_assets, list_image_names, list_task_files
+
+# Fails the first `failures` downloads of every path and delays the others randomly
+class _FlakyBucket:
+  def __init__(self, bucket, failures: int = 0, max_delay: float = 0.0):
+    self.bucket = bucket
+    self.failures = failures
+    self.max_delay = max_delay
+    self.attempts: dict[str, int] = {}
+
+  def list(self, path: str, options: dict = None) -> list[dict]:
+    return self.bucket.list(path, options)
+
+  def download(self, path: str) -> bytes:
+    self.attempts[path] = self.attempts.get(path, 0) + 1
+    if self.attempts[path] <= self.failures:
+      raise Exception(f'simulated failure {self.attempts[path]} of {path}')
+
+    time.sleep(random.uniform(0, self.max_delay))
+    return self.bucket.download(path)
+
+def _decode(data: bytes):
+  return Image.open(BytesIO(data))
+
+def _check(condition: bool, message: str) -> None:
+  if not condition:
+    raise Exception(f'fetch check failed: {message}')
+  print(f'ok: {message}')
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--views', type=int, default=60, help='an image and a sidecar each, more than a listing page')
+  args = parser.parse_args()
+
+  folder = 'tasks/check/'
+  with tempfile.TemporaryDirectory() as root:
+    bucket = LocalClient(root, 0.0).storage.from_('source')
+    synthetic.write_scan(bucket, 'check', args.views, size=(64, 48))
+
+    files = list_task_files(bucket, folder)
+    image_names = list_image_names(files)
+    _check(len(files) == 2 * args.views, f'all {2 * args.views} files are listed over pages of {LIST_PAGE_SIZE}')
+
+    # Every download fails twice and succeeds on the third attempt, after backoffs of 10 and 20 ms
+    flaky = _FlakyBucket(bucket, failures=2, max_delay=0.01)
+    fetch_args = FetchArgs(concurrency=8, retries=2, backoff=0.01, max_backoff=0.02)
+    start = time.perf_counter()
+    images, arkit = fetch_assets(flaky, folder, _decode, fetch_args)
+    elapsed = time.perf_counter() - start
+
+    _check(all(n == 3 for n in flaky.attempts.values()), 'every download is retried until it succeeds')
+    _check(elapsed >= 0.03 * len(flaky.attempts) / fetch_args.concurrency, 'the retries back off')
+
+    # The output follows the sorted image names, whatever order the downloads finish in
+    expected = [bucket.download(folder + name) for name in image_names]
+    _check(len(images) == len(image_names), 'every image is fetched')
+    _check(all(image.tobytes() == _decode(data).tobytes() for image, data in zip(images, expected)), 'the images are in sorted name order')
+    _check([name for name, _ in arkit] == [name.rsplit('.', 1)[0] + '.json' for name in image_names], 'the sidecars are in the order of the images')
+
+    # One failure more than the retries allow
+    try:
+      fetch_assets(_FlakyBucket(bucket, failures=3), folder, _decode, FetchArgs(retries=2, backoff=0.001))
+      failed = False
+    except Exception:
+      failed = True
+    _check(failed, 'a download failing more often than the retries allow raises')
+
+if __name__ == '__main__':
+  main()
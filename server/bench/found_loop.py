@@ -0,0 +1,82 @@
+# Compares the FOUND optimisation loop settings of found.FOUNDArgs against the eager loop
+# (PyTorch's default Adam, the losses read back every iteration, fp32): the time per iteration
+# and the largest keypoint, vertex and foot length deviation from the eager fit. Early stopping
+# is off by default so that every setting runs the same iterations. The first call of every
+# setting is an untimed warmup, which includes the torch.compile time.
+# Needs the FOUND checkout and the FIND weights.
+#
+#   cd server && python -m bench.found_loop --views 12 --epochs 100 --output results/found_loop.json
+import argparse
+import torch
+
+from . import harness
+from .found_multitask import make_tasks, _max_deviation
+
+harness.setup_paths()
+
+import found
+from detail.measure import calc_size
+from detail.config import FOUND_IMAGE_SIZE
+
+SETTINGS = {
+  'eager': dict(fused_adam=False, sync_interval=1),
+  'fused adam': dict(sync_interval=1),
+  'fused adam, sync every 10': dict(sync_interval=10),
+  'fused adam, sync every 10, bf16': dict(sync_interval=10, precision='bf16'),
+  'fused adam, sync every 10, compiled': dict(sync_interval=10, compile=True),
+}
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--tasks', type=int, default=1, help='tasks fitted together')
+  parser.add_argument('--views', type=int, default=12)
+  parser.add_argument('--prediction-size', type=int, nargs=2, default=[480, 640], help='prediction size (W, H)')
+  parser.add_argument('--epochs', type=int, default=100)
+  parser.add_argument('--early-stopping', action='store_true', help='stop the stages once the loss plateaus')
+  parser.add_argument('--settings', nargs='+', default=list(SETTINGS), choices=list(SETTINGS))
+  parser.add_argument('--repeats', type=int, default=3)
+  parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+  parser.add_argument('--found-root', default='/app/FOUND')
+  parser.add_argument('--output', default=None)
+  args = parser.parse_args()
+
+  device = torch.device(args.device)
+  stages = [
+    stage._replace(num_epochs=args.epochs, patience=found.EARLY_STOPPING_PATIENCE if args.early_stopping else None)
+    for stage in found.STAGES
+  ]
+  tasks = make_tasks(args.tasks, args.views, tuple(args.prediction_size))
+
+  results, reference = {}, None
+  for name in args.settings:
+    found.init_renderer(found.FOUNDArgs(
+      root_p=args.found_root, find_dir='data/find_nfap', device=device, image_size=FOUND_IMAGE_SIZE, **SETTINGS[name]
+    ))
+    found.STAGES = stages
+
+    outputs = []
+    result = harness.measure(lambda: outputs.append(found.process_many(tasks)), repeats=args.repeats, items=args.tasks, device=device)
+
+    fits = outputs[-1]
+    reference = reference or fits
+    iterations = sum(stats['iterations'] for _, _, stats in fits) / len(fits)
+    result['iterations'] = iterations
+    result['ms_per_iteration'] = result['latency_ms']['p50'] / iterations
+    result['final_loss'] = [stats['final_loss'] for _, _, stats in fits]
+    result['max_foot_length_difference'] = max(abs(calc_size(kps) - calc_size(ref_kps)) for (_, kps, _), (_, ref_kps, _) in zip(fits, reference))
+    result.update(_max_deviation(reference, fits))
+    results[name] = result
+
+  harness.print_results(f'found loop ({args.tasks} tasks, {args.views} views, {args.epochs} epochs)', results)
+  for name, r in results.items():
+    print(
+      f"{name:>32}: {r['ms_per_iteration']:.2f} ms/iteration, max vertex deviation {r['max_vertex_deviation']:.2e}, "
+      f"max foot length difference {r['max_foot_length_difference']:.4f}"
+    )
+
+  if args.output:
+    config = {k: v for k, v in vars(args).items() if k != 'output'}
+    harness.save_results(args.output, 'found_loop', results, config)
+
+if __name__ == '__main__':
+  main()
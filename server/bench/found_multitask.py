@@ -0,0 +1,87 @@
+# Compares fitting K tasks one after another with fitting them together in one optimisation loop.
+# Reports the latency of both modes and the largest keypoint, vertex and foot length deviation
+# between them, and raises if the vertices or the foot length of process_many differ from the ones
+# of process by more than the tolerances. Needs the FOUND checkout and the FIND weights.
+#
+#   cd server && python -m bench.found_multitask --tasks 1 2 4 --views 12 --epochs 50
+import argparse
+import torch
+
+from . import harness, synthetic
+
+harness.setup_paths()
+
+import found
+from detail.measure import calc_size
+from detail.config import FOUND_IMAGE_SIZE
+from data import parse_arkit
+
+def make_tasks(num_tasks: int, num_views: int, size: tuple[int, int]) -> list:
+  tasks = []
+  for seed in range(num_tasks):
+    source_arkit = parse_arkit(synthetic.arkit_content(synthetic.make_arkit(num_views, seed=seed)))
+    tasks.append((synthetic.make_predictions(num_views, size, seed=seed), source_arkit))
+
+  return tasks
+
+def _max_deviation(sequential: list, batched: list) -> dict:
+  kp_dev, vert_dev, length_dev = 0.0, 0.0, 0.0
+  for (seq_mesh, seq_kps, _), (bat_mesh, bat_kps, _) in zip(sequential, batched):
+    for label in seq_kps:
+      kp_dev = max(kp_dev, float(torch.tensor(seq_kps[label]).sub(torch.tensor(bat_kps[label])).abs().max()))
+    vert_dev = max(vert_dev, float((seq_mesh.verts_padded() - bat_mesh.verts_padded()).abs().max()))
+    length_dev = max(length_dev, abs(calc_size(seq_kps) - calc_size(bat_kps)))
+
+  return {'max_keypoint_deviation': kp_dev, 'max_vertex_deviation': vert_dev, 'max_foot_length_deviation': length_dev}
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--tasks', type=int, nargs='+', default=[1, 2, 4])
+  parser.add_argument('--views', type=int, default=12)
+  parser.add_argument('--prediction-size', type=int, nargs=2, default=[480, 640], help='prediction size (W, H)')
+  parser.add_argument('--epochs', type=int, default=50)
+  parser.add_argument('--repeats', type=int, default=1)
+  parser.add_argument('--vertex-tolerance', type=float, default=1e-5, help='largest vertex deviation in meters')
+  parser.add_argument('--length-tolerance', type=float, default=1e-4, help='largest foot length deviation in meters')
+  parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+  parser.add_argument('--found-root', default='/app/FOUND')
+  parser.add_argument('--output', default=None)
+  args = parser.parse_args()
+
+  device = torch.device(args.device)
+  found.init_renderer(found.FOUNDArgs(root_p=args.found_root, find_dir='data/find_nfap', device=device, image_size=FOUND_IMAGE_SIZE))
+  found.STAGES = [stage._replace(num_epochs=args.epochs) for stage in found.STAGES]
+
+  results = {}
+  for num_tasks in args.tasks:
+    tasks = make_tasks(num_tasks, args.views, tuple(args.prediction_size))
+
+    outputs = {}
+    def sequential():
+      outputs['sequential'] = [found.process(*task) for task in tasks]
+    def batched():
+      outputs['batched'] = found.process_many(tasks)
+
+    results[f'{num_tasks} tasks sequential'] = harness.measure(sequential, repeats=args.repeats, warmup=0, items=num_tasks, device=device)
+    results[f'{num_tasks} tasks batched'] = harness.measure(batched, repeats=args.repeats, warmup=0, items=num_tasks, device=device)
+    results[f'{num_tasks} tasks batched'].update(_max_deviation(outputs['sequential'], outputs['batched']))
+
+  harness.print_results('found multi-task', results)
+  for key, r in results.items():
+    if 'max_keypoint_deviation' in r:
+      print(
+        f"{key:>32}: max keypoint deviation {r['max_keypoint_deviation']:.2e}, max vertex deviation {r['max_vertex_deviation']:.2e}, "
+        f"max foot length deviation {r['max_foot_length_deviation']:.2e}"
+      )
+
+  if args.output:
+    harness.save_results(args.output, 'found_multitask', results)
+
+  for key, r in results.items():
+    if r.get('max_vertex_deviation', 0.0) > args.vertex_tolerance:
+      raise Exception(f"{key}: vertex deviation {r['max_vertex_deviation']:.2e} exceeds {args.vertex_tolerance:.2e}")
+    if r.get('max_foot_length_deviation', 0.0) > args.length_tolerance:
+      raise Exception(f"{key}: foot length deviation {r['max_foot_length_deviation']:.2e} exceeds {args.length_tolerance:.2e}")
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,77 @@
+# Compares FOUND fits with the losses evaluated on every pixel against losses on sampled tiles of
+# pixels, which are the only pixels rendered between importance updates (found.FOUNDArgs.sampling_ratio):
+# the time per iteration, the iterations used and the foot length difference against the full
+# fit, which has to stay within --tolerance.
+# Needs the FOUND checkout and the FIND weights.
+#
+#   cd server && python -m bench.found_sampling --scans 3 --views 12 --ratios 0.05 0.1 0.25
+import argparse
+import torch
+
+from . import harness
+from .found_multitask import make_tasks
+
+harness.setup_paths()
+
+import found
+from detail.measure import calc_size
+from detail.config import FOUND_IMAGE_SIZE
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--scans', type=int, default=3)
+  parser.add_argument('--views', type=int, default=12)
+  parser.add_argument('--prediction-size', type=int, nargs=2, default=[480, 640], help='prediction size (W, H)')
+  parser.add_argument('--ratios', type=float, nargs='+', default=[0.05, 0.1, 0.25], help='sampled fractions of the pixels')
+  parser.add_argument('--importance-ratio', type=float, default=0.7)
+  parser.add_argument('--sample-refresh', type=int, default=5)
+  parser.add_argument('--tolerance', type=float, default=0.002, help='largest foot length difference in meters')
+  parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+  parser.add_argument('--found-root', default='/app/FOUND')
+  parser.add_argument('--output', default=None)
+  args = parser.parse_args()
+
+  device = torch.device(args.device)
+  scans = make_tasks(args.scans, args.views, tuple(args.prediction_size))
+  stages = found.STAGES
+
+  results, reference = {}, None
+  for ratio in [None] + args.ratios:
+    found.init_renderer(found.FOUNDArgs(
+      root_p=args.found_root, find_dir='data/find_nfap', device=device, image_size=FOUND_IMAGE_SIZE,
+      sampling_ratio=ratio, importance_ratio=args.importance_ratio, sample_refresh=args.sample_refresh,
+    ))
+    found.STAGES = stages
+
+    torch.manual_seed(0)
+    outputs = []
+    result = harness.measure(
+      lambda: outputs.append([found.process(*scan) for scan in scans]),
+      repeats=1, warmup=0, items=len(scans), device=device
+    )
+
+    fits = outputs[-1]
+    sizes = [calc_size(kps) for _, kps, _ in fits]
+    reference = reference or sizes
+
+    iterations = sum(stats['iterations'] for _, _, stats in fits)
+    result['iterations'] = [stats['iterations'] for _, _, stats in fits]
+    result['ms_per_iteration'] = result['latency_ms']['p50'] / iterations
+    result['foot_length'] = sizes
+    result['max_foot_length_difference'] = max(abs(a - b) for a, b in zip(sizes, reference))
+    result['within_tolerance'] = result['max_foot_length_difference'] <= args.tolerance
+    results['all pixels' if ratio is None else f'{ratio:.0%} of the pixels'] = result
+
+  harness.print_results(f'found pixel sampling ({args.scans} scans, {args.views} views)', results)
+  for name, r in results.items():
+    print(
+      f"{name:>32}: {r['ms_per_iteration']:.2f} ms/iteration, iterations {r['iterations']}, "
+      f"max foot length difference {r['max_foot_length_difference']:.4f} {'pass' if r['within_tolerance'] else 'FAIL'}"
+    )
+
+  if args.output:
+    config = {k: v for k, v in vars(args).items() if k != 'output'}
+    harness.save_results(args.output, 'found_sampling', results, config)
+
+if __name__ == '__main__':
+  main()
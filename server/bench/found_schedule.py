@@ -0,0 +1,73 @@
+# Compares FOUND stage schedules on synthetic scans: the fixed 250 iteration budget, loss-plateau
+# early stopping and early stopping with a coarse-to-fine resolution pyramid. Reports latency,
+# iterations used, final loss and the foot length difference against the fixed schedule, which
+# has to stay within --tolerance before early stopping (FOUND_EARLY_STOPPING) is enabled. Needs the FOUND checkout and the FIND weights.
+#
+#   cd server && python -m bench.found_schedule --scans 3 --views 12
+import argparse
+import torch
+
+from . import harness
+from .found_multitask import make_tasks
+
+harness.setup_paths()
+
+import found
+from detail.measure import calc_size
+from detail.config import FOUND_IMAGE_SIZE
+
+def _schedules(base: list) -> dict:
+  return {
+    'fixed': [stage._replace(patience=None, scales=(1.0,)) for stage in base],
+    'early stopping': [stage._replace(patience=found.EARLY_STOPPING_PATIENCE, scales=(1.0,)) for stage in base],
+    'coarse to fine': [stage._replace(patience=found.EARLY_STOPPING_PATIENCE, scales=(0.5, 1.0)) for stage in base],
+  }
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--scans', type=int, default=3)
+  parser.add_argument('--views', type=int, default=12)
+  parser.add_argument('--prediction-size', type=int, nargs=2, default=[480, 640], help='prediction size (W, H)')
+  parser.add_argument('--tolerance', type=float, default=0.002, help='largest foot length difference in meters')
+  parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+  parser.add_argument('--found-root', default='/app/FOUND')
+  parser.add_argument('--output', default=None)
+  args = parser.parse_args()
+
+  device = torch.device(args.device)
+  found.init_renderer(found.FOUNDArgs(root_p=args.found_root, find_dir='data/find_nfap', device=device, image_size=FOUND_IMAGE_SIZE))
+  scans = make_tasks(args.scans, args.views, tuple(args.prediction_size))
+
+  results, reference = {}, None
+  for name, stages in _schedules(found.STAGES).items():
+    found.STAGES = stages
+
+    outputs = []
+    result = harness.measure(
+      lambda: outputs.append([found.process(*scan) for scan in scans]),
+      repeats=1, warmup=0, items=len(scans), device=device
+    )
+
+    fits = outputs[-1]
+    sizes = [calc_size(kps) for _, kps, _ in fits]
+    reference = reference or sizes
+
+    result['iterations'] = [stats['iterations'] for _, _, stats in fits]
+    result['final_loss'] = [stats['final_loss'] for _, _, stats in fits]
+    result['foot_length'] = sizes
+    result['max_foot_length_difference'] = max(abs(a - b) for a, b in zip(sizes, reference))
+    result['within_tolerance'] = result['max_foot_length_difference'] <= args.tolerance
+    results[name] = result
+
+  harness.print_results('found schedule', results)
+  for name, r in results.items():
+    print(
+      f"{name:>32}: iterations {r['iterations']}, max foot length difference {r['max_foot_length_difference']:.4f} "
+      f"{'pass' if r['within_tolerance'] else 'FAIL'}"
+    )
+
+  if args.output:
+    harness.save_results(args.output, 'found_schedule', results)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,45 @@
+# Compares the per-request cost of constructing FIND from disk (the previous behaviour) with
+# taking a pooled instance reset from the cached device-resident template.
+# Needs the FOUND checkout and the FIND weights.
+#
+#   cd server && python -m bench.found_template --repeats 20
+import argparse
+import torch
+
+from . import harness
+
+harness.setup_paths()
+
+import found
+from detail.config import FOUND_IMAGE_SIZE
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--repeats', type=int, default=20)
+  parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+  parser.add_argument('--found-root', default='/app/FOUND')
+  parser.add_argument('--output', default=None)
+  args = parser.parse_args()
+
+  device = torch.device(args.device)
+  found_args = found.FOUNDArgs(root_p=args.found_root, find_dir='data/find_nfap', device=device, image_size=FOUND_IMAGE_SIZE)
+  found.init_renderer(found_args)
+
+  def cold():
+    model = found.FIND(found_args.find_weights_p, kp_labels=None, opt_posevec=True)
+    model.to(device)
+
+  def warm():
+    found._release_model(found._acquire_model())
+
+  results = {
+    'cold (load from disk)': harness.measure(cold, repeats=args.repeats, device=device),
+    'warm (reset from template)': harness.measure(warm, repeats=args.repeats, device=device),
+  }
+
+  harness.print_results('found template', results)
+  if args.output:
+    harness.save_results(args.output, 'found_template', results)
+
+if __name__ == '__main__':
+  main()
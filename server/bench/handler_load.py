@@ -0,0 +1,130 @@
+# Drives the serverless handler with synthetic jobs on CPU, the way a RunPod worker runs it with
+# HANDLER_CONCURRENCY: jobs arrive at --rate per second (all at once with 0), at most
+# `concurrency` of them are in the handler at a time and the rest queue. Scans are read from
+# the local storage fake, SNU and SAM2 are stub models and FOUND is a stub fit (bench.stubs).
+# Reports the throughput and the latency percentiles from arrival to response per concurrency
+# level, with the time the jobs waited for the device scheduler and the sizes of the batches
+# concurrent FOUND fits were coalesced into. Raises if any job fails.
+#
+#   cd server && python -m bench.handler_load --jobs 24 --concurrency 1 4 --rate 2
+import time
+import asyncio
+import argparse
+import tempfile
+import torch
+import numpy as np
+
+from . import harness, synthetic
+from .storage import LocalClient
+from .stubs import StubNNET, StubSAM2Predictor, StubFOUND
+
+harness.setup_paths()
+
+import data, snu, sam, run
+from detail.admission import DeviceScheduler, BatchedStage
+
+def _init_models(device: torch.device, plan, found_epochs: int) -> None:
+  snu.model_args = snu.SNUArgs(
+    root_p='', weights_file_name='synfoot_10k_gn.pt', sampling_ratio=0.4, importance_ratio=0.7,
+    device=device, image_size=plan.model_size,
+  )
+  snu.model = StubNNET().to(device).eval()
+
+  sam.model_args = sam.SAM2Args(root_p='', weights_file_name='', cfg_file_name='', device=device)
+  sam.model = StubSAM2Predictor()
+
+  stub_found = StubFOUND(found_epochs, tuple(int(x) for x in plan.found_size[::-1]))
+  run.models.submit('snu', lambda timer: snu)
+  run.models.submit('sam', lambda timer: sam)
+  run.models.submit('found', lambda timer: stub_found)
+  run.models.wait_all()
+
+async def _drive(num_jobs: int, num_tasks: int, concurrency: int, rate: float, seed: int = 0) -> dict:
+  rng = np.random.default_rng(seed)
+  arrivals = np.cumsum(rng.exponential(1 / rate, num_jobs)) if rate > 0 else np.zeros(num_jobs)
+
+  slots = asyncio.Semaphore(concurrency)
+  latencies, errors, waits = [], [], {}
+  loop = asyncio.get_running_loop()
+  start = loop.time()
+
+  async def job(i: int) -> None:
+    await asyncio.sleep(max(0.0, arrivals[i] - (loop.time() - start)))
+    arrived = time.perf_counter()
+    async with slots:
+      response = await run.async_runpod_handler({'id': f'job{i}', 'input': {'id': f'task{i % num_tasks}'}})
+
+    # A failed job returns early, its latency and throughput would flatter the handler
+    if response['status'] != 'completed':
+      errors.append(f"job{i}: {response.get('error')}")
+      return
+    latencies.append(time.perf_counter() - arrived)
+    for stage, w in response['metrics']['admission']['waits'].items():
+      waits[stage] = waits.get(stage, 0.0) + w['wait_s']
+
+  with harness.RSSSampler() as sampler:
+    await asyncio.gather(*(job(i) for i in range(num_jobs)))
+    wall_s = loop.time() - start
+
+  if errors:
+    raise Exception(f'{len(errors)} of {num_jobs} jobs failed at concurrency {concurrency}, first: {errors[0]}')
+
+  return {
+    'repeats': num_jobs,
+    'latency_ms': harness.summarize_latencies(latencies),
+    'throughput': num_jobs / wall_s,
+    'peak_rss_mb': sampler.peak_delta / 1024 ** 2,
+    'peak_device_mb': None,
+    'admission_wait_s': {stage: w / num_jobs for stage, w in waits.items()}, # per job
+  }
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--jobs', type=int, default=24)
+  parser.add_argument('--tasks', type=int, default=4, help='distinct scans the jobs cycle through')
+  parser.add_argument('--views', type=int, default=8)
+  parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4])
+  parser.add_argument('--rate', type=float, default=0.0, help='job arrivals per second, 0 submits all at once')
+  parser.add_argument('--latency', type=float, default=0.02, help='simulated storage round trip in seconds')
+  parser.add_argument('--quality', default='low', help='resolution quality, see detail.resolution')
+  parser.add_argument('--found-epochs', type=int, default=50)
+  parser.add_argument('--found-max-batch', type=int, default=4)
+  parser.add_argument('--mode', default='streaming', choices=['streaming', 'sequential'])
+  parser.add_argument('--output', default=None)
+  args = parser.parse_args()
+
+  device = torch.device('cpu')
+  plan = run.plan_resolutions(args.quality)
+  run.device = device
+  run.resolution = plan
+  run.PIPELINE_MODE = args.mode
+  run.SUPABASE_RESULT_BUCKET_ID = ''
+  _init_models(device, plan, args.found_epochs)
+
+  results = {}
+  with tempfile.TemporaryDirectory() as root:
+    data.supabase = LocalClient(root, args.latency)
+    data.init_decoder(plan.model_size)
+    for i in range(args.tasks):
+      synthetic.write_scan(data.get_source_bucket(), f'task{i}', args.views, seed=i)
+
+    try:
+      for concurrency in args.concurrency:
+        run.scheduler = DeviceScheduler()
+        run.found_batches = BatchedStage('found', run._process_found_batch, args.found_max_batch)
+        results[f'concurrency {concurrency}'] = r = asyncio.run(_drive(args.jobs, args.tasks, concurrency, args.rate))
+        r['scheduler'] = run.scheduler.stats()
+        r['found_batches'] = run.found_batches.stats()
+        print(f'concurrency {concurrency}: admission wait per job {r["admission_wait_s"]}, FOUND batches {r["found_batches"]}')
+    finally:
+      data.image_decoder.shutdown()
+
+  harness.print_results(f'handler load ({args.jobs} jobs, {args.views} views, rate {args.rate or "burst"})', results)
+
+  if args.output:
+    config = {k: v for k, v in vars(args).items() if k != 'output'}
+    config.update(model_size=list(plan.model_size), found_size=list(plan.found_size))
+    harness.save_results(args.output, 'handler_load', results, config)
+
+if __name__ == '__main__':
+  main()
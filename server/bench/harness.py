@@ -0,0 +1,142 @@
+import os
+import sys
+import json
+import time
+import platform
+import threading
+import torch
+import numpy as np
+from datetime import datetime
+
+SRC_P = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+# Makes the server modules importable when running the benchmarks from the server folder, every
+# benchmark calls it before importing them
+def setup_paths() -> None:
+  if SRC_P not in sys.path:
+    sys.path.insert(0, SRC_P)
+
+RSS_SAMPLING_INTERVAL = 0.005 # seconds
+
+# With `anonymous` only the private memory counts, not the file pages mapped into the process,
+# which the page cache can reclaim (e.g. memory-mapped checkpoints)
+def _get_rss(anonymous: bool = False) -> int:
+  if anonymous:
+    with open('/proc/self/status', 'r') as f:
+      return next(int(line.split()[1]) * 1024 for line in f if line.startswith('RssAnon:'))
+
+  with open('/proc/self/statm', 'r') as f:
+    return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+# Samples the resident set size in a background thread to find the peak of a single call
+class RSSSampler:
+  def __init__(self, anonymous: bool = False):
+    self.anonymous = anonymous
+    self.baseline = 0
+    self.peak = 0
+    self._stop = threading.Event()
+    self._thread = None
+
+  def _run(self) -> None:
+    while not self._stop.is_set():
+      self.peak = max(self.peak, _get_rss(self.anonymous))
+      time.sleep(RSS_SAMPLING_INTERVAL)
+
+  def __enter__(self) -> 'RSSSampler':
+    self.baseline = self.peak = _get_rss(self.anonymous)
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self._thread.start()
+    return self
+
+  def __exit__(self, *exc) -> None:
+    self._stop.set()
+    self._thread.join()
+    self.peak = max(self.peak, _get_rss(self.anonymous))
+
+  @property
+  def peak_delta(self) -> int:
+    return self.peak - self.baseline
+
+def _sync(device: torch.device) -> None:
+  if device is not None and torch.device(device).type == 'cuda':
+    torch.cuda.synchronize(device)
+
+def summarize_latencies(latencies: list[float]) -> dict:
+  ms = np.array(latencies) * 1000.0
+  return {
+    'mean': float(ms.mean()),
+    'p50': float(np.percentile(ms, 50)),
+    'p90': float(np.percentile(ms, 90)),
+    'p95': float(np.percentile(ms, 95)),
+    'p99': float(np.percentile(ms, 99)),
+    'min': float(ms.min()),
+    'max': float(ms.max()),
+  }
+
+# Calls `fn` `repeats` times after `warmup` untimed calls and reports the latency percentiles,
+# the throughput in items per second and the peak host/device memory of a single call, see
+# RSSSampler for `anonymous`
+def measure(fn, repeats: int = 5, warmup: int = 1, items: int = 1, device: torch.device = None, anonymous: bool = False) -> dict:
+  for _ in range(warmup):
+    fn()
+  _sync(device)
+
+  is_cuda = device is not None and torch.device(device).type == 'cuda'
+  latencies, peak_rss, peak_device = [], 0, 0
+  for _ in range(repeats):
+    if is_cuda:
+      torch.cuda.reset_peak_memory_stats(device)
+      device_baseline = torch.cuda.memory_allocated(device)
+
+    with RSSSampler(anonymous) as sampler:
+      start = time.perf_counter()
+      fn()
+      _sync(device)
+      latencies.append(time.perf_counter() - start)
+
+    peak_rss = max(peak_rss, sampler.peak_delta)
+    if is_cuda:
+      peak_device = max(peak_device, torch.cuda.max_memory_allocated(device) - device_baseline)
+
+  return {
+    'repeats': repeats,
+    'latency_ms': summarize_latencies(latencies),
+    'throughput': items * len(latencies) / sum(latencies),
+    'peak_rss_mb': peak_rss / 1024 ** 2,
+    'peak_device_mb': peak_device / 1024 ** 2 if is_cuda else None,
+  }
+
+def environment() -> dict:
+  return {
+    'timestamp': datetime.now().isoformat(),
+    'python': platform.python_version(),
+    'torch': torch.__version__,
+    'platform': platform.platform(),
+    'cpu_count': os.cpu_count(),
+    'cuda': torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+  }
+
+# Saves the results together with the environment and, optionally, the run parameters
+def save_results(path: str, name: str, results: dict, config: dict = None) -> None:
+  os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+  output = {'benchmark': name, 'environment': environment(), 'results': results}
+  if config is not None:
+    output['config'] = config
+
+  with open(path, 'w') as f:
+    json.dump(output, f, indent=2)
+
+def load_results(path: str) -> dict:
+  with open(path, 'r') as f:
+    return json.load(f)
+
+def print_results(name: str, results: dict) -> None:
+  print(f'# {name}')
+  for key, r in results.items():
+    latency = r['latency_ms']
+    device_mb = f"{r['peak_device_mb']:.1f}" if r.get('peak_device_mb') is not None else '-'
+    print(
+      f"{key:>32}: p50 {latency['p50']:9.2f} ms  p95 {latency['p95']:9.2f} ms  "
+      f"{r['throughput']:8.2f} it/s  rss +{r['peak_rss_mb']:.1f} MB  device {device_mb} MB"
+    )
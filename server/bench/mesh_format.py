@@ -0,0 +1,119 @@
+# Compares the fmsh result format with OBJ and binary PLY on a synthetic foot-sized mesh:
+# the encoded size, the encode and decode times and the largest vertex error. The fitted mesh
+# is the template with smooth offsets of a few millimetres, like a FOUND fit.
+#
+#   cd server && python -m bench.mesh_format --resolution 64 --output results/mesh_format.json
+import io
+import argparse
+import numpy as np
+
+from . import harness
+
+harness.setup_paths()
+
+from detail.mesh_codec import MeshTemplate, encode_mesh, decode_mesh
+
+FOOT_RADII = (0.13, 0.05, 0.04) # meters
+MAX_OFFSET = 0.005 # meters
+
+# A UV ellipsoid with `resolution` rings of 2 * `resolution` vertices
+def make_template(resolution: int) -> tuple[np.ndarray, np.ndarray]:
+  theta = np.linspace(0, np.pi, resolution + 2)[1:-1]
+  phi = np.linspace(0, 2 * np.pi, 2 * resolution, endpoint=False)
+  t, p = np.meshgrid(theta, phi, indexing='ij')
+  verts = np.stack([np.sin(t) * np.cos(p), np.sin(t) * np.sin(p), np.cos(t)], axis=-1).reshape(-1, 3)
+  verts = verts * np.array(FOOT_RADII)
+
+  ring = 2 * resolution
+  faces = []
+  for i in range(resolution - 1):
+    for j in range(ring):
+      a, b = i * ring + j, i * ring + (j + 1) % ring
+      c, d = a + ring, b + ring
+      faces += [(a, b, c), (b, d, c)]
+  return verts.astype(np.float32), np.array(faces, dtype=np.int32)
+
+def make_fit(verts: np.ndarray, seed: int = 0) -> np.ndarray:
+  rng = np.random.default_rng(seed)
+  frequencies = rng.uniform(5, 20, size=(3, 3))
+  offsets = np.sin(verts @ frequencies.T * 2 * np.pi) * MAX_OFFSET
+  return (verts + offsets).astype(np.float32)
+
+def encode_obj(verts: np.ndarray, faces: np.ndarray) -> bytes:
+  out = io.StringIO()
+  np.savetxt(out, verts, fmt='v %.6f %.6f %.6f')
+  np.savetxt(out, faces + 1, fmt='f %d %d %d')
+  return out.getvalue().encode('utf-8')
+
+def decode_obj(data: bytes) -> tuple[np.ndarray, np.ndarray]:
+  lines = data.decode('utf-8').splitlines()
+  verts = np.array([line.split()[1:] for line in lines if line.startswith('v ')], dtype=np.float32)
+  faces = np.array([line.split()[1:] for line in lines if line.startswith('f ')], dtype=np.int32) - 1
+  return verts, faces
+
+_PLY_FACE = np.dtype([('count', 'u1'), ('indices', '<i4', 3)])
+
+def encode_ply(verts: np.ndarray, faces: np.ndarray) -> bytes:
+  header = (
+    'ply\nformat binary_little_endian 1.0\n'
+    f'element vertex {len(verts)}\nproperty float x\nproperty float y\nproperty float z\n'
+    f'element face {len(faces)}\nproperty list uchar int vertex_indices\nend_header\n'
+  )
+  records = np.empty(len(faces), dtype=_PLY_FACE)
+  records['count'] = 3
+  records['indices'] = faces
+  return header.encode('ascii') + verts.astype('<f4').tobytes() + records.tobytes()
+
+def decode_ply(data: bytes) -> tuple[np.ndarray, np.ndarray]:
+  end = data.index(b'end_header\n') + len(b'end_header\n')
+  header = data[:end].decode('ascii').split('\n')
+  num_verts = int(next(line for line in header if line.startswith('element vertex')).split()[-1])
+  num_faces = int(next(line for line in header if line.startswith('element face')).split()[-1])
+
+  verts = np.frombuffer(data, dtype='<f4', count=num_verts * 3, offset=end).reshape(-1, 3)
+  records = np.frombuffer(data, dtype=_PLY_FACE, count=num_faces, offset=end + verts.nbytes)
+  return verts, records['indices'].astype(np.int32)
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--resolution', type=int, default=64, help='rings of the synthetic mesh')
+  parser.add_argument('--repeats', type=int, default=50)
+  parser.add_argument('--output', default=None)
+  args = parser.parse_args()
+
+  verts, faces = make_template(args.resolution)
+  template = MeshTemplate(verts, faces)
+  fit = make_fit(verts)
+
+  formats = {
+    'obj': (lambda: encode_obj(fit, faces), decode_obj),
+    'ply (binary)': (lambda: encode_ply(fit, faces), decode_ply),
+    'fmsh': (lambda: encode_mesh(fit, faces), decode_mesh),
+    'fmsh (template offsets)': (lambda: encode_mesh(fit, template=template), lambda data: decode_mesh(data, template)),
+  }
+
+  results, sizes = {}, {}
+  for name, (encode, decode) in formats.items():
+    data = encode()
+    decoded_verts, decoded_faces = decode(data)
+    if not np.array_equal(decoded_faces, faces):
+      raise Exception(f'{name} does not preserve the faces')
+
+    results[f'{name} encode'] = harness.measure(encode, repeats=args.repeats)
+    results[f'{name} decode'] = harness.measure(lambda: decode(data), repeats=args.repeats)
+    sizes[name] = {
+      'bytes': len(data),
+      'max_error_um': float(np.abs(decoded_verts - fit).max() * 1e6),
+    }
+
+  harness.print_results(f'mesh formats ({len(verts)} vertices, {len(faces)} faces)', results)
+  print(f'template: {len(template.data)} bytes, stored once')
+  for name, size in sizes.items():
+    print(f"{name:>32}: {size['bytes']:9d} bytes  max error {size['max_error_um']:.3f} um")
+
+  if args.output:
+    config = {'resolution': args.resolution, 'verts': len(verts), 'faces': len(faces), 'template_bytes': len(template.data), 'sizes': sizes}
+    harness.save_results(args.output, 'mesh_format', results, config)
+
+if __name__ == '__main__':
+  main()
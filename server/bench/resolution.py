@@ -0,0 +1,87 @@
+# Compares the ingest cost of every resolution quality: decoding the scan to the model size,
+# running SNU on it and resizing the predictions to the FOUND size in make_batch.
+# Runs on CPU with a stub SNU model unless a checkpoint is given. SAM2 resizes its input to a
+# fixed size internally, so only its mask postprocessing scales with the model size.
+#
+#   cd server && python -m bench.resolution --views 8 --qualities low medium high
+import argparse
+import torch
+import numpy as np
+
+from . import harness, synthetic
+from .stubs import StubNNET
+
+harness.setup_paths()
+
+import data, snu
+from detail.decode import decode_image
+from detail.make_batch import make_batch
+from detail.resolution import plan_resolutions
+
+class _BatchArgs:
+  def __init__(self, image_size, device):
+    self.image_size = image_size
+    self.device = device
+
+def _init_snu(args, model_size) -> None:
+  snu_args = snu.SNUArgs(
+    root_p=args.snu_root,
+    weights_file_name=args.weights_file_name,
+    sampling_ratio=0.4,
+    importance_ratio=0.7,
+    device=torch.device(args.device),
+    image_size=model_size,
+  )
+
+  if args.stub:
+    snu.model_args = snu_args
+    snu.model = StubNNET().to(snu_args.device).eval()
+  else:
+    snu.init_model(snu_args)
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--views', type=int, default=8)
+  parser.add_argument('--qualities', nargs='+', default=['low', 'medium', 'high'])
+  parser.add_argument('--repeats', type=int, default=3)
+  parser.add_argument('--device', default='cpu')
+  parser.add_argument('--stub', action=argparse.BooleanOptionalAction, default=True)
+  parser.add_argument('--snu-root', default='/app/surface_normal_uncertainty')
+  parser.add_argument('--weights-file-name', default='synfoot_10k_gn.pt')
+  parser.add_argument('--output', default=None)
+  args = parser.parse_args()
+
+  device = torch.device(args.device)
+  encoded = [synthetic.encode_jpeg(image) for image in synthetic.make_images(args.views)]
+  source_arkit = data.parse_arkit(synthetic.arkit_content(synthetic.make_arkit(args.views)))
+
+  results = {}
+  for quality in args.qualities:
+    plan = plan_resolutions(quality)
+    _init_snu(args, plan.model_size)
+    batch_args = _BatchArgs(np.array(plan.found_size[::-1]), device)
+
+    images = [decode_image(x, plan.model_size) for x in encoded]
+    predictions = {
+      'norm': snu.process(images)['norm'],
+      'mask': torch.from_numpy(np.stack([image[..., :1] for image in images])),
+    }
+
+    size = f'{plan.model_size[0]}x{plan.model_size[1]}'
+    results[f'{quality} {size} decode'] = harness.measure(
+      lambda: [decode_image(x, plan.model_size) for x in encoded], repeats=args.repeats, items=args.views
+    )
+    results[f'{quality} {size} snu'] = harness.measure(
+      lambda: snu.process(images), repeats=args.repeats, items=args.views, device=device
+    )
+    results[f'{quality} {size} make_batch'] = harness.measure(
+      lambda: make_batch(batch_args, predictions, source_arkit), repeats=args.repeats, items=args.views, device=device
+    )
+
+  harness.print_results('resolution', results)
+
+  if args.output:
+    harness.save_results(args.output, 'resolution', results)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,80 @@
+# Compares the peak memory and throughput of micro-batched SNU inference against running the
+# whole scan at once. Runs on CPU with a stub model unless a checkpoint is given.
+#
+#   cd server && python -m bench.snu_batching --views 16 --batch-sizes 1 4 8 --output results/snu.json
+import argparse
+import torch
+import numpy as np
+from PIL import Image
+
+from . import harness
+from .stubs import StubNNET
+
+harness.setup_paths()
+
+import snu
+
+def _make_images(num_views: int, size: tuple[int, int], seed: int = 0) -> list:
+  rng = np.random.default_rng(seed)
+  return [Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)) for _ in range(num_views)]
+
+# The previous implementation: one forward pass over the whole scan, keeping every output
+def _process_whole_scan(source_images: list) -> torch.Tensor:
+  image_batch = snu.load_batch(source_images)
+  norm_out_list, _, _ = snu.model(image_batch)
+  return norm_out_list[-1].permute(0, 2, 3, 1)
+
+def _init_snu(args) -> None:
+  snu_args = snu.SNUArgs(
+    root_p=args.snu_root,
+    weights_file_name=args.weights_file_name,
+    sampling_ratio=0.4,
+    importance_ratio=0.7,
+    device=torch.device(args.device),
+  )
+
+  if args.stub:
+    snu.model_args = snu_args
+    snu.model = StubNNET().to(snu_args.device).eval()
+  else:
+    snu.init_model(snu_args)
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--views', type=int, default=16)
+  parser.add_argument('--image-size', type=int, nargs=2, default=[360, 480], help='source image size (W, H)')
+  parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8])
+  parser.add_argument('--repeats', type=int, default=3)
+  parser.add_argument('--device', default='cpu')
+  parser.add_argument('--stub', action=argparse.BooleanOptionalAction, default=True)
+  parser.add_argument('--snu-root', default='/app/surface_normal_uncertainty')
+  parser.add_argument('--weights-file-name', default='synfoot_10k_gn.pt')
+  parser.add_argument('--output', default=None)
+  args = parser.parse_args()
+
+  _init_snu(args)
+  images = _make_images(args.views, tuple(args.image_size))
+  device = torch.device(args.device)
+
+  results = {}
+  results['whole scan (previous)'] = harness.measure(
+    lambda: _process_whole_scan(images), repeats=args.repeats, items=args.views, device=device
+  )
+
+  for batch_size in args.batch_sizes:
+    snu.model_args.batch_size = batch_size
+    results[f'micro-batch {batch_size}'] = harness.measure(
+      lambda: snu.process(images), repeats=args.repeats, items=args.views, device=device
+    )
+
+  snu.model_args.batch_size = None
+  results['micro-batch auto'] = harness.measure(
+    lambda: snu.process(images), repeats=args.repeats, items=args.views, device=device
+  )
+
+  harness.print_results('snu batching', results)
+  if args.output:
+    harness.save_results(args.output, 'snu_batching', results)
+
+if __name__ == '__main__':
+  main()
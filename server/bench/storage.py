@@ -0,0 +1,108 @@
+import os
+import time
+import hashlib
+import threading
+
+# A local stand-in for the Supabase client: `storage.from_(bucket_id)` returns a bucket backed by
+# a folder on disk, with the `list`, `download`, `upload` and `remove` calls the server and the
+# client use. Like Supabase, etags are the MD5 of the content, listings return one page and
+# uploads over an existing file need 'upsert'.
+# `latency` adds a fixed delay to every call to mimic the round trip to the storage service.
+# `bandwidth` (bytes per second), if set, adds the time to move the data over a link shared by
+# all calls of the client, so concurrent transfers queue for it like on a real uplink.
+LIST_LIMIT = 100 # the default page size of Supabase listings
+
+class _Link:
+  def __init__(self, bandwidth: float = None):
+    self.bandwidth = bandwidth
+    self._lock = threading.Lock()
+
+  def transfer(self, num_bytes: int) -> None:
+    if self.bandwidth and num_bytes > 0:
+      with self._lock:
+        time.sleep(num_bytes / self.bandwidth)
+
+def _md5(path: str) -> str:
+  with open(path, 'rb') as f:
+    return hashlib.md5(f.read()).hexdigest()
+
+class LocalBucket:
+  def __init__(self, root: str, latency: float = 0.0, link: _Link = None):
+    self.root = root
+    self.latency = latency
+    self.link = link or _Link()
+
+  def _path(self, path: str) -> str:
+    return os.path.join(self.root, path.strip('/'))
+
+  def _wait(self, num_bytes: int = 0) -> None:
+    if self.latency > 0:
+      time.sleep(self.latency)
+    self.link.transfer(num_bytes)
+
+  def download(self, path: str) -> bytes:
+    with open(self._path(path), 'rb') as f:
+      data = f.read()
+    self._wait(len(data))
+    return data
+
+  def upload(self, path: str, file, file_options: dict = None) -> dict:
+    if isinstance(file, bytes):
+      data = file
+    elif hasattr(file, 'read'):
+      data = file.read()
+    else:
+      with open(file, 'rb') as f:
+        data = f.read()
+    self._wait(len(data))
+
+    target = self._path(path)
+    if os.path.exists(target) and str((file_options or {}).get('upsert', 'false')).lower() != 'true':
+      raise Exception(f'The resource already exists: {path}')
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as f:
+      f.write(data)
+
+    return {'path': path, 'etag': hashlib.md5(data).hexdigest()}
+
+  def remove(self, paths: list[str]) -> list[dict]:
+    self._wait()
+
+    removed = []
+    for path in paths:
+      target = self._path(path)
+      if os.path.exists(target):
+        os.remove(target)
+        removed.append({'name': path})
+    return removed
+
+  # Defined last, as it shadows the builtin list in the class body
+  def list(self, path: str, options: dict = None) -> list[dict]:
+    self._wait()
+
+    folder = self._path(path)
+    if not os.path.isdir(folder):
+      return []
+
+    options = options or {}
+    offset = options.get('offset', 0)
+    limit = options.get('limit', LIST_LIMIT)
+
+    entries = sorted((e for e in os.scandir(folder) if e.is_file()), key=lambda e: e.name)
+    return [
+      {'name': entry.name, 'metadata': {'size': entry.stat().st_size, 'eTag': f'"{_md5(entry.path)}"'}}
+      for entry in entries[offset:offset + limit]
+    ]
+
+class _LocalStorage:
+  def __init__(self, root: str, latency: float, bandwidth: float):
+    self.root = root
+    self.latency = latency
+    self.link = _Link(bandwidth)
+
+  def from_(self, bucket_id: str) -> LocalBucket:
+    return LocalBucket(os.path.join(self.root, bucket_id), self.latency, self.link)
+
+class LocalClient:
+  def __init__(self, root: str, latency: float = 0.0, bandwidth: float = None):
+    self.storage = _LocalStorage(root, latency, bandwidth)
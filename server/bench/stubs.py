@@ -0,0 +1,154 @@
+import torch
+import numpy as np
+from torch import nn
+
+# A small stand-in for SNU's NNET with the same interface: it returns a list of normal
+# predictions (B, 4, H, W) refined up to the input resolution, plus the sampled
+# prediction and coordinate lists, which are unused by the pipeline
+class StubNNET(nn.Module):
+  def __init__(self, width: int = 16, num_refinements: int = 3):
+    super().__init__()
+    self.encoder = nn.Sequential(
+      nn.Conv2d(3, width, 3, stride=2, padding=1), nn.ReLU(),
+      nn.Conv2d(width, width, 3, stride=2, padding=1), nn.ReLU(),
+    )
+    self.heads = nn.ModuleList([nn.Conv2d(width, 4, 3, padding=1) for _ in range(num_refinements)])
+
+  def forward(self, x: torch.Tensor):
+    features = self.encoder(x)
+
+    norm_out_list = []
+    for i, head in enumerate(self.heads):
+      scale = 2 ** (i + 1 - len(self.heads))
+      size = (int(x.shape[2] * scale), int(x.shape[3] * scale))
+      out = head(nn.functional.interpolate(features, size=size, mode='bilinear', align_corners=False))
+      norm = nn.functional.normalize(out[:, :3], dim=1)
+      kappa = nn.functional.elu(out[:, 3:]) + 1.01
+      norm_out_list.append(torch.cat([norm, kappa], dim=1))
+
+    return norm_out_list, [], []
+
+# A small stand-in for SAM2's transformer image encoder: patch embeddings through a few
+# attention and MLP blocks of linear layers, to a logit per patch. It only gives the stub
+# predictor linear layers to quantize.
+class StubSAM2Encoder(nn.Module):
+  def __init__(self, patch_size: int = 16, width: int = 128, depth: int = 4, heads: int = 4):
+    super().__init__()
+    self.patch_size = patch_size
+    self.embed = nn.Linear(3 * patch_size ** 2, width)
+    self.blocks = nn.ModuleList([
+      nn.ModuleDict({
+        'norm1': nn.LayerNorm(width), 'qkv': nn.Linear(width, 3 * width), 'proj': nn.Linear(width, width),
+        'norm2': nn.LayerNorm(width), 'mlp': nn.Sequential(nn.Linear(width, 4 * width), nn.GELU(), nn.Linear(4 * width, width)),
+      })
+      for _ in range(depth)
+    ])
+    self.heads = heads
+    self.head = nn.Linear(width, 1)
+
+  def forward(self, image: torch.Tensor) -> torch.Tensor:
+    # (B, 3, H, W) in [0, 1] to (B, H / patch_size, W / patch_size) logits
+    b, _, h, w = image.shape
+    p = self.patch_size
+    patches = nn.functional.unfold(image, p, stride=p).transpose(1, 2) # (B, L, 3 * p * p)
+    x = self.embed(patches)
+
+    for block in self.blocks:
+      q, k, v = block['qkv'](block['norm1'](x)).view(b, -1, 3, self.heads, x.shape[-1] // self.heads).permute(2, 0, 3, 1, 4)
+      attention = nn.functional.scaled_dot_product_attention(q, k, v).transpose(1, 2).reshape(x.shape)
+      x = x + block['proj'](attention)
+      x = x + block['mlp'](block['norm2'](x))
+
+    return self.head(x).view(b, h // p, w // p)
+
+# A stand-in for SAM2ImagePredictor with the same single and batched interface. It thresholds
+# the brightness of the image at three levels instead of running SAM2, which is enough to
+# segment the synthetic scans. With an `encoder` (StubSAM2Encoder) its upsampled logits shift
+# the thresholds, so that the masks depend on the precision the encoder runs at.
+class StubSAM2Predictor:
+  THRESHOLDS = (100, 128, 160)
+  SCORES = (0.8, 0.9, 0.7)
+  ENCODER_SCALE = 32 # brightness levels per logit
+
+  def __init__(self, encoder: nn.Module = None):
+    self.encoder = encoder
+    self._images = []
+
+  def set_image(self, image) -> None:
+    self._images = [np.asarray(image)]
+
+  def set_image_batch(self, images: list) -> None:
+    self._images = [np.asarray(image) for image in images]
+
+  def _encode(self, image: np.ndarray) -> np.ndarray:
+    h, w = image.shape[:2]
+    p = self.encoder.patch_size
+    x = torch.from_numpy(np.array(image[:h // p * p, :w // p * p, :3])).permute(2, 0, 1)[None].float() / 255
+    logits = self.encoder(x)[:, None].float()
+    logits = nn.functional.interpolate(logits, size=(h, w), mode='bilinear', align_corners=False)
+    return logits[0, 0].numpy() * self.ENCODER_SCALE
+
+  def _predict(self, image: np.ndarray) -> tuple:
+    gray = image[..., :3].mean(axis=-1)
+    if self.encoder is not None:
+      gray = gray + self._encode(image)
+    masks = np.stack([gray > t for t in self.THRESHOLDS]) # (3, H, W)
+    return masks, np.array(self.SCORES, dtype=np.float32), masks.astype(np.float32)
+
+  def predict(self, point_coords=None, point_labels=None, multimask_output=True) -> tuple:
+    return self._predict(self._images[0])
+
+  def predict_batch(self, point_coords_batch=None, point_labels_batch=None, multimask_output=True) -> tuple:
+    outputs = [self._predict(image) for image in self._images]
+    return tuple(list(x) for x in zip(*outputs))
+
+class _StubMesh:
+  def __init__(self, verts: torch.Tensor):
+    self._verts = verts
+
+  def verts_packed(self) -> torch.Tensor:
+    return self._verts
+
+# A stand-in for the found module: process() fits a small deformation to the masks with Adam
+# for `epochs` iterations on the FOUND resolution, and returns a mesh of the template
+# topology, keypoints and statistics the way found.process does. process_many fits the tasks
+# one after another.
+class StubFOUND:
+  KPS = {'big toe': [0.26, 0.02, 0.0], 'heel': [0.0, 0.03, 0.0]}
+
+  def __init__(self, epochs: int = 50, size: tuple[int, int] = (192, 144), resolution: int = 32):
+    from detail.mesh_codec import MeshTemplate
+    from .mesh_format import make_template
+
+    self.epochs = epochs
+    self.size = size # (H, W)
+    self.mesh_template = MeshTemplate(*make_template(resolution))
+
+  def process(self, predictions: dict, source_arkit, profiler=None) -> tuple:
+    masks = predictions['mask'].permute(0, 3, 1, 2).float() / 255 # (N, 1, H, W)
+    target = nn.functional.interpolate(masks, size=self.size, mode='bilinear', align_corners=False)
+
+    logits = torch.zeros_like(target, requires_grad=True)
+    optimiser = torch.optim.Adam([logits], lr=0.1)
+    for i in range(self.epochs):
+      loss = nn.functional.binary_cross_entropy_with_logits(logits, target)
+      optimiser.zero_grad()
+      loss.backward()
+      optimiser.step()
+      if profiler is not None:
+        profiler('Stub fit', self.size, i, [loss.item()])
+
+    verts = torch.from_numpy(self.mesh_template.verts) * (1 + 0.01 * loss.detach())
+    stats = {
+      'iterations': self.epochs,
+      'final_loss': loss.item(),
+      'stages': [{'name': 'Stub fit', 'iterations': self.epochs, 'final_loss': loss.item()}],
+      'buffers': {},
+    }
+    return _StubMesh(verts), dict(self.KPS), stats
+
+  def process_many(self, tasks: list[tuple], profiler=None) -> list[tuple]:
+    results = [self.process(predictions, source_arkit, profiler) for predictions, source_arkit in tasks]
+    for _, _, stats in results:
+      stats['batch_size'] = len(tasks)
+    return results
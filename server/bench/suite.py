@@ -0,0 +1,167 @@
+# Runs every stage of the pipeline on a synthetic scan, without a GPU, Supabase or RunPod:
+# the scan is uploaded to a local storage fake and SNU and SAM2 are replaced with stub models
+# unless checkpoints are given. FOUND runs when its checkout is importable and is skipped
+# otherwise. Reports latency percentiles, throughput and peak RSS per stage and end to end.
+#
+#   cd server && python -m bench.suite --views 12 --output results/suite.json
+#   cd server && python -m bench.compare results/baseline.json results/suite.json
+import argparse
+import tempfile
+import torch
+import numpy as np
+
+from . import harness, synthetic
+from .storage import LocalClient
+from .stubs import StubNNET, StubSAM2Predictor
+
+harness.setup_paths()
+
+import data, snu, sam, streaming
+from detail.make_batch import make_batch
+from detail.measure import calc_size
+from detail.resolution import plan_resolutions
+
+TASK_ID = 'bench'
+
+# Keypoints used for calc_size when FOUND is unavailable
+STUB_KPS = {'big toe': [0.26, 0.02, 0.0], 'heel': [0.0, 0.03, 0.0]}
+
+class _BatchArgs:
+  def __init__(self, image_size, device):
+    self.image_size = image_size
+    self.device = device
+
+def _import_found():
+  try:
+    import found
+    return found
+  except ImportError as e:
+    print(f'FOUND is unavailable ({e}), skipping the FOUND stages')
+    return None
+
+def _init_snu(args, device: torch.device, model_size) -> None:
+  snu_args = snu.SNUArgs(
+    root_p=args.snu_root,
+    weights_file_name='synfoot_10k_gn.pt',
+    sampling_ratio=0.4,
+    importance_ratio=0.7,
+    device=device,
+    image_size=model_size,
+  )
+
+  if args.stub:
+    snu.model_args = snu_args
+    snu.model = StubNNET().to(device).eval()
+  else:
+    snu.init_model(snu_args)
+
+def _init_sam(args, device: torch.device) -> None:
+  sam_args = sam.SAM2Args(
+    root_p=args.sam_root,
+    weights_file_name='sam2.1_hiera_large.pt',
+    cfg_file_name='sam2.1/sam2.1_hiera_l.yaml',
+    device=device,
+  )
+
+  if args.stub:
+    sam.model_args = sam_args
+    sam.model = StubSAM2Predictor()
+  else:
+    sam.init_predictor(sam_args)
+
+def _init_found(found, args, device: torch.device, found_size) -> None:
+  found.init_renderer(found.FOUNDArgs(root_p=args.found_root, find_dir='data/find_nfap', device=device, image_size=found_size))
+  if args.found_epochs is not None:
+    found.STAGES = [stage._replace(num_epochs=args.found_epochs) for stage in found.STAGES]
+
+def _read_sidecars(bucket) -> list[tuple[str, str]]:
+  folder = f'tasks/{TASK_ID}/'
+  names = [f['name'] for f in bucket.list(folder) if f['name'].endswith('.json')]
+  return [(name, bucket.download(folder + name).decode('utf-8')) for name in names]
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--views', type=int, default=12)
+  parser.add_argument('--image-size', type=int, nargs=2, default=None, help='source image size (W, H), IMAGE_SIZE by default')
+  parser.add_argument('--quality', default='high', help='resolution quality, see detail.resolution')
+  parser.add_argument('--repeats', type=int, default=5)
+  parser.add_argument('--latency', type=float, default=0.0, help='simulated storage round trip in seconds')
+  parser.add_argument('--device', default='cpu')
+  parser.add_argument('--stub', action=argparse.BooleanOptionalAction, default=True)
+  parser.add_argument('--snu-root', default='/app/surface_normal_uncertainty')
+  parser.add_argument('--sam-root', default='/app/sam2')
+  parser.add_argument('--found-root', default='/app/FOUND')
+  parser.add_argument('--found-epochs', type=int, default=None, help='override the FOUND iteration budget')
+  parser.add_argument('--found-repeats', type=int, default=1)
+  parser.add_argument('--output', default=None)
+  args = parser.parse_args()
+
+  device = torch.device(args.device)
+  plan = plan_resolutions(args.quality)
+  found_size = np.array(plan.found_size[::-1]) # (H, W), the way FOUND takes it
+
+  _init_snu(args, device, plan.model_size)
+  _init_sam(args, device)
+  found = _import_found()
+  if found is not None:
+    _init_found(found, args, device, found_size)
+
+  with tempfile.TemporaryDirectory() as root:
+    data.supabase = LocalClient(root, args.latency)
+    data.init_decoder(plan.model_size)
+
+    bucket = data.get_source_bucket()
+    synthetic.write_scan(bucket, TASK_ID, args.views, tuple(args.image_size) if args.image_size else None)
+    sidecars = _read_sidecars(bucket)
+
+    results, outputs = {}, {}
+    def run(name: str, fn, repeats: int = args.repeats):
+      def call():
+        outputs[name] = fn()
+      results[name] = harness.measure(call, repeats=repeats, items=args.views, device=device)
+      return outputs[name]
+
+    images, source_arkit = run('download', lambda: data.download_from_cloud(TASK_ID))
+    run('process_arkit', lambda: data.parse_arkit(sidecars))
+    predictions = run('snu.process', lambda: snu.process(images))
+    predictions['mask'] = run('sam.process', lambda: sam.process(images))
+
+    batch_args = found.model_args if found is not None else _BatchArgs(found_size, device)
+    run('make_batch', lambda: make_batch(batch_args, predictions, source_arkit))
+
+    kps = STUB_KPS
+    if found is not None:
+      _, kps, _ = run('found.process', lambda: found.process(predictions, source_arkit), args.found_repeats)
+    run('calc_size', lambda: calc_size(kps))
+
+    def fit(predictions, source_arkit) -> float:
+      if found is None:
+        return calc_size(STUB_KPS)
+      _, kps, _ = found.process(predictions, source_arkit)
+      return calc_size(kps)
+
+    def sequential() -> float:
+      images, source_arkit = data.download_from_cloud(TASK_ID)
+      predictions = snu.process(images)
+      predictions['mask'] = sam.process(images)
+      return fit(predictions, source_arkit)
+
+    def streamed() -> float:
+      _, predictions, source_arkit, _ = streaming.stream_task(TASK_ID, snu.process, sam.process)
+      return fit(predictions, source_arkit)
+
+    e2e_repeats = args.found_repeats if found is not None else args.repeats
+    run('end to end (sequential)', sequential, e2e_repeats)
+    run('end to end (streaming)', streamed, e2e_repeats)
+
+    data.image_decoder.shutdown()
+
+  harness.print_results('pipeline stages', results)
+
+  if args.output:
+    config = {k: v for k, v in vars(args).items() if k != 'output'}
+    config.update(model_size=list(plan.model_size), found_size=list(plan.found_size), found=found is not None)
+    harness.save_results(args.output, 'suite', results, config)
+
+if __name__ == '__main__':
+  main()
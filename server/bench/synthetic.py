@@ -0,0 +1,111 @@
+import os
+import json
+import torch
+import numpy as np
+from PIL import Image, ImageDraw
+
+from . import harness
+
+harness.setup_paths()
+
+from detail.config import IMAGE_SIZE
+
+# Synthetic foot scans: a ring of phone cameras around the origin, images with a bright
+# foot-like ellipse on a darker floor and matching SNU/SAM-like predictions.
+# The camera poses only approximate a real capture, they are meant for timing and for
+# comparing pipeline variants against each other, not for absolute accuracy.
+
+SCAN_RADIUS = 0.35 # meters
+SCAN_HEIGHT = 0.3 # meters
+FOCAL_LENGTH = 1400.0 # pixels at IMAGE_SIZE
+
+def make_arkit(num_views: int, seed: int = 0) -> dict[str, dict]:
+  rng = np.random.default_rng(seed)
+  width, height = IMAGE_SIZE
+
+  cameras = {}
+  for i in range(num_views):
+    azimuth = 2 * np.pi * i / num_views + rng.normal(0, 0.05)
+    elevation = np.arctan2(SCAN_HEIGHT, SCAN_RADIUS) + rng.normal(0, 0.03)
+
+    cameras[f'{i:04d}.jpg'] = {
+      'x': float(SCAN_RADIUS * np.cos(azimuth)),
+      'y': float(SCAN_HEIGHT + rng.normal(0, 0.01)),
+      'z': float(SCAN_RADIUS * np.sin(azimuth)),
+      'angleX': float(-elevation),
+      'angleY': float(np.pi / 2 - azimuth),
+      'angleZ': float(np.pi / 2 + rng.normal(0, 0.02)),
+      'fx': FOCAL_LENGTH,
+      'ox': float(width / 2),
+      'oy': float(height / 2),
+    }
+
+  return cameras
+
+def arkit_content(cameras: dict[str, dict]) -> list[tuple[str, str]]:
+  # The (json file name, json content) pairs the data module produces
+  return [(name.rsplit('.', 1)[0] + '.json', json.dumps(camera)) for name, camera in cameras.items()]
+
+def make_images(num_views: int, size: tuple[int, int] = None, seed: int = 0) -> list[Image.Image]:
+  rng = np.random.default_rng(seed)
+  width, height = size if size is not None else IMAGE_SIZE.astype(int)
+
+  images = []
+  for _ in range(num_views):
+    pixels = rng.normal(70, 12, (height, width, 3)).clip(0, 255).astype(np.uint8)
+    image = Image.fromarray(pixels)
+
+    cx, cy = width * rng.uniform(0.45, 0.55), height * rng.uniform(0.45, 0.55)
+    rx, ry = width * 0.18, height * 0.3
+    ImageDraw.Draw(image).ellipse([cx - rx, cy - ry, cx + rx, cy + ry], fill=(205, 175, 150))
+    images.append(image)
+
+  return images
+
+def encode_jpeg(image: Image.Image, quality: int = 90) -> bytes:
+  from io import BytesIO
+  buffer = BytesIO()
+  image.save(buffer, format='JPEG', quality=quality)
+  return buffer.getvalue()
+
+# SNU-like normals (N, H, W, 4) in [0, 1] with a kappa channel, and SAM-like masks (N, H, W, 1)
+def make_predictions(num_views: int, size: tuple[int, int], seed: int = 0) -> dict:
+  rng = np.random.default_rng(seed)
+  width, height = size
+
+  y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+  norms, masks = [], []
+  for _ in range(num_views):
+    cx, cy = width * rng.uniform(0.45, 0.55), height * rng.uniform(0.45, 0.55)
+    d = ((x - cx) / (width * 0.18)) ** 2 + ((y - cy) / (height * 0.3)) ** 2
+    inside = d < 1
+
+    nx, ny = (x - cx) / width, (y - cy) / height
+    nz = np.sqrt(np.clip(1 - nx ** 2 - ny ** 2, 0, 1))
+    kappa = np.where(inside, 60.0, 1.0) + rng.normal(0, 0.5, d.shape)
+
+    norms.append(np.stack([nx * 0.5 + 0.5, ny * 0.5 + 0.5, nz * 0.5 + 0.5, kappa], axis=-1))
+    masks.append(np.where(inside, 255, 0)[..., None])
+
+  return {
+    'norm': torch.from_numpy(np.stack(norms).astype(np.float32)),
+    'mask': torch.from_numpy(np.stack(masks).astype(np.uint8)),
+  }
+
+# Uploads a synthetic scan the way the client does: an image and an ARKit sidecar per view
+# in the tasks/<task_id>/ folder of the bucket
+def write_scan(bucket, task_id: str, num_views: int, size: tuple[int, int] = None, seed: int = 0) -> None:
+  folder = f'tasks/{task_id}/'
+  cameras = make_arkit(num_views, seed)
+  for (name, camera), image in zip(cameras.items(), make_images(num_views, size, seed)):
+    bucket.upload(folder + name, encode_jpeg(image))
+    bucket.upload(folder + name.rsplit('.', 1)[0] + '.json', json.dumps(camera).encode('utf-8'))
+
+# Writes a synthetic scan into a local folder, the way the client finds a capture on disk
+def write_scan_folder(path: str, num_views: int, size: tuple[int, int] = None, seed: int = 0, quality: int = 95) -> None:
+  os.makedirs(path, exist_ok=True)
+  cameras = make_arkit(num_views, seed)
+  for (name, camera), image in zip(cameras.items(), make_images(num_views, size, seed)):
+    image.save(os.path.join(path, name), format='JPEG', quality=quality)
+    with open(os.path.join(path, name.rsplit('.', 1)[0] + '.json'), 'w') as f:
+      json.dump(camera, f)
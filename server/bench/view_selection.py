@@ -0,0 +1,69 @@
+# Reports how the FOUND foot length drifts as fewer views are kept by the view selection,
+# relative to fitting all views, together with the FOUND latency and the selection cost.
+# Needs the FOUND checkout and the FIND weights.
+#
+#   cd server && python -m bench.view_selection --views 40 --keep 8 12 16 24
+import time
+import argparse
+import torch
+
+from . import harness
+from .found_multitask import make_tasks
+
+harness.setup_paths()
+
+import found
+from detail.measure import calc_size
+from detail.config import FOUND_IMAGE_SIZE
+from detail.select_views import select_diverse_views
+
+def main() -> None:
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--scans', type=int, default=2)
+  parser.add_argument('--views', type=int, default=40)
+  parser.add_argument('--keep', type=int, nargs='+', default=[8, 12, 16, 24])
+  parser.add_argument('--prediction-size', type=int, nargs=2, default=[480, 640], help='prediction size (W, H)')
+  parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+  parser.add_argument('--found-root', default='/app/FOUND')
+  parser.add_argument('--output', default=None)
+  args = parser.parse_args()
+
+  device = torch.device(args.device)
+  found.init_renderer(found.FOUNDArgs(root_p=args.found_root, find_dir='data/find_nfap', device=device, image_size=FOUND_IMAGE_SIZE))
+  scans = make_tasks(args.scans, args.views, tuple(args.prediction_size))
+
+  results, reference = {}, None
+  for keep in [args.views] + sorted(args.keep, reverse=True):
+    subsets, selection_time = [], 0.0
+    for predictions, source_arkit in scans:
+      start = time.perf_counter()
+      indices = select_diverse_views(source_arkit, keep)
+      selection_time += time.perf_counter() - start
+
+      index = torch.as_tensor(indices)
+      subsets.append(({k: v[index] for k, v in predictions.items()}, source_arkit[indices]))
+
+    outputs = []
+    result = harness.measure(
+      lambda: outputs.append([found.process(*subset) for subset in subsets]),
+      repeats=1, warmup=0, items=len(subsets), device=device
+    )
+
+    sizes = [calc_size(kps) for _, kps, _ in outputs[-1]]
+    reference = reference or sizes
+
+    result['views'] = keep
+    result['selection_ms'] = selection_time * 1000.0 / len(scans)
+    result['foot_length'] = sizes
+    result['max_foot_length_difference'] = max(abs(a - b) for a, b in zip(sizes, reference))
+    results[f'{keep} views'] = result
+
+  harness.print_results('view selection', results)
+  for name, r in results.items():
+    print(f"{name:>32}: max foot length difference {r['max_foot_length_difference']:.4f}, selection {r['selection_ms']:.2f} ms")
+
+  if args.output:
+    harness.save_results(args.output, 'view_selection', results)
+
+if __name__ == '__main__':
+  main()
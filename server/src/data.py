@@ -1,19 +1,34 @@
 import os
 import json
 import logging
-from io import BytesIO
-from PIL import Image
+import threading
+import numpy as np
 from supabase import Client, create_client
 
-from detail.config import IMAGE_SIZE
+from detail.config import DECODE_IMAGE_SIZE
 from detail.types import ARKitSource
 from detail.process_arkit import process_arkit
+from detail.fetch import FetchArgs, fetch_assets, list_files
+from detail.cache import AssetCache, ASSET_CACHE_MAX_BYTES
+from detail.decode import ImageDecoder
+from detail.mesh_codec import CONTENT_TYPE as MESH_CONTENT_TYPE, read_header
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
 SUPABASE_SOURCE_BUCKET_ID = os.environ.get('SUPABASE_SOURCE_BUCKET_ID', '') # 'found-serverless-source'
+SUPABASE_RESULT_BUCKET_ID = os.environ.get('SUPABASE_RESULT_BUCKET_ID', '') # 'found-serverless-result'
+
+# The mesh templates results refer to, shared by all tasks
+TEMPLATE_FOLDER_PATH = 'templates/'
 
 supabase: Client = None
+fetch_args: FetchArgs = FetchArgs()
+image_decoder = ImageDecoder(DECODE_IMAGE_SIZE)
+
+# Ids of the mesh templates known to be in the result bucket
+published_templates: set[str] = set()
+published_templates_lock = threading.Lock()
 
 # A utility function to replace an extension of a file path
 def _replace_extension(filename: str, new_extension: str) -> str:
@@ -50,62 +65,112 @@ def init_cloud(url: str, key: str) -> None:
         logger.error(f"Failed to initialize Supabase client: {str(e)}")
         raise
 
-def download_from_cloud(id: str) -> tuple[list, ARKitSource]:
+def init_cache(root: str, max_bytes: int = ASSET_CACHE_MAX_BYTES, cache_decoded: bool = True) -> None:
+    logger.info(f"Initializing asset cache at {root}")
+    fetch_args.cache = AssetCache(root, max_bytes)
+    fetch_args.decoded_variant = _get_decoded_variant() if cache_decoded else None
+
+def init_decoder(size=None) -> None:
+    global image_decoder
+    if size is not None and tuple(int(x) for x in size) != image_decoder.size:
+        image_decoder.shutdown()
+        image_decoder = ImageDecoder(size)
+
+        # Decoded images of another size are cached separately
+        if fetch_args.decoded_variant is not None:
+            fetch_args.decoded_variant = _get_decoded_variant()
+
+    logger.info(f"Starting {image_decoder.workers} image decoding workers, decoding to {image_decoder.size}")
+    image_decoder.start()
+
+def _get_decoded_variant() -> str:
+  width, height = image_decoder.size
+  return f'{width}x{height}'
+
+# Decodes an image to a (H, W, 3) uint8 array of the decoder size in the decoding processes
+def decode_image(data: bytes) -> np.ndarray:
+  return image_decoder(data)
+
+def get_source_bucket():
+  return supabase.storage.from_(SUPABASE_SOURCE_BUCKET_ID)
+
+def get_result_bucket():
+  return supabase.storage.from_(SUPABASE_RESULT_BUCKET_ID)
+
+# Uploads a mesh template unless it is in the result bucket already. `get_template` returns
+# the MeshTemplate and is only called when it has to be uploaded.
+def _publish_template(bucket, template_id: str, get_template) -> str:
+  path = f'{TEMPLATE_FOLDER_PATH}{template_id}.fmsh'
+  with published_templates_lock:
+    if template_id in published_templates:
+      return path
+
+  if not any(f['name'] == f'{template_id}.fmsh' for f in list_files(bucket, TEMPLATE_FOLDER_PATH)):
+    template = get_template()
+    if template.id != template_id:
+      raise Exception('the result mesh does not match the template')
+    bucket.upload(path, template.data, {'content-type': MESH_CONTENT_TYPE, 'upsert': 'true'})
+
+  with published_templates_lock:
+    published_templates.add(template_id)
+  return path
+
+# Converts a list of (json file name, json content) pairs into an ARKit camera bundle
+def parse_arkit(arkit_data_strings: list[tuple[str, str]]) -> ARKitSource:
+  return process_arkit('', _custom_arkit_loader, content=arkit_data_strings)
+
+def download_from_cloud(id: str, args: FetchArgs = None) -> tuple[list, ARKitSource]:
     logger.info(f"Starting download from cloud for task ID: {id}")
     task_folder_path = f'tasks/{id}/'
-    
-    # Get all files in the bucket
-    logger.debug(f"Listing files in bucket {SUPABASE_SOURCE_BUCKET_ID} at path: {task_folder_path}")
-    bucket = supabase.storage.from_(SUPABASE_SOURCE_BUCKET_ID)
+
+    # Download the images and ARKit files concurrently, decoding the images as they arrive
+    logger.debug(f"Fetching files from bucket {SUPABASE_SOURCE_BUCKET_ID} at path: {task_folder_path}")
+    bucket = get_source_bucket()
     try:
-        files = bucket.list(task_folder_path)
-        logger.debug(f"Found {len(files)} files in bucket")
+        images, arkit_data_strings = fetch_assets(bucket, task_folder_path, decode_image, args or fetch_args)
+        logger.debug(f"Downloaded {len(images)} images and {len(arkit_data_strings)} ARKit files")
     except Exception as e:
-        logger.error(f"Failed to list files in bucket: {str(e)}")
+        logger.error(f"Failed to download files for task {id}: {str(e)}")
         raise
 
-    # Filter out image file names
-    image_names = [
-        f['name']
-        for f in files
-        if f['name'].lower().endswith(('.png', '.jpg', '.jpeg'))
-    ]
-    logger.debug(f"Found {len(image_names)} image files")
-
-    # Load all images
-    images = []
-    for f in image_names:
-        logger.debug(f"Downloading and processing image: {f}")
-        try:
-            image_data = bucket.download(f)
-            image = Image.open(BytesIO(image_data)).resize(IMAGE_SIZE)
-            images.append(image)
-            logger.debug(f"Successfully processed image: {f}")
-        except Exception as e:
-            logger.error(f"Failed to process image {f}: {str(e)}")
-            raise
-    
-    # Get associated ARKit file names
-    arkit_names = list(map(lambda f: _replace_extension(f, '.json'), image_names))
-    logger.debug(f"Looking for {len(arkit_names)} ARKit files")
-
-    # Load all ARKit files
-    arkit_data_strings = []
-    for f in arkit_names:
-        logger.debug(f"Downloading ARKit file: {f}")
-        try:
-            arkit_json_content = bucket.download(f).decode('utf-8')
-            arkit_data_strings.append((f, arkit_json_content))
-            logger.debug(f"Successfully downloaded ARKit file: {f}")
-        except Exception as e:
-            logger.error(f"Failed to download ARKit file {f}: {str(e)}")
-            raise
-
     logger.debug("Processing ARKit data")
     try:
-        arkit_data = process_arkit('', _custom_arkit_loader, content=arkit_data_strings)
+        arkit_data = parse_arkit(arkit_data_strings)
         logger.info(f"Successfully completed cloud download for task {id}")
         return images, arkit_data
     except Exception as e:
         logger.error(f"Failed to process ARKit data: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+
+# Uploads the result of a task into its folder of the result bucket: result.json with the foot
+# size, the keypoints and the paths of mesh.fmsh and of the template the mesh refers to.
+# The parts upload concurrently. Returns the result description.
+def upload_result(id: str, record: dict, get_template) -> dict:
+    logger.info(f"Uploading the result of task ID: {id}")
+    task_folder_path = f'tasks/{id}/'
+    bucket = get_result_bucket()
+
+    result = {'foot_size': record['foot_size'], 'kps': record['kps'], 'mesh': None, 'template': None}
+    try:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            uploads = []
+            if record.get('mesh') is not None:
+                header = read_header(record['mesh'])
+                result['mesh'] = task_folder_path + 'mesh.fmsh'
+                uploads.append(pool.submit(bucket.upload, result['mesh'], record['mesh'], {'content-type': MESH_CONTENT_TYPE, 'upsert': 'true'}))
+                if header['delta']:
+                    result['template'] = _publish_template(bucket, header['template_id'], get_template)
+
+            for upload in uploads:
+                upload.result()
+
+        # Written last, so that a client which sees result.json can read everything it refers to
+        content = json.dumps(result).encode('utf-8')
+        bucket.upload(task_folder_path + 'result.json', content, {'content-type': 'application/json', 'upsert': 'true'})
+    except Exception as e:
+        logger.error(f"Failed to upload the result of task {id}: {str(e)}")
+        raise
+
+    result['path'] = task_folder_path + 'result.json'
+    logger.info(f"Successfully uploaded the result of task {id}")
+    return result
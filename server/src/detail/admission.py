@@ -0,0 +1,265 @@
+import time
+import logging
+import itertools
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Device memory fraction the admitted stages may reserve, of the memory free once the models are loaded
+DEFAULT_MEMORY_FRACTION = 0.8
+
+# Stages which can't run concurrently with themselves: the SAM2 predictor keeps the image
+# embeddings of its last call and FOUND renders through module-level renderers
+DEFAULT_STAGE_LIMITS = {'sam': 1, 'found': 1}
+
+class _Request:
+  def __init__(self, job: 'Job', stage: str, num_bytes: int, seq: int, exclusive: bool = False):
+    self.job = job
+    self.stage = stage
+    self.num_bytes = num_bytes
+    self.seq = seq
+    self.exclusive = exclusive
+    self.granted = False
+
+  @property
+  def order(self) -> tuple[int, int]:
+    return self.job.seq, self.seq
+
+# Admits the device-heavy stages of concurrent jobs. A stage runs once
+#  - fewer than its limit of calls of the same stage are running, and
+#  - its estimated device memory fits into what the running stages haven't reserved.
+# Waiting requests are served in the order their jobs arrived, so that older jobs finish
+# first. A request which doesn't fit into the free memory blocks the memory for younger jobs
+# until it is admitted, so large requests aren't starved by a stream of small ones. A request
+# larger than the whole capacity runs alone, and so does an exclusive one, e.g. a stage which
+# measures its own device memory use.
+class DeviceScheduler:
+  def __init__(self, capacity: int = None, stage_limits: dict[str, int] = None):
+    self.capacity = capacity # bytes, None doesn't limit the memory
+    self.stage_limits = dict(DEFAULT_STAGE_LIMITS if stage_limits is None else stage_limits)
+
+    self.reserved = 0
+    self.peak_reserved = 0
+    self.admitted = 0
+    self.peak_waiting = 0
+
+    self._running: dict[str, int] = {}
+    self._exclusive = False # an exclusive request is running
+    self._waiting: list[_Request] = []
+    self._job_seq = itertools.count()
+    self._request_seq = itertools.count()
+    self._cond = threading.Condition()
+
+  def set_capacity(self, capacity: int) -> None:
+    with self._cond:
+      self.capacity = capacity
+      self._grant()
+      self._cond.notify_all()
+
+  # Starts a job, which orders the requests of its stages
+  def job(self, name: str = None) -> 'Job':
+    return Job(self, next(self._job_seq), name)
+
+  def _fits(self, request: _Request) -> bool:
+    if self.capacity is None or self.reserved == 0:
+      return True
+    return self.reserved + request.num_bytes <= self.capacity
+
+  def _grant(self) -> None:
+    memory_blocked = False
+    for request in sorted(self._waiting, key=lambda r: r.order):
+      if self._exclusive:
+        return
+
+      limit = self.stage_limits.get(request.stage)
+      if limit is not None and self._running.get(request.stage, 0) >= limit:
+        continue
+
+      # An exclusive request waits for the running stages to finish, blocking younger jobs
+      if request.exclusive and any(self._running.values()):
+        memory_blocked = True
+        continue
+
+      if memory_blocked or not self._fits(request):
+        memory_blocked = True
+        continue
+
+      request.granted = True
+      self._waiting.remove(request)
+      self._running[request.stage] = self._running.get(request.stage, 0) + 1
+      self._exclusive = request.exclusive
+      self.reserved += request.num_bytes
+      self.peak_reserved = max(self.peak_reserved, self.reserved)
+      self.admitted += 1
+
+  def _acquire(self, request: _Request) -> None:
+    with self._cond:
+      self._waiting.append(request)
+      self.peak_waiting = max(self.peak_waiting, len(self._waiting))
+      self._grant()
+      while not request.granted:
+        self._cond.wait()
+
+  def _release(self, request: _Request) -> None:
+    with self._cond:
+      self._running[request.stage] -= 1
+      self._exclusive = self._exclusive and not request.exclusive
+      self.reserved -= request.num_bytes
+      self._grant()
+      self._cond.notify_all()
+
+  def stats(self) -> dict:
+    with self._cond:
+      return {
+        'capacity_bytes': self.capacity,
+        'reserved_bytes': self.reserved,
+        'peak_reserved_bytes': self.peak_reserved,
+        'running': {stage: n for stage, n in self._running.items() if n > 0},
+        'waiting': len(self._waiting),
+        'peak_waiting': self.peak_waiting,
+        'admitted': self.admitted,
+      }
+
+# The admission requests of a single job, with the time it spent waiting per stage
+class Job:
+  def __init__(self, scheduler: DeviceScheduler, seq: int, name: str = None):
+    self.scheduler = scheduler
+    self.seq = seq
+    self.name = name
+    self.waits: dict[str, dict] = {}
+    self._lock = threading.Lock()
+
+  def _request(self, stage: str, num_bytes: int = 0, exclusive: bool = False) -> _Request:
+    return _Request(self, stage, max(int(num_bytes), 0), next(self.scheduler._request_seq), exclusive)
+
+  def _record_wait(self, stage: str, wait_s: float) -> None:
+    with self._lock:
+      waits = self.waits.setdefault(stage, {'calls': 0, 'wait_s': 0.0})
+      waits['calls'] += 1
+      waits['wait_s'] += wait_s
+
+  @contextmanager
+  def _admit(self, request: _Request):
+    start = time.perf_counter()
+    self.scheduler._acquire(request)
+    self._record_wait(request.stage, time.perf_counter() - start)
+
+    try:
+      yield
+    finally:
+      self.scheduler._release(request)
+
+  # Runs the enclosed block once the stage is admitted with `num_bytes` of estimated device memory,
+  # alone on the device if `exclusive`
+  @contextmanager
+  def admit(self, stage: str, num_bytes: int = 0, exclusive: bool = False):
+    with self._admit(self._request(stage, num_bytes, exclusive)):
+      yield
+
+  def as_dict(self) -> dict:
+    with self._lock:
+      return {stage: dict(waits) for stage, waits in self.waits.items()}
+
+# The calls of a batched stage which share one admission
+class _Batch:
+  def __init__(self, request: _Request):
+    self.request = request
+    self.items = []
+    self.outcomes: list[tuple] = None # (result, error) per item
+    self.started = None
+    self.done = threading.Event()
+
+# Coalesces the calls of a stage by concurrent jobs into batches, for stages which process
+# several items in one call faster than one after another (e.g. FOUND fits, see
+# found.process_many). The first call of a batch requests the admission. Calls arriving while
+# it waits join the batch and add their memory to its request, up to `max_batch` calls and the
+# scheduler capacity. Once admitted, the batch runs in one call of `run_batch`, which takes the
+# list of items and returns the list of their results. An uncontended call runs alone without
+# any delay. A failed batch is retried call by call, so that a bad item only fails its own job.
+class BatchedStage:
+  def __init__(self, stage: str, run_batch, max_batch: int = None):
+    self.stage = stage
+    self.run_batch = run_batch
+    self.max_batch = max_batch
+
+    self.batches = 0
+    self.calls = 0
+    self.peak_batch = 0
+
+    self._open: _Batch = None
+    self._lock = threading.Lock()
+
+  def _joins(self, batch: _Batch, job: Job, num_bytes: int) -> bool:
+    # Called with the scheduler's lock held, which also guards the admission of the batch
+    if batch is None or batch.request.granted or batch.request.job.scheduler is not job.scheduler:
+      return False
+    if self.max_batch is not None and len(batch.items) >= self.max_batch:
+      return False
+    capacity = job.scheduler.capacity
+    return capacity is None or batch.request.num_bytes + num_bytes <= capacity
+
+  def _run(self, items: list) -> list[tuple]:
+    try:
+      return [(result, None) for result in self.run_batch(items)]
+    except Exception as e:
+      if len(items) == 1:
+        return [(None, e)]
+      logger.warning(f"Batch of {len(items)} {self.stage} calls failed ({str(e)}), running them one by one")
+
+    outcomes = []
+    for item in items:
+      try:
+        outcomes.append((self.run_batch([item])[0], None))
+      except Exception as e:
+        outcomes.append((None, e))
+    return outcomes
+
+  # Returns the result of `item`, run in a batch with the calls of other jobs waiting at the same time
+  def run(self, job: Job, item, num_bytes: int = 0):
+    num_bytes = max(int(num_bytes), 0)
+    start = time.perf_counter()
+
+    with job.scheduler._cond:
+      batch = self._open
+      leader = not self._joins(batch, job, num_bytes)
+      if leader:
+        batch = self._open = _Batch(job._request(self.stage, num_bytes))
+      else:
+        batch.request.num_bytes += num_bytes
+      index = len(batch.items)
+      batch.items.append(item)
+
+    if leader:
+      with job._admit(batch.request):
+        batch.started = time.perf_counter()
+        with job.scheduler._cond:
+          if self._open is batch:
+            self._open = None
+        try:
+          batch.outcomes = self._run(list(batch.items))
+        finally:
+          with self._lock:
+            self.batches += 1
+            self.calls += len(batch.items)
+            self.peak_batch = max(self.peak_batch, len(batch.items))
+          batch.done.set()
+    else:
+      batch.done.wait()
+      job._record_wait(self.stage, (batch.started or start) - start)
+
+    if batch.outcomes is None:
+      raise Exception(f'the {self.stage} batch failed')
+    result, error = batch.outcomes[index]
+    if error is not None:
+      raise error
+    return result
+
+  def stats(self) -> dict:
+    with self._lock:
+      return {
+        'batches': self.batches,
+        'calls': self.calls,
+        'mean_batch_size': self.calls / self.batches if self.batches else 0.0,
+        'peak_batch_size': self.peak_batch,
+      }
@@ -0,0 +1,188 @@
+import threading
+import torch
+
+# Idle arenas a pool keeps, and the bytes of buffers an idle arena keeps. Arenas beyond these are
+# freed on release, so the memory held outside the admitted stages stays bounded.
+MAX_IDLE_ARENAS = 2
+MAX_IDLE_ARENA_BYTES = 256 * 1024 ** 2
+
+# Reusable host and device buffers of the per-request batch tensors. Every buffer has a name and
+# a per-view shape, and grows in its first (view) dimension to the largest request seen, after
+# which requests don't allocate. On CUDA the host buffers are pinned and the host to device
+# copies run on a side stream, so that they overlap with the work of the current stream.
+# An arena is used by one request at a time, see ArenaPool.
+class BufferArena:
+  def __init__(self, device: torch.device):
+    self.device = torch.device(device)
+    self.is_cuda = self.device.type == 'cuda'
+    self.stream = torch.cuda.Stream(self.device) if self.is_cuda else None
+
+    self._host: dict[tuple, torch.Tensor] = {}
+    self._device: dict[tuple, torch.Tensor] = {}
+    self._host_events: dict[tuple, torch.cuda.Event] = {} # the last copy out of a host buffer
+    self._copy_events: dict[str, torch.cuda.Event] = {} # the last copy into a named device buffer
+    self._timings = [] # (start, end) events of the copies not yet added to h2d_ms
+
+    self.counts = {'allocations': 0, 'allocated_bytes': 0, 'reuses': 0, 'h2d_copies': 0, 'h2d_bytes': 0, 'trims': 0}
+    self._h2d_ms = 0.0
+
+  def _buffer(self, buffers: dict, name: str, shape, dtype: torch.dtype, **kwargs) -> torch.Tensor:
+    key = (name, tuple(shape[1:]), dtype)
+    buffer = buffers.get(key)
+    if buffer is None or buffer.shape[0] < shape[0]:
+      buffer = torch.empty(tuple(shape), dtype=dtype, **kwargs)
+      buffers[key] = buffer
+      self.counts['allocations'] += 1
+      self.counts['allocated_bytes'] += buffer.numel() * buffer.element_size()
+    else:
+      self.counts['reuses'] += 1
+
+    return buffer[:shape[0]]
+
+  # A host buffer, pinned on CUDA. Waits for the previous copy out of it first.
+  def host(self, name: str, shape, dtype: torch.dtype) -> torch.Tensor:
+    key = (name, tuple(shape[1:]), dtype)
+    event = self._host_events.pop(key, None)
+    if event is not None:
+      event.synchronize()
+
+    return self._buffer(self._host, name, shape, dtype, pin_memory=self.is_cuda)
+
+  # A device buffer
+  def buffer(self, name: str, shape, dtype: torch.dtype = torch.float32) -> torch.Tensor:
+    return self._buffer(self._device, name, shape, dtype, device=self.device)
+
+  # Starts copying `x` into the named device buffer, staged through a pinned host buffer unless
+  # it's pinned already. Returns the device tensor, which is ready once `wait(name)` is called.
+  # Tensors on the device already are returned as they are.
+  def to_device(self, name: str, x: torch.Tensor) -> torch.Tensor:
+    if not self.is_cuda or x.device.type == 'cuda':
+      return x.to(self.device)
+
+    if not x.is_pinned():
+      host = self.host(name, x.shape, x.dtype)
+      host.copy_(x)
+      x = host
+    out = self.buffer(name, x.shape, x.dtype)
+
+    start, end = torch.cuda.Event(enable_timing=True), torch.cuda.Event(enable_timing=True)
+    # The device buffer may still be read by the work queued before
+    self.stream.wait_stream(torch.cuda.current_stream(self.device))
+    with torch.cuda.stream(self.stream):
+      start.record()
+      out.copy_(x, non_blocking=True)
+      end.record()
+    out.record_stream(self.stream)
+
+    self._host_events[(name, tuple(x.shape[1:]), x.dtype)] = end
+    self._copy_events[name] = end
+    self._timings.append((start, end))
+    self.counts['h2d_copies'] += 1
+    self.counts['h2d_bytes'] += x.numel() * x.element_size()
+    return out
+
+  # Makes the current stream wait for the copy into the named buffer
+  def wait(self, name: str) -> None:
+    event = self._copy_events.pop(name, None)
+    if event is not None:
+      torch.cuda.current_stream(self.device).wait_event(event)
+
+  # Adds the time of the finished copies to h2d_ms, waiting for the pending ones if `wait`
+  def collect_timings(self, wait: bool = True) -> None:
+    pending = []
+    for start, end in self._timings:
+      if wait:
+        end.synchronize()
+      elif not end.query():
+        pending.append((start, end))
+        continue
+      self._h2d_ms += start.elapsed_time(end)
+    self._timings = pending
+
+  # Device and host bytes held by the buffers
+  def resident_bytes(self) -> dict:
+    def size(buffers: dict) -> int:
+      return sum(b.numel() * b.element_size() for b in buffers.values())
+    return {'device': size(self._device), 'host': size(self._host)}
+
+  # Frees every buffer, after the copies out of them are done
+  def trim(self) -> None:
+    self.collect_timings()
+    self._host.clear()
+    self._device.clear()
+    self._host_events.clear()
+    self._copy_events.clear()
+    self.counts['trims'] += 1
+
+  # The counts and the time spent in host to device copies so far. Waits for the pending copies.
+  def stats(self) -> dict:
+    self.collect_timings()
+    return {**self.counts, 'h2d_ms': self._h2d_ms}
+
+def _stats_delta(after: dict, before: dict) -> dict:
+  return {k: after[k] - before[k] for k in after}
+
+# The arenas of a worker, one per request using them at a time. Released arenas are kept for
+# the next requests, up to `max_idle` of them with at most `max_idle_bytes` of buffers each.
+class ArenaPool:
+  def __init__(self, device: torch.device, max_idle: int = MAX_IDLE_ARENAS, max_idle_bytes: int = MAX_IDLE_ARENA_BYTES):
+    self.device = torch.device(device)
+    self.max_idle = max_idle
+    self.max_idle_bytes = max_idle_bytes
+
+    self._idle: list[BufferArena] = []
+    self._arenas: list[BufferArena] = []
+    self._freed = {'arenas_freed': 0, 'h2d_ms': 0.0} # the totals of the freed arenas
+    self._lock = threading.Lock()
+
+  def acquire(self) -> BufferArena:
+    with self._lock:
+      if self._idle:
+        return self._idle.pop()
+
+      arena = BufferArena(self.device)
+      self._arenas.append(arena)
+      return arena
+
+  def release(self, arena: BufferArena) -> None:
+    # The request is done with the arena, its copies have finished
+    arena.collect_timings(wait=False)
+
+    with self._lock:
+      if len(self._idle) >= self.max_idle:
+        self._arenas.remove(arena)
+        self._freed['arenas_freed'] += 1
+        self._freed['h2d_ms'] += arena._h2d_ms
+        for k, v in arena.counts.items():
+          self._freed[k] = self._freed.get(k, 0) + v
+        return
+
+      if sum(arena.resident_bytes().values()) > self.max_idle_bytes:
+        arena.trim()
+      self._idle.append(arena)
+
+  # The totals of all arenas, including the freed ones, and the bytes the pool holds. The copies
+  # still pending in arenas in use aren't counted yet.
+  def stats(self) -> dict:
+    with self._lock:
+      arenas = list(self._arenas)
+      totals = {'arenas': len(arenas), 'resident_device_bytes': 0, 'resident_host_bytes': 0, **self._freed}
+
+    for arena in arenas:
+      for k, v in arena.counts.items():
+        totals[k] = totals.get(k, 0) + v
+      totals['h2d_ms'] += arena._h2d_ms
+
+      resident = arena.resident_bytes()
+      totals['resident_device_bytes'] += resident['device']
+      totals['resident_host_bytes'] += resident['host']
+    return totals
+
+# Records the counts and the host to device time of an arena over a block, for per-request stats
+class ArenaUsage:
+  def __init__(self, arena: BufferArena):
+    self.arena = arena
+    self._start = arena.stats()
+
+  def stats(self) -> dict:
+    return _stats_delta(self.arena.stats(), self._start)
@@ -0,0 +1,153 @@
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+import numpy as np
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+ASSET_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+RAW_SUFFIX = '.bin'
+ARRAY_SUFFIX = '.npy'
+TMP_SUFFIX = '.tmp'
+
+# An on-disk, content-addressed cache for downloaded task assets.
+# Entries are keyed by the object path and its version (etag or size), so a re-uploaded
+# object never hits a stale entry. Raw bytes are stored as-is, decoded images are stored
+# as .npy files which are memory-mapped on read. The least recently used files are evicted
+# once the total size exceeds `max_bytes`. All methods are thread safe and writes are atomic,
+# so concurrent handlers in one worker can share a cache instance.
+class AssetCache:
+  def __init__(self, root: str, max_bytes: int = ASSET_CACHE_MAX_BYTES):
+    self.root = root
+    self.max_bytes = max_bytes
+
+    self._lock = threading.Lock()
+    self._entries = OrderedDict() # file name -> size in bytes, least recently used first
+    self._total_bytes = 0
+
+    os.makedirs(root, exist_ok=True)
+    self._load_index()
+
+  def _load_index(self) -> None:
+    # Restore the LRU order from the access times left by previous processes
+    files, orphans = [], 0
+    for entry in os.scandir(self.root):
+      if not entry.is_file():
+        continue
+
+      # Writes a previous process didn't finish, nothing refers to them and they'd fill the disk
+      if entry.name.endswith(TMP_SUFFIX):
+        try:
+          os.remove(entry.path)
+          orphans += 1
+        except FileNotFoundError:
+          pass
+      elif entry.name.endswith((RAW_SUFFIX, ARRAY_SUFFIX)):
+        stat = entry.stat()
+        files.append((stat.st_mtime, entry.name, stat.st_size))
+
+    for _, name, size in sorted(files):
+      self._entries[name] = size
+      self._total_bytes += size
+
+    logger.info(f"Asset cache at {self.root} holds {len(self._entries)} files ({self._total_bytes} bytes), removed {orphans} unfinished writes")
+
+  @staticmethod
+  def key(path: str, version) -> str:
+    return hashlib.sha256(f'{path}:{version}'.encode('utf-8')).hexdigest()
+
+  def _path(self, name: str) -> str:
+    return os.path.join(self.root, name)
+
+  def _touch(self, name: str) -> bool:
+    with self._lock:
+      if name not in self._entries:
+        return False
+      self._entries.move_to_end(name)
+
+    try:
+      os.utime(self._path(name))
+    except FileNotFoundError:
+      self._forget(name)
+      return False
+    return True
+
+  def _forget(self, name: str) -> None:
+    with self._lock:
+      size = self._entries.pop(name, None)
+      if size is not None:
+        self._total_bytes -= size
+
+  def _store(self, name: str, write) -> None:
+    # Write into a temporary file first so that readers never observe partial entries
+    fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=TMP_SUFFIX)
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        write(f)
+      size = os.path.getsize(tmp_path)
+      os.replace(tmp_path, self._path(name))
+    except Exception:
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+      raise
+
+    with self._lock:
+      self._total_bytes += size - self._entries.pop(name, 0)
+      self._entries[name] = size
+      evicted = self._pop_lru()
+
+    for victim in evicted:
+      try:
+        os.remove(self._path(victim))
+      except FileNotFoundError:
+        pass
+
+  def _pop_lru(self) -> list[str]:
+    # Must be called with the lock held. The most recent entry is never evicted.
+    evicted = []
+    while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+      name, size = self._entries.popitem(last=False)
+      self._total_bytes -= size
+      evicted.append(name)
+
+    if evicted:
+      logger.debug(f"Evicted {len(evicted)} files from the asset cache")
+    return evicted
+
+  def get_bytes(self, key: str) -> bytes:
+    name = key + RAW_SUFFIX
+    if not self._touch(name):
+      return None
+
+    try:
+      with open(self._path(name), 'rb') as f:
+        return f.read()
+    except FileNotFoundError:
+      self._forget(name)
+      return None
+
+  def put_bytes(self, key: str, data: bytes) -> None:
+    self._store(key + RAW_SUFFIX, lambda f: f.write(data))
+
+  # Returns a read-only memory-mapped array stored under the given variant name
+  def get_array(self, key: str, variant: str) -> np.ndarray:
+    name = f'{key}.{variant}{ARRAY_SUFFIX}'
+    if not self._touch(name):
+      return None
+
+    try:
+      return np.load(self._path(name), mmap_mode='r')
+    except FileNotFoundError:
+      self._forget(name)
+      return None
+
+  def put_array(self, key: str, variant: str, array: np.ndarray) -> None:
+    self._store(f'{key}.{variant}{ARRAY_SUFFIX}', lambda f: np.save(f, np.ascontiguousarray(array)))
+
+  @property
+  def total_bytes(self) -> int:
+    return self._total_bytes
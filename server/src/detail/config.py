@@ -2,4 +2,7 @@ import numpy as np
 
 IMAGE_SIZE = np.array([1440.0, 1920.0])
 INTERMEDIATE_IMAGE_SIZE = np.array([960.0, 1280.0])
-FOUND_IMAGE_SIZE = np.array([192, 144])
\ No newline at end of file
+FOUND_IMAGE_SIZE = np.array([192, 144])
+
+# Default size images are decoded to, the resolution planner (detail.resolution) picks the actual one
+DECODE_IMAGE_SIZE = INTERMEDIATE_IMAGE_SIZE
@@ -0,0 +1,61 @@
+import os
+import logging
+import torch
+from torch import nn
+
+logger = logging.getLogger(__name__)
+
+# CPU execution of the models. Every model has a precision:
+#   'fp32'  the reference
+#   'bf16'  bfloat16 autocast with channels-last activations, fast on CPUs with AVX512-BF16/AMX
+#   'int8'  dynamic int8 quantization of the linear layers, for transformer models like SAM2's
+#           Hiera encoder. Convolutions stay in fp32, so it doesn't help convolutional models.
+PRECISIONS = ('fp32', 'bf16', 'int8')
+
+# Tolerances of the CPU modes against the fp32 outputs, checked by bench.cpu_inference
+MAX_NORMAL_ERROR_DEG = 2.0 # mean angle between the SNU normals
+MIN_MASK_IOU = 0.97 # IoU of the SAM2 masks
+
+def check_precision(precision: str) -> str:
+  if precision not in PRECISIONS:
+    raise Exception('invalid precision provided')
+  return precision
+
+# Sets the intra-op (within an operator) and inter-op (between independent operators) thread
+# counts. The inter-op count can only be set before the first parallel work, so it's skipped
+# with a warning when that has happened already.
+def configure_threads(intra_op: int = None, inter_op: int = None) -> None:
+  if intra_op is not None:
+    torch.set_num_threads(intra_op)
+
+  if inter_op is not None:
+    try:
+      torch.set_num_interop_threads(inter_op)
+    except RuntimeError as e:
+      logger.warning(f"Cannot set the inter-op thread count ({str(e)})")
+
+  logger.info(f"CPU threads: {torch.get_num_threads()} intra-op, {torch.get_num_interop_threads()} inter-op of {os.cpu_count()} cores")
+
+# Prepares a model for CPU inference at the precision, returns the model to use
+def prepare_model(model: nn.Module, precision: str) -> nn.Module:
+  if precision == 'bf16':
+    return model.to(memory_format=torch.channels_last)
+  if precision == 'int8':
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+  return model
+
+def autocast(device: torch.device, precision: str):
+  return torch.autocast(device.type, dtype=torch.bfloat16, enabled=precision == 'bf16')
+
+# Mean angle in degrees between two sets of (..., 3+) normal predictions
+def normal_error_deg(reference: torch.Tensor, output: torch.Tensor) -> float:
+  a = nn.functional.normalize(reference[..., :3].float(), dim=-1)
+  b = nn.functional.normalize(output[..., :3].float(), dim=-1)
+  cos = (a * b).sum(dim=-1).clamp(-1, 1)
+  return torch.rad2deg(torch.acos(cos)).mean().item()
+
+# Intersection over union of two sets of uint8 masks
+def mask_iou(reference: torch.Tensor, output: torch.Tensor) -> float:
+  a, b = reference > 127, output > 127
+  union = (a | b).sum().item()
+  return (a & b).sum().item() / union if union else 1.0
@@ -0,0 +1,95 @@
+import os
+import sys
+import logging
+import threading
+import multiprocessing
+import numpy as np
+from io import BytesIO
+from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DECODE_WORKERS = min(os.cpu_count() or 1, 8)
+
+# Seconds the decoding processes wait for each other to start
+WORKER_START_TIMEOUT = 120
+
+# Decodes an encoded image straight to a (H, W, 3) uint8 array of the given (W, H) size.
+# For JPEGs, `draft` lets libjpeg downscale in the DCT domain by 1/2, 1/4 or 1/8 while decoding,
+# to the smallest scale that is still at least as large as the requested size.
+def decode_image(data: bytes, size: tuple[int, int]) -> np.ndarray:
+  image = Image.open(BytesIO(data))
+  image.draft('RGB', size)
+  image = image.convert('RGB')
+
+  if image.size != tuple(size):
+    image = image.resize(tuple(size), Image.BILINEAR)
+
+  return np.asarray(image)
+
+# Holds every worker back until all of them are started, so that the pool starts them all at once
+def _wait_for_workers(started) -> None:
+  started.wait(WORKER_START_TIMEOUT)
+
+# Decodes images in a pool of worker processes, so that decoding isn't serialised by the GIL.
+# Calling the decoder blocks the calling thread until its image is ready, so it can be used
+# from the fetch threads directly. With `workers=0` images are decoded in the calling thread.
+class ImageDecoder:
+  def __init__(self, size, workers: int = DECODE_WORKERS):
+    self.size = tuple(int(x) for x in size)
+    self.workers = workers
+
+    self._pool: ProcessPoolExecutor = None
+    self._lock = threading.Lock()
+
+  def _get_pool(self) -> ProcessPoolExecutor:
+    with self._lock:
+      if self._pool is None:
+        self._pool = self._start_pool()
+        logger.info(f"Started {self.workers} image decoding processes")
+      return self._pool
+
+  # Forking a process which has initialised CUDA is unsafe, the workers are spawned instead.
+  # Spawned processes import the main module of the parent first, which is the handler with torch
+  # and the models, so this module stands in for it while the workers start. They all start here
+  # and the pool never starts more later.
+  def _start_pool(self) -> ProcessPoolExecutor:
+    context = multiprocessing.get_context('spawn')
+    pool = ProcessPoolExecutor(
+      max_workers=self.workers, mp_context=context,
+      initializer=_wait_for_workers, initargs=(context.Barrier(self.workers),)
+    )
+
+    main = sys.modules['__main__']
+    sys.modules['__main__'] = sys.modules[__name__]
+    try:
+      # A worker is started for every task submitted while none is idle
+      futures = [pool.submit(os.getpid) for _ in range(self.workers)]
+    finally:
+      sys.modules['__main__'] = main
+
+    try:
+      for f in futures:
+        f.result()
+    except Exception:
+      pool.shutdown(wait=False, cancel_futures=True)
+      raise
+    return pool
+
+  # Starts the worker processes ahead of the first request
+  def start(self) -> None:
+    if self.workers > 0:
+      self._get_pool()
+
+  def __call__(self, data: bytes) -> np.ndarray:
+    if self.workers == 0:
+      return decode_image(data, self.size)
+
+    return self._get_pool().submit(decode_image, data, self.size).result()
+
+  def shutdown(self) -> None:
+    with self._lock:
+      if self._pool is not None:
+        self._pool.shutdown()
+        self._pool = None
@@ -0,0 +1,204 @@
+import time
+import logging
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import AssetCache
+from .metrics import TransferStats
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Default fetch settings, tuned for 20-40 view scans
+FETCH_CONCURRENCY = 8
+FETCH_RETRIES = 3
+FETCH_BACKOFF = 0.25 # seconds, doubled after every failed attempt
+FETCH_MAX_BACKOFF = 4.0
+
+# Storage listings return pages of at most this many files, like Supabase's default
+LIST_PAGE_SIZE = 100
+
+class FetchArgs:
+  def __init__(self, **kwargs):
+    self.concurrency = kwargs.get('concurrency', FETCH_CONCURRENCY)
+    self.retries = kwargs.get('retries', FETCH_RETRIES)
+    self.backoff = kwargs.get('backoff', FETCH_BACKOFF)
+    self.max_backoff = kwargs.get('max_backoff', FETCH_MAX_BACKOFF)
+
+    # Optional local asset cache. When `decoded_variant` is set, decoded images are cached
+    # as arrays under that name as well, so a warm hit skips decoding altogether.
+    self.cache: AssetCache = kwargs.get('cache', None)
+    self.decoded_variant: str = kwargs.get('decoded_variant', None)
+
+    # Optional per-request transfer counters
+    self.stats: TransferStats = kwargs.get('stats', None)
+
+    if self.concurrency < 1:
+      raise Exception('fetch concurrency must be at least 1')
+
+def _replace_extension(filename: str, new_extension: str) -> str:
+  return filename.rsplit('.', 1)[0] + new_extension
+
+def _download(bucket, path: str, args: FetchArgs) -> bytes:
+  for attempt in range(args.retries + 1):
+    try:
+      data = bucket.download(path)
+    except Exception as e:
+      if attempt == args.retries:
+        raise
+
+      delay = min(args.backoff * (2 ** attempt), args.max_backoff)
+      logger.warning(f"Download of {path} failed ({str(e)}), retrying in {delay:.2f}s")
+      time.sleep(delay)
+      continue
+
+    if args.stats is not None:
+      args.stats.record(len(data))
+    return data
+
+def _get_version(file: dict):
+  # Storage listings report the etag and size in the object metadata
+  metadata = file.get('metadata') or {}
+  return metadata.get('eTag') or metadata.get('size')
+
+def _download_cached(bucket, path: str, version, args: FetchArgs) -> bytes:
+  if args.cache is None or version is None:
+    return _download(bucket, path, args)
+
+  key = AssetCache.key(path, version)
+  data = args.cache.get_bytes(key)
+  if data is None:
+    data = _download(bucket, path, args)
+    args.cache.put_bytes(key, data)
+  elif args.stats is not None:
+    args.stats.record(len(data), cached=True)
+  return data
+
+def _uses_decoded_cache(version, args: FetchArgs) -> bool:
+  return args.cache is not None and version is not None and args.decoded_variant is not None
+
+def _get_cached_image(path: str, version, args: FetchArgs):
+  if not _uses_decoded_cache(version, args):
+    return None
+
+  array = args.cache.get_array(AssetCache.key(path, version), args.decoded_variant)
+  if array is None:
+    return None
+
+  if args.stats is not None:
+    args.stats.record(array.nbytes, cached=True)
+  # The read-only memory map is returned as is, the models stack the images into their own batches
+  return array
+
+def _decode_image(data: bytes, path: str, version, decode, args: FetchArgs):
+  image = decode(data)
+
+  if _uses_decoded_cache(version, args):
+    args.cache.put_array(AssetCache.key(path, version), args.decoded_variant, np.asarray(image))
+  return image
+
+def _fetch_image(bucket, path: str, version, decode, args: FetchArgs):
+  image = _get_cached_image(path, version, args)
+  if image is not None:
+    return image
+
+  # Decode in the worker thread as soon as the bytes arrive
+  return _decode_image(_download_cached(bucket, path, version, args), path, version, decode, args)
+
+def _fetch_json(bucket, path: str, version, args: FetchArgs) -> str:
+  return _download_cached(bucket, path, version, args).decode('utf-8')
+
+# Lists every file of the folder, page by page
+def list_files(bucket, folder_path: str) -> list[dict]:
+  files, offset = [], 0
+  while True:
+    page = bucket.list(folder_path, {'limit': LIST_PAGE_SIZE, 'offset': offset})
+    files += page
+    if len(page) < LIST_PAGE_SIZE:
+      return files
+    offset += len(page)
+
+def list_task_files(bucket, folder_path: str) -> dict:
+  return {f['name']: _get_version(f) for f in list_files(bucket, folder_path)}
+
+# The content hashes (etags) of the files in the folder, None where the storage reports none
+def list_content_hashes(bucket, folder_path: str) -> dict:
+  return {f['name']: (f.get('metadata') or {}).get('eTag') for f in list_files(bucket, folder_path)}
+
+def list_image_names(files: dict) -> list[str]:
+  # Sorted so that the output order doesn't depend on the storage listing order
+  return sorted(
+    name
+    for name in files
+    if name.lower().endswith(IMAGE_EXTENSIONS)
+  )
+
+# Lists the task folder, returning the file versions and the sorted image names
+def list_views(bucket, folder_path: str) -> tuple[dict, list[str]]:
+  files = list_task_files(bucket, folder_path)
+  return files, list_image_names(files)
+
+# Downloads a single view, i.e. the image and its ARKit sidecar. The image is left encoded
+# in 'data' unless a decoded copy was found in the cache, in which case it is in 'image'.
+def download_view(bucket, folder_path: str, files: dict, image_name: str, args: FetchArgs = None, arkit: tuple[str, str] = None) -> dict:
+  args = args or FetchArgs()
+
+  path = folder_path + image_name
+  version = files[image_name]
+  arkit_name = _replace_extension(image_name, '.json')
+
+  view = {'name': image_name, 'path': path, 'version': version, 'data': None}
+  view['image'] = _get_cached_image(path, version, args)
+  if view['image'] is None:
+    view['data'] = _download_cached(bucket, path, version, args)
+
+  view['arkit'] = arkit or (arkit_name, _fetch_json(bucket, folder_path + arkit_name, files.get(arkit_name), args))
+  return view
+
+# Downloads only the ARKit sidecars of the given images, e.g. to select views before
+# downloading any image. Returns (json file name, json content) pairs in the same order.
+def fetch_sidecars(bucket, folder_path: str, files: dict, image_names: list[str], args: FetchArgs = None) -> list[tuple[str, str]]:
+  args = args or FetchArgs()
+  arkit_names = [_replace_extension(f, '.json') for f in image_names]
+
+  with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+    futures = [pool.submit(_fetch_json, bucket, folder_path + name, files.get(name), args) for name in arkit_names]
+    return [(name, f.result()) for name, f in zip(arkit_names, futures)]
+
+# Decodes the image of a view returned by `download_view`
+def decode_view(view: dict, decode, args: FetchArgs = None) -> dict:
+  args = args or FetchArgs()
+
+  if view['image'] is None:
+    view['image'] = _decode_image(view['data'], view['path'], view['version'], decode, args)
+    view['data'] = None
+  return view
+
+# Downloads every image in the folder together with its ARKit JSON sidecar using a bounded
+# thread pool. `bucket` only needs to provide `list(path, options)` and `download(path)`.
+# Returns the decoded images and a list of (json file name, json content) pairs, both in
+# sorted image name order.
+def fetch_assets(bucket, folder_path: str, decode, args: FetchArgs = None) -> tuple[list, list[tuple[str, str]]]:
+  args = args or FetchArgs()
+
+  files, image_names = list_views(bucket, folder_path)
+  arkit_names = [_replace_extension(f, '.json') for f in image_names]
+  logger.debug(f"Fetching {len(image_names)} images and their ARKit files with {args.concurrency} workers")
+
+  pool = ThreadPoolExecutor(max_workers=args.concurrency)
+  try:
+    # Submit each image together with its sidecar so both arrive at about the same time
+    image_futures, arkit_futures = [], []
+    for image_name, arkit_name in zip(image_names, arkit_names):
+      image_futures.append(pool.submit(_fetch_image, bucket, folder_path + image_name, files[image_name], decode, args))
+      arkit_futures.append(pool.submit(_fetch_json, bucket, folder_path + arkit_name, files.get(arkit_name), args))
+
+    images = [f.result() for f in image_futures]
+    arkit = [(name, f.result()) for name, f in zip(arkit_names, arkit_futures)]
+  except Exception:
+    pool.shutdown(wait=False, cancel_futures=True)
+    raise
+
+  pool.shutdown()
+  return images, arkit
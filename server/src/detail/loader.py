@@ -0,0 +1,99 @@
+import time
+import pickle
+import logging
+import threading
+import torch
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, Future
+
+logger = logging.getLogger(__name__)
+
+# Loads a checkpoint with its tensors memory-mapped from the file, so that loading it into a model
+# copies straight from the page cache instead of reading the whole file into memory first.
+# Returns the state dict under `key`, if present, with any DataParallel 'module.' prefix removed.
+def load_checkpoint(path: str, key: str = 'model') -> dict:
+  try:
+    # Checkpoints which pickle more than tensors (e.g. training arguments) need the full
+    # unpickler, they are the server's own files
+    try:
+      checkpoint = torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+    except pickle.UnpicklingError:
+      checkpoint = torch.load(path, map_location='cpu', mmap=True, weights_only=False)
+  except RuntimeError as e:
+    # Legacy (non-zip) checkpoints can't be memory-mapped
+    logger.warning(f"Cannot memory-map {path} ({str(e)}), loading it into memory instead")
+    checkpoint = torch.load(path, map_location='cpu', weights_only=False)
+
+  state = checkpoint[key] if key is not None and key in checkpoint else checkpoint
+  return {k[len('module.'):] if k.startswith('module.') else k: v for k, v in state.items()}
+
+# Times the phases of loading a single model
+class LoadTimer:
+  def __init__(self):
+    self.phases: dict[str, float] = {}
+
+  @contextmanager
+  def phase(self, name: str):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+# Loads models concurrently in background threads. Every load function takes a LoadTimer and
+# returns the loaded model (or module), which `get` waits for. Loads which failed re-raise
+# their error from `get`.
+class ModelLoader:
+  def __init__(self, workers: int = 3):
+    self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='model-loader')
+    self._futures: dict[str, Future] = {}
+    self._timings: dict[str, dict] = {}
+    self._lock = threading.Lock()
+    self._start = time.perf_counter()
+
+  def _run(self, name: str, fn):
+    timer = LoadTimer()
+    start = time.perf_counter()
+    try:
+      result = fn(timer)
+    except Exception as e:
+      logger.error(f"Failed to load {name}: {str(e)}", exc_info=True)
+      raise
+    finally:
+      timing = {
+        'started_s': start - self._start,
+        'total_s': time.perf_counter() - start,
+        **{f'{phase}_s': t for phase, t in timer.phases.items()},
+      }
+      with self._lock:
+        self._timings[name] = timing
+
+    phases = ', '.join(f'{phase} {t:.2f}s' for phase, t in timer.phases.items())
+    logger.info(f"Loaded {name} in {timing['total_s']:.2f}s ({phases})")
+    return result
+
+  def submit(self, name: str, fn) -> None:
+    self._futures[name] = self._pool.submit(self._run, name, fn)
+
+  def ready(self, name: str) -> bool:
+    return self._futures[name].done()
+
+  # Whether the model finished loading without an error
+  def loaded(self, name: str) -> bool:
+    future = self._futures[name]
+    return future.done() and future.exception() is None
+
+  def get(self, name: str, timeout: float = None):
+    return self._futures[name].result(timeout)
+
+  # Waits for every model and returns the per-model load times. Doesn't raise on failed loads.
+  def wait_all(self) -> dict:
+    for future in list(self._futures.values()):
+      future.exception()
+
+    with self._lock:
+      timings = dict(self._timings)
+
+    # Time from the loader's creation until the last model finished loading
+    wall_s = max((t['started_s'] + t['total_s'] for t in timings.values()), default=0.0)
+    return {'wall_s': wall_s, 'models': timings}
@@ -1,6 +1,8 @@
+import math
 import torch
-from torchvision import transforms
+import torch.nn.functional as F
 
+from .buffers import BufferArena
 from .types import ARKitSource, Predictions
 
 def _kappa_to_alpha(mask: torch.Tensor) -> torch.Tensor:
@@ -8,37 +10,82 @@ def _kappa_to_alpha(mask: torch.Tensor) -> torch.Tensor:
     + ((torch.exp(- mask * torch.pi) * torch.pi) / (1 + torch.exp(- mask * torch.pi)))
   return torch.rad2deg(alpha)
 
-def _determine_batch_size(predictions: Predictions) -> int:
-  return max(len(predictions), 8)
+# Normal uncertainty in degrees below which a pixel belongs to the silhouette
+SIL_MAX_ALPHA = 70
 
-def make_batch(args, predictions: Predictions, source_arkit: ARKitSource) -> list[dict]:
-  assert predictions['norm'].shape[0] == len(source_arkit['filename'])
+# The silhouette (_kappa_to_alpha(mask) < SIL_MAX_ALPHA) computed in place in two arena buffers,
+# with the second term of the uncertainty written as pi * sigmoid(-pi * mask)
+def _silhouette(mask: torch.Tensor, arena: BufferArena) -> torch.Tensor:
+  alpha = arena.buffer('alpha', mask.shape)
+  sil = arena.buffer('sil', mask.shape)
 
-  # image_size has a shape of (W, H)
-  resize_fac = args.image_size[1] / predictions['norm'].shape[1]
-  downscale = transforms.Resize(args.image_size)
+  torch.mul(mask, mask, out=alpha).add_(1)
+  torch.div(mask, alpha, out=alpha).mul_(2)
+  torch.mul(mask, -math.pi, out=sil).sigmoid_().mul_(math.pi)
+  alpha.add_(sil) # radians
 
-  # We want to downscale the source images and predictions for FOUND due to speed restrictions.
-  norm_rgb = downscale(predictions['norm']) # (N, H, W, 3)
-  norm_xyz = norm_rgb * 2 - 1 # (N, H, W, 3)
+  # 1 where alpha is below the limit, 0 elsewhere
+  return torch.neg(alpha, out=sil).add_(math.radians(SIL_MAX_ALPHA)).sign_().clamp_(min=0)
 
-  mask = downscale(predictions['mask']) # (N, H, W, 1)
-  mask_alpha = _kappa_to_alpha(mask) # (N, H, W, 1)
-  sil = (mask_alpha < 70).float() # (N, H, W, 1)
+# Resizes (N, H, W, C) maps to the given (W, H) size on the device. A no-op at the same size.
+def _resize(x: torch.Tensor, size: tuple[int, int], arena: BufferArena, name: str) -> torch.Tensor:
+  if x.dtype != torch.float32:
+    x = arena.buffer(f'{name}_float', x.shape).copy_(x)
+  if tuple(x.shape[1:3]) == (size[1], size[0]):
+    return x
+
+  x = F.interpolate(x.permute(0, 3, 1, 2), size=(size[1], size[0]), mode='bilinear', align_corners=False, antialias=True)
+  return x.permute(0, 2, 3, 1)
+
+# `arena` holds the batch tensors which aren't new allocations, it is owned by the caller for as
+# long as it uses the batch. Without one every tensor is allocated.
+def make_batch(args, predictions: Predictions, source_arkit: ARKitSource, arena: BufferArena = None) -> dict:
+  assert predictions['norm'].shape[0] == len(source_arkit)
+  if arena is None:
+    arena = BufferArena(args.device)
+
+  # image_size has a shape of (H, W), the way FOUND takes it
+  size = (int(args.image_size[1]), int(args.image_size[0]))
+
+  # Both maps are copied to the device on the arena's side stream, the mask one while the
+  # normals are processed
+  norm = arena.to_device('norm', predictions['norm'])
+  mask = arena.to_device('mask', predictions['mask'])
+
+  # We want to downscale the predictions for FOUND due to speed restrictions.
+  # Every map is resized once, straight from the model resolution to the FOUND one.
+  arena.wait('norm')
+  norm_rgb = _resize(norm, size, arena, 'norm') # (N, H, W, 4), the last channel is SNU's kappa
+  norm_xyz = torch.mul(norm_rgb, 2, out=arena.buffer('norm_xyz', norm_rgb.shape)).sub_(1) # (N, H, W, 4)
+
+  arena.wait('mask')
+  mask = _resize(mask, size, arena, 'mask') # (N, H, W, 1)
+  sil = _silhouette(mask, arena) # (N, H, W, 1)
+
+  # Camera parameters, with the intrinsics rescaled to the FOUND image size, staged through the
+  # arena's pinned host buffers
+  cameras = source_arkit.resized(size).to_tensors()
+  cameras = {k: arena.to_device(f'camera_{k}', cameras[k]) for k in ('R', 'T', 'pp', 'f')}
+  for k in cameras:
+    arena.wait(f'camera_{k}')
 
   result = {
-      'filename': source_arkit['filename'],
+      'filename': source_arkit.filename,
 
       # Camera parameters
-      'R': source_arkit['R'],
-      'T': source_arkit['T'],
-      'pp': map(lambda pp: pp * resize_fac, source_arkit['pp']),
-      'f': map(lambda f: f * resize_fac, source_arkit['f']),
+      'R': cameras['R'],
+      'T': cameras['T'],
+      'pp': cameras['pp'],
+      'f': cameras['f'],
 
       # Image data and predictions
-      'norm_xyz': norm_xyz.to(args.device),
-      'norm_kappa': mask.to(args.device),
-      'sil': sil.to(args.device),
+      'norm_xyz': norm_xyz,
+      'norm_kappa': mask,
+      'sil': sil,
   }
 
+  # SNU's normal uncertainty, resized with the normals
+  if norm_rgb.shape[-1] > 3:
+    result['snu_kappa'] = norm_rgb[..., 3:] # (N, H, W, 1)
+
   return result
\ No newline at end of file
@@ -0,0 +1,15 @@
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def calc_size(kps: dict) -> float:
+  logger.debug("Calculating foot size from keypoints")
+  big_toe = np.array(kps['big toe'])
+  heel = np.array(kps['heel'])
+
+  # As the foot points to +X, the foot size is determined by
+  # subtracting the X component of the farthest and the closest points.
+  foot_size = big_toe[0] - heel[0]
+  logger.debug(f"Calculated foot size: {foot_size}")
+  return foot_size
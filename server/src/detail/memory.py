@@ -0,0 +1,40 @@
+import os
+import torch
+
+# Fraction of the free memory a single micro-batch is allowed to occupy
+DEFAULT_MEMORY_FRACTION = 0.5
+
+def _get_free_host_memory() -> int:
+  try:
+    with open('/proc/meminfo', 'r') as f:
+      for line in f:
+        if line.startswith('MemAvailable:'):
+          return int(line.split()[1]) * 1024
+  except OSError:
+    pass
+
+  return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
+def get_free_memory(device: torch.device) -> int:
+  device = torch.device(device)
+  if device.type == 'cuda':
+    free, _ = torch.cuda.mem_get_info(device)
+    return free
+
+  return _get_free_host_memory()
+
+# Picks a micro-batch size for `num_items` items which need `bytes_per_item` bytes each.
+# An explicit batch size always wins, otherwise the batch is sized to fit into a fraction
+# of the currently free memory on the device.
+def determine_batch_size(
+  num_items: int,
+  bytes_per_item: int,
+  device: torch.device,
+  batch_size: int = None,
+  memory_fraction: float = DEFAULT_MEMORY_FRACTION
+) -> int:
+  if batch_size is not None:
+    return max(1, min(batch_size, num_items))
+
+  budget = get_free_memory(device) * memory_fraction
+  return max(1, min(int(budget // max(bytes_per_item, 1)), num_items))
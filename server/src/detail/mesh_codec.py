@@ -0,0 +1,142 @@
+import struct
+import hashlib
+import numpy as np
+
+# A compact binary mesh format ('fmsh'). Vertices are quantized to int16 relative to their
+# bounding box. Every fitted foot shares the FIND template topology, so results store only the
+# vertex offsets from the template and refer to it by its id, a digest of the encoded template.
+# The id changes with the template vertices too, e.g. with new FIND weights or another mesh
+# scale, so a result never resolves to a stale template. The template itself is stored once, as
+# a full mesh with faces.
+#
+# Layout, little endian:
+#   header    magic 'FMSH', version u8, flags u8, reserved u16, vertex count u32, face count u32
+#   reference 16 bytes, the template id in delta meshes, a digest of the faces in full meshes
+#   quant     center float32[3], scale float32[3], vertex = center + q * scale
+#   vertices  int16[vertex count, 3], absolute positions or offsets from the template vertices
+#   faces     uint16 or int32 [face count, 3], only present in full meshes
+
+MAGIC = b'FMSH'
+FORMAT_VERSION = 1
+CONTENT_TYPE = 'application/x-fmsh'
+
+FLAG_FACES = 1 # the faces follow the vertices
+FLAG_DELTA = 2 # the vertices are offsets from the template with the referenced id
+FLAG_FACES_U16 = 4 # the faces are stored as uint16
+
+_HEADER = struct.Struct('<4sBBHII')
+_QUANT = struct.Struct('<6f')
+_REFERENCE_BYTES = 16
+_QUANT_MAX = 32767
+
+def topology_id(faces: np.ndarray) -> str:
+  faces = np.ascontiguousarray(faces, dtype=np.int32)
+  return hashlib.blake2b(faces.tobytes(), digest_size=_REFERENCE_BYTES).hexdigest()
+
+def template_id(data: bytes) -> str:
+  return hashlib.blake2b(data, digest_size=_REFERENCE_BYTES).hexdigest()
+
+# The mesh results are encoded against: the FIND template with its id and encoding.
+# The vertices are the quantized ones, as readers decode them, so that the offsets of a result
+# don't add the template quantization error on top of their own.
+class MeshTemplate:
+  def __init__(self, verts: np.ndarray, faces: np.ndarray):
+    self.data = encode_mesh(verts, faces)
+    self.verts, self.faces = decode_mesh(self.data)
+    self.id = template_id(self.data)
+
+  @classmethod
+  def from_bytes(cls, data: bytes) -> 'MeshTemplate':
+    return cls(*decode_mesh(data))
+
+  @property
+  def name(self) -> str:
+    return f'{self.id}.fmsh'
+
+def _quantize(values: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+  lo, hi = values.min(axis=0), values.max(axis=0)
+  center = (lo + hi) / 2
+  scale = np.maximum((hi - lo) / (2 * _QUANT_MAX), np.finfo(np.float32).tiny)
+  q = np.clip(np.rint((values - center) / scale), -_QUANT_MAX, _QUANT_MAX).astype('<i2')
+  return q, center.astype(np.float32), scale.astype(np.float32)
+
+# With a template the vertices are stored as offsets from the template vertices and the faces
+# are left out, the template has to be stored separately
+def encode_mesh(verts: np.ndarray, faces: np.ndarray = None, template: MeshTemplate = None) -> bytes:
+  verts = np.asarray(verts, dtype=np.float64).reshape(-1, 3)
+
+  flags = 0
+  if template is not None:
+    if len(verts) != len(template.verts):
+      raise Exception('the mesh does not match the template topology')
+    flags |= FLAG_DELTA
+    reference = bytes.fromhex(template.id)
+    values = verts - template.verts
+    faces = None
+  else:
+    if faces is None:
+      raise Exception('full meshes need their faces')
+    faces = np.ascontiguousarray(faces, dtype=np.int32).reshape(-1, 3)
+    flags |= FLAG_FACES
+    if len(verts) <= np.iinfo(np.uint16).max + 1:
+      flags |= FLAG_FACES_U16
+    reference = bytes.fromhex(topology_id(faces))
+    values = verts
+
+  q, center, scale = _quantize(values)
+
+  parts = [
+    _HEADER.pack(MAGIC, FORMAT_VERSION, flags, 0, len(verts), 0 if faces is None else len(faces)),
+    reference,
+    _QUANT.pack(*center, *scale),
+    q.tobytes(),
+  ]
+  if faces is not None:
+    parts.append(faces.astype('<u2' if flags & FLAG_FACES_U16 else '<i4').tobytes())
+
+  return b''.join(parts)
+
+# The header fields of an encoded mesh, e.g. to find the template a result refers to
+def read_header(data: bytes) -> dict:
+  if len(data) < _HEADER.size + _REFERENCE_BYTES:
+    raise Exception('truncated mesh data')
+
+  magic, version, flags, _, num_verts, num_faces = _HEADER.unpack_from(data)
+  if magic != MAGIC:
+    raise Exception('not an fmsh mesh')
+  if version != FORMAT_VERSION:
+    raise Exception(f'unsupported fmsh version {version}')
+
+  delta = bool(flags & FLAG_DELTA)
+  reference = data[_HEADER.size:_HEADER.size + _REFERENCE_BYTES].hex()
+  return {
+    'version': version,
+    'delta': delta,
+    'flags': flags,
+    'num_verts': num_verts,
+    'num_faces': num_faces,
+    'template_id': reference if delta else None,
+    'topology_id': None if delta else reference,
+  }
+
+# Returns the float32 vertices and int32 faces. Results encoded against a template need it.
+def decode_mesh(data: bytes, template: MeshTemplate = None) -> tuple[np.ndarray, np.ndarray]:
+  header = read_header(data)
+  num_verts, num_faces, flags = header['num_verts'], header['num_faces'], header['flags']
+
+  offset = _HEADER.size + _REFERENCE_BYTES
+  quant = np.array(_QUANT.unpack_from(data, offset), dtype=np.float64)
+  offset += _QUANT.size
+
+  q = np.frombuffer(data, dtype='<i2', count=num_verts * 3, offset=offset).reshape(-1, 3)
+  offset += q.nbytes
+  values = quant[:3] + q * quant[3:]
+
+  if header['delta']:
+    if template is None or template.id != header['template_id']:
+      raise Exception(f"the mesh needs the template {header['template_id']}")
+    return (template.verts + values).astype(np.float32), template.faces
+
+  dtype = '<u2' if flags & FLAG_FACES_U16 else '<i4'
+  faces = np.frombuffer(data, dtype=dtype, count=num_faces * 3, offset=offset).reshape(-1, 3)
+  return values.astype(np.float32), faces.astype(np.int32)
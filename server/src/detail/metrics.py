@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import resource
+import threading
+import torch
+from contextlib import contextmanager
+
+# Lightweight per-request instrumentation: a Trace collects one Span per pipeline step with its
+# wall time, counters set by the step and the memory high-water marks. The summary is plain
+# JSON-serialisable data, so it can be returned in the handler response and exported as is.
+
+def _get_rss() -> int:
+  try:
+    with open('/proc/self/statm', 'r') as f:
+      return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+  except OSError:
+    return 0
+
+def _get_peak_rss() -> int:
+  # The high-water mark of the whole process, in kilobytes on Linux
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class Span:
+  def __init__(self, name: str, **attrs):
+    self.name = name
+    self.attrs = dict(attrs)
+    self.wall_s: float = None
+
+  def set(self, **attrs) -> None:
+    self.attrs.update(attrs)
+
+  def as_dict(self) -> dict:
+    return {'name': self.name, 'wall_s': self.wall_s, **self.attrs}
+
+# `shared_device` tells that other jobs use the device concurrently, see span
+class Trace:
+  def __init__(self, id: str, device: torch.device = None, shared_device: bool = False):
+    self.id = id
+    self.device = torch.device(device) if device is not None else None
+    self.shared_device = shared_device
+    self.spans: list[Span] = []
+    self._start = time.perf_counter()
+    self._lock = threading.Lock()
+
+  @property
+  def _is_cuda(self) -> bool:
+    return self.device is not None and self.device.type == 'cuda'
+
+  # Times the enclosed block. On CUDA the device is synchronised when the block ends, so that
+  # queued kernels are attributed to the span which launched them, and the device peak of the
+  # block is recorded. On a shared device only the calling thread's stream is synchronised and
+  # no peak is recorded, as the peak is device wide and resetting it would disturb other jobs.
+  @contextmanager
+  def span(self, name: str, **attrs):
+    span = Span(name, **attrs)
+    if self._is_cuda and not self.shared_device:
+      torch.cuda.reset_peak_memory_stats(self.device)
+
+    rss = _get_rss()
+    start = time.perf_counter()
+    try:
+      yield span
+    except Exception as e:
+      span.set(error=str(e))
+      raise
+    finally:
+      if self._is_cuda and self.shared_device:
+        torch.cuda.current_stream(self.device).synchronize()
+      elif self._is_cuda:
+        torch.cuda.synchronize(self.device)
+        span.set(device_peak_bytes=torch.cuda.max_memory_allocated(self.device))
+
+      span.wall_s = time.perf_counter() - start
+      span.set(host_rss_delta_bytes=_get_rss() - rss, host_peak_rss_bytes=_get_peak_rss())
+
+      with self._lock:
+        self.spans.append(span)
+
+  def summary(self) -> dict:
+    with self._lock:
+      return {
+        'id': self.id,
+        'wall_s': time.perf_counter() - self._start,
+        'spans': [span.as_dict() for span in self.spans],
+      }
+
+# Appends one JSON object per line to a file, safe to share between threads
+class JSONLExporter:
+  def __init__(self, path: str):
+    self.path = path
+    self._lock = threading.Lock()
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+  def export(self, record: dict) -> None:
+    line = json.dumps(record, default=str)
+    with self._lock:
+      with open(self.path, 'a') as f:
+        f.write(line + '\n')
+
+# Bytes and files moved by the fetch helpers, updated from the download threads
+class TransferStats:
+  def __init__(self):
+    self.files = 0
+    self.bytes = 0
+    self.cache_hits = 0
+    self.cached_bytes = 0
+    self._lock = threading.Lock()
+
+  def record(self, num_bytes: int, cached: bool = False) -> None:
+    with self._lock:
+      if cached:
+        self.cache_hits += 1
+        self.cached_bytes += num_bytes
+      else:
+        self.files += 1
+        self.bytes += num_bytes
+
+  def as_dict(self) -> dict:
+    return {
+      'downloaded_files': self.files,
+      'downloaded_bytes': self.bytes,
+      'cache_hits': self.cache_hits,
+      'cached_bytes': self.cached_bytes,
+    }
+
+# A FOUND loop hook which samples every `every`-th iteration: the time since the previous
+# sample, the loss of every task and the device memory in use
+class IterationProfiler:
+  def __init__(self, every: int = 10, device: torch.device = None):
+    if every < 1:
+      raise Exception('invalid profiler sampling interval provided')
+
+    self.every = every
+    self.device = torch.device(device) if device is not None else None
+    self.samples = []
+    self._last: float = None
+    self._iterations = 0
+
+  # Called after every iteration with its stage, image size, index within the level and task losses
+  def __call__(self, stage: str, image_size: tuple, iteration: int, losses: list[float]) -> None:
+    self._iterations += 1
+    if iteration % self.every != 0:
+      return
+
+    now = time.perf_counter()
+    sample = {
+      'stage': stage,
+      'image_size': list(image_size),
+      'iteration': iteration,
+      'losses': losses,
+      # averaged over the iterations since the previous sample, unknown for the first one
+      'ms_per_iteration': (now - self._last) * 1000.0 / self._iterations if self._last is not None else None,
+    }
+    if self.device is not None and self.device.type == 'cuda':
+      sample['device_bytes'] = torch.cuda.memory_allocated(self.device)
+
+    self.samples.append(sample)
+    self._last = now
+    self._iterations = 0
+
+  def as_dict(self) -> dict:
+    return {'every': self.every, 'samples': self.samples}
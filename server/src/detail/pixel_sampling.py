@@ -0,0 +1,91 @@
+import torch
+import torch.nn.functional as F
+
+from .make_batch import _kappa_to_alpha
+
+# Width in pixels of the band around a silhouette edge which counts as its boundary
+BOUNDARY_WIDTH = 5
+
+# Side in pixels of the square tiles the pixels are sampled in, every tile renders as a camera
+# of its own, see found._run_level. Larger tiles correlate the sampled pixels, with 8 and 16 the
+# foot length left the tolerance of bench.found_sampling.
+TILE_SIZE = 4
+
+def _as_maps(x: torch.Tensor) -> torch.Tensor:
+  # (N, H, W, 1) or (N, H, W) maps to (N, 1, H, W)
+  return (x[..., 0] if x.dim() == 4 else x).unsqueeze(1).float()
+
+def _dilate(x: torch.Tensor, width: int) -> torch.Tensor:
+  return F.max_pool2d(x, width, stride=1, padding=width // 2)
+
+# The pixels within `width` of a silhouette edge, (N, 1, H, W) in {0, 1}
+def boundary_band(sil: torch.Tensor, width: int = BOUNDARY_WIDTH) -> torch.Tensor:
+  x = _as_maps(sil)
+  return _dilate(x, width) + _dilate(-x, width)
+
+# Sampling weights (N, H, W) of the pixels of every view: the boundary band of the target
+# silhouette and, if given, of the rendered one, plus SNU's normal uncertainty (the expected
+# angle error of its kappa, up to 90 degrees) within the dilated target silhouette. Background
+# and interior pixels far from an edge keep a small weight.
+def pixel_importance(batch: dict, rendered_sil: torch.Tensor = None, width: int = BOUNDARY_WIDTH) -> torch.Tensor:
+  target = batch['sil']
+  score = boundary_band(target, width)
+  if rendered_sil is not None:
+    score = torch.maximum(score, boundary_band(rendered_sil.detach() > 0.5, width))
+
+  if 'snu_kappa' in batch:
+    alpha = _as_maps(_kappa_to_alpha(batch['snu_kappa'].float())) / 90
+    score = score + alpha.clamp(0, 1) * _dilate(_as_maps(target), width)
+  return score[:, 0] + 1e-3
+
+# Draws `num_tiles` distinct tiles of `tile` pixels per view from a grid over the image, a mix of
+# `importance_ratio` by the mean `score` of the tiles and the rest uniform, like SNU's
+# uncertainty-guided sampling. The last row and column of the grid are flush with the image
+# edges. Returns the (N, K, 2) top left (row, column) corners of the tiles.
+def sample_tiles(score: torch.Tensor, num_tiles: int, importance_ratio: float, tile: int = TILE_SIZE) -> torch.Tensor:
+  height, width = score.shape[1:]
+  pooled = F.avg_pool2d(score.unsqueeze(1).float(), tile, stride=tile, ceil_mode=True)[:, 0] # (N, rows, cols)
+  rows, cols = pooled.shape[1:]
+
+  weights = pooled.flatten(1)
+  weights = importance_ratio * weights / weights.sum(dim=1, keepdim=True) + (1 - importance_ratio) / weights.shape[1]
+  chosen = torch.multinomial(weights, min(num_tiles, weights.shape[1]), replacement=False)
+
+  top = (chosen // cols * tile).clamp(max=height - tile)
+  left = (chosen % cols * tile).clamp(max=width - tile)
+  return torch.stack([top, left], dim=2)
+
+# The flat pixel indices (N, K * tile * tile) of the tiles, tile by tile and row by row within a
+# tile, the order in which the tiles' renders are flattened by gather_tiles
+def tile_pixels(corners: torch.Tensor, image_size: tuple[int, int], tile: int = TILE_SIZE) -> torch.Tensor:
+  offsets = torch.arange(tile, device=corners.device)
+  rows = corners[..., 0, None, None] + offsets[:, None] # (N, K, tile, 1)
+  cols = corners[..., 1, None, None] + offsets[None, :] # (N, K, 1, tile)
+  return (rows * image_size[1] + cols).flatten(1)
+
+# Replaces the per-view (N, H, W, ...) maps of `tensors` with (N, 1, S, ...) rows of the sampled
+# pixels, so that per-pixel losses see an image of one row. Everything else is kept as it is.
+def gather_pixels(tensors: dict, index: torch.Tensor, image_size: tuple[int, int]) -> dict:
+  num_views, num_samples = index.shape
+  sampled = {}
+  for k, v in tensors.items():
+    if isinstance(v, torch.Tensor) and v.dim() >= 3 and v.shape[0] == num_views and tuple(v.shape[1:3]) == tuple(image_size):
+      flat = v.flatten(1, 2)
+      flat_index = index.view(num_views, num_samples, *[1] * (flat.dim() - 2)).expand(-1, -1, *flat.shape[2:])
+      sampled[k] = flat.gather(1, flat_index).unsqueeze(1)
+    else:
+      sampled[k] = v
+
+  return sampled
+
+# Replaces the per-tile (N * K, tile, tile, ...) maps of a render of the tiles with (N, 1, S, ...)
+# rows, the layout of gather_pixels at the indices of tile_pixels
+def gather_tiles(res: dict, num_views: int, num_tiles: int, tile: int = TILE_SIZE) -> dict:
+  gathered = {}
+  for k, v in res.items():
+    if isinstance(v, torch.Tensor) and v.dim() >= 3 and v.shape[0] == num_views * num_tiles and tuple(v.shape[1:3]) == (tile, tile):
+      gathered[k] = v.reshape(num_views, num_tiles * tile * tile, *v.shape[3:]).unsqueeze(1)
+    else:
+      gathered[k] = v
+
+  return gathered
@@ -3,11 +3,9 @@ import json
 import numpy as np
 from scipy.spatial.transform import Rotation
 
-from .config import IMAGE_SIZE, INTERMEDIATE_IMAGE_SIZE
+from .config import IMAGE_SIZE
 from .types import ARKitSource
 
-DOWNSCALE_FACTOR = INTERMEDIATE_IMAGE_SIZE / IMAGE_SIZE
-
 # arkit to pytorch3d coordinate system transformation matrix
 TRANSF_A2P = np.diag([-1., 1., -1.])
 
@@ -24,28 +22,53 @@ def _load_arkit_data_from_file(path: str) -> dict:
       with open(image.path, 'r') as f:
         json_data = json.load(f)
 
-    image_name = image.name[:-5] + '.jpg'
-    arkit_data[image_name] = json_data
+      image_name = image.name[:-5] + '.jpg'
+      arkit_data[image_name] = json_data
 
   return arkit_data
 
-def _serialize_arkit_data(data: dict) -> ARKitSource:
-  result = {
-    'filename': [],
-    'R': [], # world-to-camera rotation transform matrix
-    'T': [], # world-to-camera translation vector
-    'pp': [], # downscaled principal point coordinates
-    'f': [], # downscaled focal length
+# The constant transforms applied to every camera rotation, folded where the folding is exact.
+# R = ROTATE_NEG90_Z.T @ TRANSF_A2P @ E.T @ ROTATE_90_X.T @ ROTATE_180_Z.T, where E is the ARKit
+# euler rotation. TRANSF_A2P only flips signs, so the left product is exact. The right-hand
+# rotations carry rounding noise and are kept as two products to match the reference results.
+ROTATION_LEFT = ROTATE_NEG90_Z.T @ TRANSF_A2P
+ROTATION_RIGHT_X = ROTATE_90_X.T
+ROTATION_RIGHT_Z = ROTATE_180_Z.T
+
+def stack_cameras(data: dict) -> tuple[list[str], dict[str, np.ndarray]]:
+  filenames = list(data.keys())
+  cameras = list(data.values())
+
+  def stack(*keys):
+    return np.array([[camera[k] for k in keys] for camera in cameras], dtype=np.float64).reshape(len(cameras), len(keys))
+
+  return filenames, {
+    'angles': stack('angleX', 'angleY', 'angleZ'), # (N, 3)
+    'centers': stack('x', 'y', 'z'), # (N, 3)
+    'pp': stack('oy', 'ox'), # (N, 2)
+    'f': stack('fx')[:, 0], # (N,)
   }
 
-  for filename, camera in data.items():
-    result['filename'].append(filename)
-    result['R'].append(camera['R'].tolist())
-    result['T'].append(camera['T'].tolist())
-    result['pp'].append(camera['pp'].tolist())
-    result['f'].append(camera['f'])
-  
-  return result
+def _serialize_arkit_data(filenames: list[str], R, T, C, pp, f) -> ARKitSource:
+  # ARKitSource packs everything into contiguous float32 arrays. The intrinsics stay in pixels of
+  # the camera images and are rescaled to whatever size they're used at.
+  return ARKitSource(filename=filenames, R=R, T=T, C=C, pp=pp, f=f, image_size=IMAGE_SIZE)
+
+# The world-to-camera rotations (N, 3, 3), translations (N, 3) and camera centers (N, 3) of the
+# stacked cameras, in float64
+def convert_cameras(cameras: dict[str, np.ndarray]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+  # move the cameras and apply the Z-flip (TODO: FIXME), with the centers as row vectors
+  C = cameras['centers'] @ ROTATE_90_X.T @ ROTATE_180_Z.T # (N, 3)
+
+  # calculate R: flip the orientation from landscape to portrait, rotate the cameras and
+  # apply the Z-flip (TODO: FIXME)
+  R = ROTATION_LEFT @ Rotation.from_euler('xyz', cameras['angles']).as_matrix().transpose(0, 2, 1)
+  R = R @ ROTATION_RIGHT_X @ ROTATION_RIGHT_Z # (N, 3, 3)
+
+  # calculate T = -R @ C, as row vectors times a contiguous -R^T, which keeps the same
+  # summation order as the per-camera products
+  T = (C[:, None, :] @ np.ascontiguousarray(-R.transpose(0, 2, 1)))[:, 0] # (N, 3)
+  return R, T, C
 
 def process_arkit(path: str, custom_loader=None, **loader_kwargs) -> ARKitSource:
   if custom_loader:
@@ -53,44 +76,10 @@ def process_arkit(path: str, custom_loader=None, **loader_kwargs) -> ARKitSource
   else:
     data = _load_arkit_data_from_file(path)
 
-  for _, camera in data.items():
-    # downscale pp and f
-    camera['pp'] = np.array([camera['oy'], camera['ox']]) * DOWNSCALE_FACTOR
-    camera['f'] = camera['fx'] * DOWNSCALE_FACTOR[0]
-
-    # world center coordinate
-    camera['C'] = np.array([
-        camera['x'],
-        camera['y'],
-        camera['z']
-    ])
-
-    # move the cameras
-    camera['C'] = ROTATE_90_X @ camera['C']
-    
-    # TODO: FIXME: Apply a Z-flip
-    camera['C'] = ROTATE_180_Z @ camera['C']
-
-    # calculate R
-    camera['R'] = TRANSF_A2P @ Rotation.from_euler(
-      'xyz',
-      [
-        camera['angleX'],
-        camera['angleY'],
-        camera['angleZ']
-      ]
-    ).as_matrix().T
-
-    # flip the orientation from landscape to portrait
-    camera['R'] = (camera['R'].T @ ROTATE_NEG90_Z).T
-
-    # rotate the cameras
-    camera['R'] = (ROTATE_90_X @ camera['R'].T).T
-    
-    # TODO: FIXME: Apply a Z-flip
-    camera['R'] = (ROTATE_180_Z @ camera['R'].T).T
-
-    # calculate T
-    camera['T'] = (-camera['R'] @ camera['C'][:, None])[..., 0]
-
-  return _serialize_arkit_data(data)
\ No newline at end of file
+  filenames, cameras = stack_cameras(data)
+  if not filenames:
+    empty = np.zeros((0, 3))
+    return _serialize_arkit_data(filenames, np.zeros((0, 3, 3)), empty, empty, np.zeros((0, 2)), np.zeros((0,)))
+
+  R, T, C = convert_cameras(cameras)
+  return _serialize_arkit_data(filenames, R, T, C, cameras['pp'], cameras['f'])
@@ -0,0 +1,55 @@
+import math
+import numpy as np
+from collections import namedtuple
+
+from .config import IMAGE_SIZE, INTERMEDIATE_IMAGE_SIZE, FOUND_IMAGE_SIZE
+
+# The SNU encoder downsamples by 32, so the model input sizes are kept at multiples of it
+SIZE_MULTIPLE = 32
+
+# Resolution of SNU and SAM as a multiple of the FOUND resolution.
+# None runs them at the largest size, INTERMEDIATE_IMAGE_SIZE.
+QUALITY_SCALES = {
+  'low': 2,
+  'medium': 4,
+  'high': None,
+}
+
+# All sizes are (W, H) integer tuples:
+# - source_size: the camera images, which the raw ARKit intrinsics are expressed in
+# - model_size: the images are decoded to this size and run through SNU and SAM as they are
+# - found_size: the predictions are resized to this size once per FOUND resolution level
+ResolutionPlan = namedtuple('ResolutionPlan', 'quality source_size model_size found_size')
+
+def _as_size(size) -> tuple[int, int]:
+  return tuple(int(x) for x in size)
+
+# The smallest scale step which keeps both sides of the FOUND size at multiples of SIZE_MULTIPLE
+def _scale_step(found_size: tuple[int, int]) -> int:
+  return SIZE_MULTIPLE // math.gcd(SIZE_MULTIPLE, math.gcd(*found_size))
+
+# Picks the resolution of every model from the FOUND size and the quality setting.
+# FOUND_IMAGE_SIZE is given as (H, W), the way FOUND and its renderer take it.
+def plan_resolutions(quality: str = 'high', found_size=FOUND_IMAGE_SIZE[::-1], max_size=INTERMEDIATE_IMAGE_SIZE, source_size=IMAGE_SIZE) -> ResolutionPlan:
+  if quality not in QUALITY_SCALES:
+    raise Exception(f'invalid resolution quality provided: {quality}')
+
+  found_size = _as_size(found_size)
+  max_size = _as_size(max_size)
+
+  scale = QUALITY_SCALES[quality]
+  if scale is None:
+    model_size = max_size
+  else:
+    step = _scale_step(found_size)
+    scale = step * math.ceil(scale / step)
+    model_size = tuple(x * scale for x in found_size)
+
+    # Never upsample beyond the largest size
+    if model_size[0] > max_size[0] or model_size[1] > max_size[1]:
+      model_size = max_size
+
+  if not np.isclose(model_size[0] * found_size[1], model_size[1] * found_size[0]):
+    raise Exception('the model and FOUND resolutions have different aspect ratios')
+
+  return ResolutionPlan(quality, _as_size(source_size), model_size, found_size)
@@ -0,0 +1,233 @@
+import abc
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_MAX_ENTRIES = 10000
+RESULT_CACHE_MAX_BYTES = 1024 ** 3
+RESULT_CACHE_TTL = 7 * 24 * 3600 # seconds, None keeps results until they are evicted
+
+# A finished pipeline result: the foot size, the keypoints and the fitted mesh encoded by
+# detail.mesh_codec. Records are split into JSON metadata and the mesh, stored as a blob.
+def make_record(foot_size: float, kps: dict, mesh: bytes = None) -> dict:
+  return {'foot_size': float(foot_size), 'kps': kps, 'mesh': mesh}
+
+def _encode_record(record: dict) -> tuple[str, bytes]:
+  meta = {k: v for k, v in record.items() if k != 'mesh'}
+  return json.dumps(meta), record.get('mesh') or b''
+
+def _decode_record(meta: str, blob: bytes) -> dict:
+  record = json.loads(meta)
+  record['mesh'] = bytes(blob) if blob else None
+  return record
+
+# The storage interface of the result cache. Stores only need to be safe to call from several
+# threads; a remote store (e.g. a table in Supabase) can implement the same three methods.
+class ResultStore(abc.ABC):
+  @abc.abstractmethod
+  def get(self, key: str) -> dict:
+    pass
+
+  @abc.abstractmethod
+  def put(self, key: str, record: dict) -> None:
+    pass
+
+  def stats(self) -> dict:
+    return {}
+
+# A result store in a local SQLite database. Entries expire after `ttl` seconds and the least
+# recently used ones are evicted once there are more than `max_entries` or `max_bytes` of them.
+class SQLiteResultStore(ResultStore):
+  def __init__(self, path: str, max_entries: int = RESULT_CACHE_MAX_ENTRIES, max_bytes: int = RESULT_CACHE_MAX_BYTES, ttl: float = RESULT_CACHE_TTL):
+    self.path = path
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.ttl = ttl
+    self.evictions = 0
+
+    self._lock = threading.Lock()
+    self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    self._db.execute('PRAGMA journal_mode=WAL')
+    self._db.execute(
+      'CREATE TABLE IF NOT EXISTS results ('
+      'key TEXT PRIMARY KEY, created REAL, accessed REAL, size INTEGER, meta TEXT, blob BLOB)'
+    )
+    self._db.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+
+  def _is_expired(self, created: float, now: float) -> bool:
+    return self.ttl is not None and now - created > self.ttl
+
+  def get(self, key: str) -> dict:
+    now = time.time()
+    with self._lock:
+      row = self._db.execute('SELECT created, meta, blob FROM results WHERE key = ?', (key,)).fetchone()
+      if row is None:
+        return None
+
+      created, meta, blob = row
+      if self._is_expired(created, now):
+        self._db.execute('DELETE FROM results WHERE key = ?', (key,))
+        self.evictions += 1
+        return None
+
+      self._db.execute('UPDATE results SET accessed = ? WHERE key = ?', (now, key))
+
+    return _decode_record(meta, blob)
+
+  def put(self, key: str, record: dict) -> None:
+    meta, blob = _encode_record(record)
+    now = time.time()
+
+    with self._lock:
+      self._db.execute(
+        'INSERT OR REPLACE INTO results (key, created, accessed, size, meta, blob) VALUES (?, ?, ?, ?, ?, ?)',
+        (key, now, now, len(meta) + len(blob), meta, blob)
+      )
+      self._evict(now)
+
+  def _evict(self, now: float) -> None:
+    if self.ttl is not None:
+      self.evictions += self._db.execute('DELETE FROM results WHERE created < ?', (now - self.ttl,)).rowcount
+
+    # Drop the least recently used entries until both limits hold
+    entries, size = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+    if entries <= self.max_entries and size <= self.max_bytes:
+      return
+
+    for key, entry_size in self._db.execute('SELECT key, size FROM results ORDER BY accessed').fetchall():
+      if entries <= self.max_entries and size <= self.max_bytes:
+        break
+
+      self._db.execute('DELETE FROM results WHERE key = ?', (key,))
+      entries -= 1
+      size -= entry_size
+      self.evictions += 1
+
+  def stats(self) -> dict:
+    with self._lock:
+      entries, size = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+
+    return {
+      'entries': entries,
+      'bytes': size,
+      'evictions': self.evictions,
+      'policy': {'max_entries': self.max_entries, 'max_bytes': self.max_bytes, 'ttl_s': self.ttl},
+    }
+
+# A computation shared by every request for the same key while it runs
+class _InFlight:
+  def __init__(self):
+    self.done = threading.Event()
+    self.record: dict = None
+    self.error: Exception = None
+
+# Caches pipeline results under a hash of the task inputs and the pipeline version. Requests for
+# a key which is already being computed wait for that computation instead of starting their own.
+# Store failures are logged and treated as misses, they never fail a request.
+class ResultCache:
+  def __init__(self, store: ResultStore, version: str):
+    self.store = store
+    self.version = version
+
+    self.hits = 0
+    self.misses = 0
+    self.coalesced = 0
+    self.errors = 0
+
+    self._in_flight: dict[str, _InFlight] = {}
+    self._lock = threading.Lock()
+
+  # Hashes the (name, content hash) pairs of the input files together with the version.
+  # Returns None if any file has no content hash, in which case the task isn't cached.
+  def key(self, files: dict[str, str]) -> str:
+    if not files or any(not version for version in files.values()):
+      return None
+
+    digest = hashlib.sha256(self.version.encode('utf-8'))
+    for name in sorted(files):
+      digest.update(f'\0{name}\0{files[name]}'.encode('utf-8'))
+    return digest.hexdigest()
+
+  def _get(self, key: str) -> dict:
+    try:
+      return self.store.get(key)
+    except Exception as e:
+      with self._lock:
+        self.errors += 1
+      logger.warning(f"Result cache lookup failed ({str(e)})")
+      return None
+
+  def _put(self, key: str, record: dict) -> None:
+    try:
+      self.store.put(key, record)
+    except Exception as e:
+      with self._lock:
+        self.errors += 1
+      logger.warning(f"Failed to store the result in the cache ({str(e)})")
+
+  # Returns the record for the key and how it was obtained: 'hit', 'coalesced' or 'miss'.
+  # `compute` is called without arguments on a miss and must return a record.
+  def get_or_compute(self, key: str, compute) -> tuple[dict, str]:
+    if key is None:
+      return compute(), 'miss'
+
+    record = self._get(key)
+    if record is not None:
+      with self._lock:
+        self.hits += 1
+      return record, 'hit'
+
+    with self._lock:
+      in_flight = self._in_flight.get(key)
+      owner = in_flight is None
+      if owner:
+        in_flight = self._in_flight[key] = _InFlight()
+        self.misses += 1
+      else:
+        self.coalesced += 1
+
+    if not owner:
+      in_flight.done.wait()
+      if in_flight.error is not None:
+        raise in_flight.error
+      return in_flight.record, 'coalesced'
+
+    try:
+      # Another request may have stored the result between the lookup and taking ownership
+      record = self._get(key)
+      if record is not None:
+        in_flight.record = record
+        return record, 'hit'
+
+      in_flight.record = compute()
+      self._put(key, in_flight.record)
+      return in_flight.record, 'miss'
+    except Exception as e:
+      in_flight.error = e
+      raise
+    finally:
+      with self._lock:
+        del self._in_flight[key]
+      in_flight.done.set()
+
+  def stats(self) -> dict:
+    with self._lock:
+      lookups = self.hits + self.misses + self.coalesced
+      stats = {
+        'hits': self.hits,
+        'misses': self.misses,
+        'coalesced': self.coalesced,
+        'errors': self.errors,
+        'hit_rate': (self.hits + self.coalesced) / lookups if lookups else 0.0,
+      }
+
+    try:
+      stats['store'] = self.store.stats()
+    except Exception as e:
+      logger.warning(f"Failed to read the result cache statistics ({str(e)})")
+    return stats
@@ -0,0 +1,28 @@
+from collections import namedtuple
+
+# The optimisation stages of the FOUND fits, kept apart from found.py so that the result cache
+# version can include them without importing FOUND.
+#
+# num_epochs is the iteration budget of every resolution level in `scales`, which are fractions
+# of the FOUND image size optimised coarse to fine. A level stops early once the loss hasn't
+# improved by more than `rel_tol` (relative) for `patience` iterations, but not before `min_epochs`.
+# A patience of None disables early stopping, unless it's enabled for all stages.
+Stage = namedtuple(
+  'Stage',
+  'name num_epochs lr params losses patience rel_tol min_epochs scales',
+  defaults=(None, 1e-4, 0, (1.0,))
+)
+STAGES = [
+#	Stage('Registration', 50, .001, ['reg'], ['kp_nll']), // not implemented yet
+	Stage('Deform verts', 250, .001, ['deform', 'reg'], ['sil', 'norm_nll'], rel_tol=1e-4, min_epochs=50),
+]
+
+# Patience of the stages without one when early stopping is enabled. It's off by default until
+# bench.found_schedule shows the foot length staying within tolerance of the full budget.
+EARLY_STOPPING_PATIENCE = 25
+
+# The stages with the early stopping patience filled in if it's enabled
+def with_early_stopping(stages: list[Stage], early_stopping: bool) -> list[Stage]:
+  if not early_stopping:
+    return stages
+  return [stage._replace(patience=EARLY_STOPPING_PATIENCE) if stage.patience is None else stage for stage in stages]
@@ -0,0 +1,101 @@
+import torch
+import numpy as np
+
+from .types import ARKitSource, Predictions
+
+# Width the images are reduced to before computing the sharpness score
+SHARPNESS_IMAGE_WIDTH = 256
+
+class ViewSelectionArgs:
+  def __init__(self, **kwargs):
+    # Upper bound on the number of views kept, None keeps all of them
+    self.max_views = kwargs.get('max_views', None)
+
+    # Weight of the camera position relative to the viewing direction in the pose distance
+    self.position_weight = kwargs.get('position_weight', 1.0)
+
+    # Views with a sharpness score below this fraction of the median score are dropped,
+    # None disables the blur filter
+    self.min_relative_sharpness = kwargs.get('min_relative_sharpness', None)
+
+    if self.max_views is not None and self.max_views < 1:
+      raise Exception('invalid maximum number of views provided')
+
+  @property
+  def enabled(self) -> bool:
+    return self.max_views is not None or self.min_relative_sharpness is not None
+
+def _pose_features(source_arkit: ARKitSource, position_weight: float) -> np.ndarray:
+  # The optical axis of a world-to-camera rotation R is its third row
+  directions = source_arkit.R[:, 2, :].astype(np.float64)
+  directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+
+  # Normalise the positions by the radius of the capture so that both terms are comparable
+  centers = source_arkit.C.astype(np.float64)
+  centers = centers - centers.mean(axis=0)
+  radius = np.linalg.norm(centers, axis=1).max()
+  if radius > 0:
+    centers /= radius
+
+  return np.concatenate([directions, centers * position_weight], axis=1) # (N, 6)
+
+# Greedily picks the view farthest from all views picked so far, starting from the first one
+def _farthest_point_sampling(features: np.ndarray, k: int) -> np.ndarray:
+  n = features.shape[0]
+  if k >= n:
+    return np.arange(n)
+
+  chosen = [0]
+  distances = np.linalg.norm(features - features[0], axis=1)
+  for _ in range(k - 1):
+    i = int(np.argmax(distances))
+    chosen.append(i)
+    distances = np.minimum(distances, np.linalg.norm(features - features[i], axis=1))
+
+  return np.sort(np.array(chosen))
+
+# Picks at most `max_views` views with maximally diverse viewing directions and positions
+def select_diverse_views(source_arkit: ARKitSource, max_views: int, position_weight: float = 1.0) -> np.ndarray:
+  if max_views is None or max_views >= len(source_arkit):
+    return np.arange(len(source_arkit))
+
+  return _farthest_point_sampling(_pose_features(source_arkit, position_weight), max_views)
+
+# The variance of the Laplacian of the reduced grayscale image, higher is sharper.
+# Accepts PIL images as well as (H, W, 3) uint8 arrays.
+def sharpness(image) -> float:
+  rgb = np.asarray(image)
+  step = max(1, rgb.shape[1] // SHARPNESS_IMAGE_WIDTH)
+
+  x = rgb[::step, ::step, :3].astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+  laplacian = x[:-2, 1:-1] + x[2:, 1:-1] + x[1:-1, :-2] + x[1:-1, 2:] - 4 * x[1:-1, 1:-1]
+  return float(laplacian.var())
+
+# Indices of the images whose sharpness is at least the given fraction of the median
+def select_sharp_views(images: list, min_relative_sharpness: float) -> np.ndarray:
+  if min_relative_sharpness is None or not images:
+    return np.arange(len(images))
+
+  scores = np.array([sharpness(image) for image in images])
+  return np.flatnonzero(scores >= np.median(scores) * min_relative_sharpness)
+
+# Drops blurry views first and then picks the most diverse poses among the remaining ones.
+# Returns sorted indices into the original views.
+def select_views(source_arkit: ARKitSource, images: list, args: ViewSelectionArgs) -> np.ndarray:
+  sharp = select_sharp_views(images, args.min_relative_sharpness)
+  diverse = select_diverse_views(source_arkit[sharp], args.max_views, args.position_weight)
+  return sharp[diverse]
+
+# Applies the same view indices to the images, the ARKit bundle and, if given, the predictions
+def subset_views(indices: np.ndarray, images: list, source_arkit: ARKitSource, predictions: Predictions = None) -> tuple:
+  images = [images[i] for i in indices]
+  source_arkit = source_arkit[indices]
+
+  if predictions is None:
+    return images, source_arkit
+
+  predictions = {
+    k: v[torch.as_tensor(indices, dtype=torch.long, device=v.device)] if isinstance(v, torch.Tensor) else v
+    for k, v in predictions.items()
+  }
+  return images, source_arkit, predictions
@@ -0,0 +1,212 @@
+import time
+import queue
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 8
+
+# Marks the end of the stream on a stage queue
+_END = object()
+
+class StageStats:
+  def __init__(self, name: str):
+    self.name = name
+    self.items = 0
+    self.batches = 0
+    self.busy_time = 0.0 # time spent inside the stage function
+    self.input_stall_time = 0.0 # time spent waiting for input items
+    self.output_stall_time = 0.0 # time spent blocked on a full output queue
+    self.max_queue_depth = 0
+    self._depth_sum = 0
+    self._depth_samples = 0
+    self._lock = threading.Lock()
+
+  def sample_depth(self, depth: int) -> None:
+    with self._lock:
+      self.max_queue_depth = max(self.max_queue_depth, depth)
+      self._depth_sum += depth
+      self._depth_samples += 1
+
+  def record(self, items: int = 0, busy: float = 0.0, input_stall: float = 0.0, output_stall: float = 0.0) -> None:
+    with self._lock:
+      self.items += items
+      self.batches += 1 if items else 0
+      self.busy_time += busy
+      self.input_stall_time += input_stall
+      self.output_stall_time += output_stall
+
+  def as_dict(self) -> dict:
+    return {
+      'items': self.items,
+      'batches': self.batches,
+      'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+      'busy_s': self.busy_time,
+      'input_stall_s': self.input_stall_time,
+      'output_stall_s': self.output_stall_time,
+      'max_queue_depth': self.max_queue_depth,
+      'mean_queue_depth': self._depth_sum / self._depth_samples if self._depth_samples else 0.0,
+    }
+
+# A pipeline stage. `fn` takes a list of items and returns a list of results of the same length.
+# Items are batched dynamically: a worker blocks for the first item and then takes whatever
+# else has arrived, waiting at most `max_wait` seconds, up to `batch_size` items.
+class Stage:
+  def __init__(self, name: str, fn, batch_size: int = 1, max_wait: float = 0.0, workers: int = 1, queue_size: int = DEFAULT_QUEUE_SIZE):
+    self.name = name
+    self.fn = fn
+    self.batch_size = batch_size
+    self.max_wait = max_wait
+    self.workers = workers
+    self.queue_size = queue_size
+
+    if batch_size < 1 or workers < 1:
+      raise Exception(f'invalid configuration of the stage {name}')
+
+class _Failure:
+  def __init__(self):
+    self.error: BaseException = None
+    self.event = threading.Event()
+
+  def set(self, error: BaseException) -> None:
+    if not self.event.is_set():
+      self.error = error
+      self.event.set()
+
+# Runs items through a chain of stages connected by bounded queues, so that the stages overlap.
+# Results are returned in the order of the input items.
+class StagePipeline:
+  def __init__(self, stages: list[Stage]):
+    self.stages = stages
+    self.stats = {stage.name: StageStats(stage.name) for stage in stages}
+
+  def _put(self, q: queue.Queue, item, failure: _Failure) -> None:
+    while not failure.event.is_set():
+      try:
+        q.put(item, timeout=0.1)
+        return
+      except queue.Full:
+        pass
+
+  def _get(self, q: queue.Queue, failure: _Failure, timeout: float = None):
+    deadline = None if timeout is None else time.perf_counter() + timeout
+    while not failure.event.is_set():
+      wait = 0.1 if deadline is None else min(0.1, deadline - time.perf_counter())
+      if wait <= 0:
+        raise queue.Empty
+      try:
+        return q.get(timeout=wait)
+      except queue.Empty:
+        pass
+    raise queue.Empty
+
+  def _next_batch(self, stage: Stage, in_q: queue.Queue, failure: _Failure) -> tuple[list, bool]:
+    stats = self.stats[stage.name]
+
+    start = time.perf_counter()
+    try:
+      first = self._get(in_q, failure)
+    finally:
+      stats.record(input_stall=time.perf_counter() - start)
+    if first is _END:
+      return [], True
+
+    batch = [first]
+    deadline = time.perf_counter() + stage.max_wait
+    while len(batch) < stage.batch_size:
+      try:
+        item = in_q.get_nowait() if stage.max_wait <= 0 else self._get(in_q, failure, deadline - time.perf_counter())
+      except queue.Empty:
+        break
+
+      if item is _END:
+        return batch, True
+      batch.append(item)
+
+    return batch, False
+
+  def _worker(self, stage: Stage, in_q: queue.Queue, out_q: queue.Queue, failure: _Failure, done: threading.Barrier) -> None:
+    stats = self.stats[stage.name]
+
+    try:
+      finished = False
+      while not finished and not failure.event.is_set():
+        stats.sample_depth(in_q.qsize())
+        batch, finished = self._next_batch(stage, in_q, failure)
+        if finished:
+          # Let the other workers of this stage see the end of the stream too
+          self._put(in_q, _END, failure)
+        if not batch:
+          continue
+
+        start = time.perf_counter()
+        results = stage.fn([item for _, item in batch])
+        busy = time.perf_counter() - start
+
+        if len(results) != len(batch):
+          raise Exception(f'stage {stage.name} returned {len(results)} results for {len(batch)} items')
+
+        start = time.perf_counter()
+        for (index, _), result in zip(batch, results):
+          self._put(out_q, (index, result), failure)
+        stats.record(items=len(batch), busy=busy, output_stall=time.perf_counter() - start)
+    except queue.Empty:
+      pass
+    except BaseException as e:
+      logger.error(f"Stage {stage.name} failed: {str(e)}")
+      failure.set(e)
+    finally:
+      # The last worker of a stage to finish closes the stream for the next stage
+      if done.wait() == 0:
+        self._put(out_q, _END, failure)
+
+  def run(self, items) -> list:
+    failure = _Failure()
+    queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+    queues.append(queue.Queue())
+
+    threads = []
+    for stage, in_q, out_q in zip(self.stages, queues[:-1], queues[1:]):
+      done = threading.Barrier(stage.workers)
+      for i in range(stage.workers):
+        threads.append(threading.Thread(
+          target=self._worker,
+          args=(stage, in_q, out_q, failure, done),
+          name=f'stage-{stage.name}-{i}',
+          daemon=True
+        ))
+
+    for t in threads:
+      t.start()
+
+    try:
+      count = 0
+      for index, item in enumerate(items):
+        self._put(queues[0], (index, item), failure)
+        count += 1
+      self._put(queues[0], _END, failure)
+    except BaseException as e:
+      failure.set(e)
+
+    results = {}
+    while not failure.event.is_set():
+      try:
+        entry = self._get(queues[-1], failure)
+      except queue.Empty:
+        break
+      if entry is _END:
+        break
+      index, result = entry
+      results[index] = result
+
+    for t in threads:
+      t.join()
+
+    if failure.error is not None:
+      raise failure.error
+
+    return [results[i] for i in range(count)]
+
+  def summary(self) -> dict:
+    return {name: stats.as_dict() for name, stats in self.stats.items()}
@@ -1,5 +1,102 @@
+import torch
+import numpy as np
 from torch import Tensor
+from dataclasses import dataclass
 
 # A list of 'mask' (B, 1, H, W) and 'norm' (B, 3, H, W) predictions
 Predictions = dict[Tensor, Tensor]
-ARKitSource = dict
\ No newline at end of file
+
+def _pack(x) -> np.ndarray:
+  return np.ascontiguousarray(x, dtype=np.float32)
+
+# A bundle of N ARKit cameras backed by contiguous float32 arrays.
+# Indexing with an int, slice, list or index array selects views and returns a new bundle;
+# slices share memory with the original arrays.
+@dataclass(slots=True)
+class ARKitSource:
+  filename: list[str]
+  R: np.ndarray # (N, 3, 3) world-to-camera rotation transform matrices
+  T: np.ndarray # (N, 3) world-to-camera translation vectors
+  C: np.ndarray # (N, 3) camera centers in world coordinates
+  pp: np.ndarray # (N, 2) principal point coordinates
+  f: np.ndarray # (N,) focal lengths
+  image_size: tuple = None # (W, H) of the images the intrinsics are expressed in pixels of
+
+  def __post_init__(self):
+    self.filename = list(self.filename)
+    self.R = _pack(self.R).reshape(-1, 3, 3)
+    self.T = _pack(self.T).reshape(-1, 3)
+    self.C = _pack(self.C).reshape(-1, 3)
+    self.pp = _pack(self.pp).reshape(-1, 2)
+    self.f = _pack(self.f).reshape(-1)
+
+    if self.image_size is not None:
+      self.image_size = tuple(int(x) for x in self.image_size)
+
+    n = len(self.filename)
+    if any(x.shape[0] != n for x in (self.R, self.T, self.C, self.pp, self.f)):
+      raise Exception('inconsistent number of cameras in the ARKit source')
+
+  def __len__(self) -> int:
+    return len(self.filename)
+
+  def __getitem__(self, index) -> 'ARKitSource':
+    if isinstance(index, int):
+      index = slice(index, index + 1 if index != -1 else None)
+
+    if isinstance(index, slice):
+      filename = self.filename[index]
+    else:
+      index = np.asarray(index, dtype=np.int64).reshape(-1)
+      filename = [self.filename[i] for i in index]
+
+    return ARKitSource(filename, self.R[index], self.T[index], self.C[index], self.pp[index], self.f[index], self.image_size)
+
+  # Returns a copy with the intrinsics rescaled by the given factor
+  def scaled(self, factor: float) -> 'ARKitSource':
+    image_size = None
+    if self.image_size is not None:
+      image_size = tuple(int(round(x * factor)) for x in self.image_size)
+
+    return ARKitSource(self.filename, self.R, self.T, self.C, self.pp * factor, self.f * factor, image_size)
+
+  # Returns a copy with the intrinsics expressed in pixels of images of the given (W, H) size,
+  # which must have the same aspect ratio as the current one
+  def resized(self, image_size) -> 'ARKitSource':
+    if self.image_size is None:
+      raise Exception('the image size of the ARKit intrinsics is unknown')
+
+    width, height = self.image_size
+    if abs(image_size[0] * height - image_size[1] * width) > max(width, height):
+      raise Exception('cannot resize the ARKit intrinsics to a different aspect ratio')
+
+    return self.scaled(image_size[1] / height)
+
+  # Returns a copy whose arrays live in page-locked host memory, so that `to_tensors`
+  # can issue asynchronous host-to-device copies. A no-op without CUDA.
+  def pin(self) -> 'ARKitSource':
+    if not torch.cuda.is_available():
+      return self
+
+    def pinned(x: np.ndarray) -> np.ndarray:
+      buffer = torch.empty(x.shape, dtype=torch.float32, pin_memory=True)
+      buffer.numpy()[...] = x
+      return buffer.numpy()
+
+    return ARKitSource(self.filename, pinned(self.R), pinned(self.T), pinned(self.C), pinned(self.pp), pinned(self.f), self.image_size)
+
+  # Wraps the camera arrays as tensors without copying them on the host.
+  # If `device` is given the tensors are moved there, asynchronously for pinned arrays.
+  def to_tensors(self, device: torch.device = None) -> dict[str, Tensor]:
+    tensors = {
+      'R': torch.from_numpy(self.R),
+      'T': torch.from_numpy(self.T),
+      'C': torch.from_numpy(self.C),
+      'pp': torch.from_numpy(self.pp),
+      'f': torch.from_numpy(self.f),
+    }
+
+    if device is not None:
+      tensors = {k: v.to(device, non_blocking=True) for k, v in tensors.items()}
+
+    return tensors
@@ -1,16 +1,25 @@
 import os
+import copy
 import json
+import time
 import torch
+import threading
 import numpy as np
-from collections import namedtuple
 
+from detail.buffers import ArenaPool, ArenaUsage
+from detail.cpu import autocast
 from detail.make_batch import make_batch
+from detail.pixel_sampling import TILE_SIZE, pixel_importance, sample_tiles, tile_pixels, gather_pixels, gather_tiles
 from detail.types import ARKitSource, Predictions
+from detail.mesh_codec import MeshTemplate
+from detail.schedule import Stage, STAGES, EARLY_STOPPING_PATIENCE, with_early_stopping # noqa: F401
 
 from FOUND.FOUND.model import FIND
 from FOUND.FOUND.utils import Renderer
 from FOUND.FOUND.utils.forward import batch_to_device, calc_losses, LOSS_KEYS
 
+from pytorch3d.structures import join_meshes_as_batch
+
 class FOUNDArgs:
   def __init__(self, **kwargs):
     self.root_p = kwargs['root_p']
@@ -31,18 +40,64 @@ class FOUNDArgs:
 		  edge=1., norm_nll=0.1, norm_al=0.1
     )
     
-    for k, v in loss_weights:
+    loss_defaults.update(kwargs.get('loss_weights', {}))
+    for k, v in loss_defaults.items():
       setattr(self, f'weight_{k}', v)
 
-Stage = namedtuple('Stage', 'name num_epochs lr params losses')
-STAGES = [
-#	Stage('Registration', 50, .001, ['reg'], ['kp_nll']), // not implemented yet
-	Stage('Deform verts', 250, .001, ['deform', 'reg'], ['sil', 'norm_nll']),
-]
+    # Optimisation loop, see _run_level. The losses are read back to the host every
+    # `sync_interval` iterations, so early stopping acts up to sync_interval - 1 iterations late.
+    self.sync_interval = kwargs.get('sync_interval', 1)
+    if self.sync_interval < 1:
+      raise Exception('invalid sync interval provided')
+
+    # 'fp32' or 'bf16' autocast of the mesh generation and the losses, rasterization stays in fp32
+    self.precision = kwargs.get('precision', 'fp32')
+    if self.precision not in ('fp32', 'bf16'):
+      raise Exception('invalid precision provided')
+
+    # torch.compile the loss computation, the renderer runs eagerly either way
+    self.compile = kwargs.get('compile', False)
+
+    # Fused (CUDA) or multi-tensor Adam instead of PyTorch's default implementation
+    self.fused_adam = kwargs.get('fused_adam', True)
+
+    # Stop the stages without a patience of their own early, see detail.schedule
+    self.early_stopping = kwargs.get('early_stopping', False)
+
+    # Pixel-sampled losses, see detail.pixel_sampling: the fraction of the pixels of every view
+    # the losses are evaluated on (None evaluates all of them), in tiles which are the only
+    # pixels rendered, the fraction of those drawn by importance and the iterations after which
+    # the importance is scored again on a render of the whole images, see _run_level
+    self.sampling_ratio = kwargs.get('sampling_ratio', None)
+    if self.sampling_ratio is not None and not 0 < self.sampling_ratio <= 1:
+      raise Exception('invalid sampling ratio provided')
+    self.importance_ratio = kwargs.get('importance_ratio', 0.7)
+    self.sample_refresh = kwargs.get('sample_refresh', 5)
+
+# The stages the fits run, with the early stopping patience filled in if it's enabled
+def get_stages() -> list[Stage]:
+  return with_early_stopping(STAGES, model_args.early_stopping)
+
+# Number of idle FIND instances kept around for reuse
+MODEL_POOL_SIZE = 4
 
 renderer: Renderer = None
+renderers: dict[tuple, Renderer] = {} # renderers of the coarser resolution levels
 model_args: FOUNDArgs = None
 loss_weights: dict[float] = None
+task_loss_fn = None # _task_loss, compiled with FOUNDArgs.compile
+
+# FIND is loaded from disk once. Requests optimise copies of it, which are reset from the
+# pristine device-resident state dict and returned to the pool afterwards.
+template: FIND = None
+template_state: dict[str, torch.Tensor] = None
+template_requires_grad: list[bool] = None
+mesh_template: MeshTemplate = None # the unfitted mesh, results are encoded as offsets from it
+model_pool: list[FIND] = []
+model_pool_lock = threading.Lock()
+
+# The batch tensors of a task are kept in a buffer arena of the pool, see detail.buffers
+buffer_pool: ArenaPool = None
 
 def _get_kps(kps: torch.Tensor, labels: list[str]) -> dict:
   obj = {}
@@ -50,16 +105,33 @@ def _get_kps(kps: torch.Tensor, labels: list[str]) -> dict:
     kp = kp.cpu().detach().numpy().tolist()
     obj[label] = kp
 
-def init_renderer(args: FOUNDArgs):
-  # Instantiate the renderer
-  global renderer
-  renderer = Renderer(
-      device=args.device,
-      image_size=args.image_size,
+  return obj
+
+def _create_renderer(device: torch.device, image_size) -> Renderer:
+  return Renderer(
+      device=device,
+      image_size=image_size,
       max_faces_per_bin=100000,
       cam_params=[]
   )
 
+def _scale_image_size(scale: float) -> tuple[int, int]:
+  return tuple(int(round(x * scale)) for x in model_args.image_size)
+
+def _get_renderer(image_size: tuple[int, int]) -> Renderer:
+  if image_size == tuple(int(x) for x in model_args.image_size):
+    return renderer
+
+  if image_size not in renderers:
+    renderers[image_size] = _create_renderer(model_args.device, np.array(image_size))
+  return renderers[image_size]
+
+def init_renderer(args: FOUNDArgs):
+  # Instantiate the renderer
+  global renderer
+  renderer = _create_renderer(args.device, args.image_size)
+  renderers.clear()
+
   # Parse the loss weights from the config file
   global loss_weights
   loss_weights = {k: getattr(args, f'weight_{k}') for k in LOSS_KEYS}
@@ -67,46 +139,340 @@ def init_renderer(args: FOUNDArgs):
   global model_args
   model_args = args
 
-def process(predictions: Predictions, source_arkit: ARKitSource):
-  model = FIND(model_args.find_weights_p, kp_labels=None, opt_posevec=True)
-  model.to(model_args.device)
-
-  batch = make_batch(model_args, predictions, source_arkit)
-  batch = batch_to_device(batch, model_args.device)
-
-  for stage in STAGES:
-    optimiser = torch.optim.Adam(model.get_params(stage.params), lr=stage.lr)
-
-    render_normals = 'norm_nll' in stage.losses or 'norm_al' in stage.losses
-    render_sil = 'sil' in stage.losses or render_normals
-
-    for _ in range(stage.num_epochs):
-      optimiser.zero_grad()
-
-      # Generate new mesh
-      new_mesh = model().scale_verts_(model_args.mesh_scale)
-
-      # Render the normal map and extract the silhouette
-      res = renderer(
-        new_mesh,
-        batch['R'], batch['T'], batch['pp'], batch['f'],
-        normals_fmt='ours',
-        render_rgb=False,
-        render_normals=render_normals,
-        render_sil=render_sil,
-        keypoints=model.kps_from_mesh(new_mesh),
-        mask_out_faces=model.get_mask_out_faces()
-      )
-      res['new_mesh'] = new_mesh
-
-      # Calculate the total loss
-      loss_dict = calc_losses(res, batch, stage.losses, {'img_size': model_args.image_size}, disable_keypoints=model_args.disable_keypoints)
-      loss = sum(loss_dict[k] * loss_weights[k] for k in stage.losses)
-
-      loss.backward()
-      optimiser.step()
-
-  mesh = model().scale_verts_(model_args.mesh_scale)
-  kps = _get_kps(model.kps_from_mesh(mesh), model.kp_labels)
-  
-  return mesh, kps
\ No newline at end of file
+  global task_loss_fn
+  task_loss_fn = torch.compile(_task_loss) if args.compile else _task_loss
+
+  global buffer_pool
+  buffer_pool = ArenaPool(args.device)
+
+  init_template(args)
+
+def init_template(args: FOUNDArgs) -> None:
+  global template, template_state, template_requires_grad, mesh_template
+  template = FIND(args.find_weights_p, kp_labels=None, opt_posevec=True)
+  template.to(args.device)
+
+  # The copies get FIND's own requires_grad flags, so that its frozen parameters stay frozen
+  template_requires_grad = [p.requires_grad for p in template.parameters()]
+  template.requires_grad_(False)
+
+  template_state = {k: v.detach().clone() for k, v in template.state_dict().items()}
+
+  with torch.no_grad():
+    mesh = template().scale_verts_(args.mesh_scale)
+  mesh_template = MeshTemplate(mesh.verts_packed().cpu().numpy(), mesh.faces_packed().cpu().numpy())
+
+  with model_pool_lock:
+    model_pool.clear()
+
+def _acquire_model() -> FIND:
+  with model_pool_lock:
+    model = model_pool.pop() if model_pool else None
+
+  if model is None:
+    model = copy.deepcopy(template)
+    for p, requires_grad in zip(model.parameters(), template_requires_grad):
+      p.requires_grad_(requires_grad)
+
+  # Reset the parameters in place, a device-to-device copy
+  model.load_state_dict(template_state)
+  for p in model.parameters():
+    p.grad = None
+
+  return model
+
+def _release_model(model: FIND) -> None:
+  with model_pool_lock:
+    if len(model_pool) < MODEL_POOL_SIZE:
+      model_pool.append(model)
+
+# Tracks the loss of a task on one resolution level and decides when it has plateaued
+class _Plateau:
+  def __init__(self, stage: Stage):
+    self.stage = stage
+    self.best = float('inf')
+    self.bad_epochs = 0
+    self.epochs = 0
+
+  def update(self, loss: float) -> bool:
+    self.epochs += 1
+
+    if self.best == float('inf') or loss < self.best - abs(self.best) * self.stage.rel_tol:
+      self.best = loss
+      self.bad_epochs = 0
+    else:
+      self.bad_epochs += 1
+
+    if self.stage.patience is None or self.epochs < self.stage.min_epochs:
+      return False
+    return self.bad_epochs >= self.stage.patience
+
+# A single fitting task: a FIND model together with its inputs and the statistics of its stages
+class _Task:
+  def __init__(self, predictions: Predictions, source_arkit: ARKitSource):
+    self.model = _acquire_model()
+    self.arena = buffer_pool.acquire()
+    self.arena_usage = ArenaUsage(self.arena)
+
+    self.predictions = predictions
+    self.source_arkit = source_arkit
+    self.num_views = len(source_arkit)
+
+    self.batches = {}
+    self.scores = {}
+    self.samples = {}
+    self.stats = {'stages': []}
+
+  # Returns the batch downscaled to the given (H, W) image size
+  def batch(self, image_size: tuple[int, int]) -> dict:
+    if image_size not in self.batches:
+      batch_args = copy.copy(model_args)
+      batch_args.image_size = np.array(image_size)
+
+      batch = make_batch(batch_args, self.predictions, self.source_arkit, self.arena)
+      self.batches[image_size] = batch_to_device(batch, model_args.device)
+
+    return self.batches[image_size]
+
+  # Scores the pixels the tiles are drawn by, from the batch and a render of the whole images
+  def rescore(self, image_size: tuple[int, int], res: dict) -> None:
+    with torch.no_grad():
+      self.scores[image_size] = pixel_importance(self.batch(image_size), res.get('sil'))
+
+  # Draws new tiles the losses are evaluated on by the last scores, returns their (N * K, 2) top
+  # left (row, column) corners view by view
+  def draw_tiles(self, image_size: tuple[int, int]) -> torch.Tensor:
+    batch = self.batch(image_size)
+    tile = _tile_size(image_size)
+    with torch.no_grad():
+      corners = sample_tiles(self.scores[image_size], _num_tiles(image_size), model_args.importance_ratio, tile)
+      index = tile_pixels(corners, image_size, tile)
+
+    self.samples[image_size] = (corners, gather_pixels(batch, index, image_size))
+    return corners.flatten(0, 1)
+
+  # Returns a render of the tiles and the batch at the sampled pixels, as rows of the pixels
+  def sampled(self, image_size: tuple[int, int], res: dict) -> tuple[dict, dict]:
+    corners, batch = self.samples[image_size]
+    return gather_tiles(res, self.num_views, corners.shape[1], _tile_size(image_size)), batch
+
+def _tile_size(image_size: tuple[int, int]) -> int:
+  return min(TILE_SIZE, *image_size)
+
+# Tiles per view of the sampled losses, which cover `sampling_ratio` of the pixels
+def _num_tiles(image_size: tuple[int, int]) -> int:
+  return max(1, round(model_args.sampling_ratio * image_size[0] * image_size[1] / _tile_size(image_size) ** 2))
+
+def _join_cameras(tasks: list[_Task], image_size: tuple[int, int]) -> dict:
+  return {k: torch.cat([task.batch(image_size)[k] for task in tasks]) for k in ('R', 'T', 'pp', 'f')}
+
+# Draws new tiles for the tasks and returns their cameras, K per view: the camera of the view
+# with its principal point (x, y in pixels) moved to the top left corner of the tile, so that a
+# render of the tile size is the tile of the whole image
+def _tile_cameras(tasks: list[_Task], image_size: tuple[int, int], cameras: dict) -> dict:
+  corners = torch.cat([task.draw_tiles(image_size) for task in tasks])
+  num_tiles = corners.shape[0] // cameras['R'].shape[0]
+
+  tile_cameras = {k: v.repeat_interleave(num_tiles, dim=0) for k, v in cameras.items()}
+  pp = tile_cameras['pp']
+  tile_cameras['pp'] = pp - corners.flip(1).to(pp.dtype).view(pp.shape)
+  return tile_cameras
+
+def _split_result(res: dict, start: int, count: int, num_cameras: int) -> dict:
+  # Per-camera render outputs are sliced to the cameras of the task, everything else is shared
+  cameras = slice(start, start + count)
+  return {
+    k: v[cameras] if isinstance(v, torch.Tensor) and v.dim() > 0 and v.shape[0] == num_cameras else v
+    for k, v in res.items()
+  }
+
+# Renders the tasks' meshes with `cameras_per_view` cameras for every view of a task, e.g. tiles
+def _render(level_renderer: Renderer, tasks: list[_Task], meshes: list, cameras: dict, render_normals: bool, render_sil: bool, cameras_per_view: int = 1) -> dict:
+  if len(tasks) == 1:
+    # The renderer extends a single mesh to all cameras by itself
+    task_meshes = meshes[0]
+    keypoints = tasks[0].model.kps_from_mesh(meshes[0])
+  else:
+    # One mesh per camera, so that every task is rendered with its own mesh in a single call
+    task_meshes = join_meshes_as_batch([mesh.extend(task.num_views * cameras_per_view) for task, mesh in zip(tasks, meshes)])
+    keypoints = torch.cat([
+      task.model.kps_from_mesh(mesh).expand(task.num_views * cameras_per_view, -1, -1)
+      for task, mesh in zip(tasks, meshes)
+    ])
+
+  return level_renderer(
+    task_meshes,
+    cameras['R'], cameras['T'], cameras['pp'], cameras['f'],
+    normals_fmt='ours',
+    render_rgb=False,
+    render_normals=render_normals,
+    render_sil=render_sil,
+    keypoints=keypoints,
+    # The face mask depends on the template topology only, which is shared by all tasks
+    mask_out_faces=tasks[0].model.get_mask_out_faces()
+  )
+
+def _generate_mesh(model: FIND):
+  mesh = model()
+  if mesh.verts_packed().dtype != torch.float32:
+    # Under autocast the vertices may come out in bf16, the rasterizer takes fp32 only
+    mesh = mesh.update_padded(mesh.verts_padded().float())
+  return mesh.scale_verts_(model_args.mesh_scale)
+
+def _task_loss(res: dict, batch: dict, losses: list[str], image_size: tuple[int, int]) -> torch.Tensor:
+  loss_dict = calc_losses(res, batch, losses, {'img_size': np.array(image_size)}, disable_keypoints=model_args.disable_keypoints)
+  return torch.stack([(loss_dict[k] * loss_weights[k]).float().sum() for k in losses]).sum()
+
+def _create_optimiser(params: list, lr: float) -> torch.optim.Optimizer:
+  if not model_args.fused_adam:
+    return torch.optim.Adam(params, lr=lr)
+  if model_args.device.type == 'cuda':
+    return torch.optim.Adam(params, lr=lr, fused=True)
+  return torch.optim.Adam(params, lr=lr, foreach=True)
+
+# Runs a stage on one resolution level. The task losses of every iteration are kept on the
+# device and read back every `sync_interval` iterations (every iteration with a profiler), when
+# the tasks are checked for convergence. A task which converged within the read back iterations
+# has kept optimising until then, its statistics count those iterations.
+# With pixel-sampled losses the whole images are rendered every `sample_refresh` iterations
+# only, to score the pixels the tiles are drawn by, and their losses take every pixel. In between
+# new tiles are drawn every iteration and only they are rendered, each through a camera of its own.
+def _run_level(stage: Stage, optimiser: torch.optim.Optimizer, tasks: list[_Task], image_size: tuple[int, int], profiler=None) -> None:
+  start = time.perf_counter()
+  level_renderer = _get_renderer(image_size)
+  sampling = model_args.sampling_ratio is not None
+  if sampling:
+    tile, num_tiles = _tile_size(image_size), _num_tiles(image_size)
+
+  render_normals = 'norm_nll' in stage.losses or 'norm_al' in stage.losses
+  render_sil = 'sil' in stage.losses or render_normals
+  sync_interval = model_args.sync_interval if profiler is None else 1
+
+  plateaus = {id(task): _Plateau(stage) for task in tasks}
+  columns = {id(task): i for i, task in enumerate(tasks)}
+  iterations, final_losses = {}, {}
+
+  # (iteration, task) losses, filled on the device
+  history = torch.empty((stage.num_epochs, len(tasks)), device=model_args.device)
+  synced = 0
+
+  active = list(tasks)
+  cameras = _join_cameras(active, image_size)
+  active_columns = torch.arange(len(tasks), device=model_args.device)
+
+  for epoch in range(stage.num_epochs):
+    # Converged tasks drop out of the loop. Their parameters get no gradients, so Adam skips them.
+    optimiser.zero_grad(set_to_none=True)
+
+    # Generate new meshes
+    with autocast(model_args.device, model_args.precision):
+      meshes = [_generate_mesh(task.model) for task in active]
+
+    # Render the normal maps and extract the silhouettes, of the whole images or of the tiles
+    tiled = sampling and epoch % model_args.sample_refresh != 0
+    if tiled:
+      tile_cameras = _tile_cameras(active, image_size, cameras)
+      res = _render(_get_renderer((tile, tile)), active, meshes, tile_cameras, render_normals, render_sil, num_tiles)
+    else:
+      res = _render(level_renderer, active, meshes, cameras, render_normals, render_sil)
+
+    # Calculate the total loss of every task
+    cameras_per_view = num_tiles if tiled else 1
+    num_cameras = sum(task.num_views for task in active) * cameras_per_view
+    task_losses, camera_start = [], 0
+    with autocast(model_args.device, model_args.precision):
+      for task, mesh in zip(active, meshes):
+        task_res = _split_result(res, camera_start, task.num_views * cameras_per_view, num_cameras)
+        camera_start += task.num_views * cameras_per_view
+
+        batch = task.batch(image_size)
+        if tiled:
+          task_res, batch = task.sampled(image_size, task_res)
+        elif sampling:
+          # The whole images are rendered to score the pixels, their losses take every pixel
+          task.rescore(image_size, task_res)
+
+        task_res['new_mesh'] = mesh
+        task_losses.append(task_loss_fn(task_res, batch, stage.losses, image_size))
+
+    task_losses = torch.stack(task_losses)
+    task_losses.sum().backward()
+    optimiser.step()
+
+    history[epoch, active_columns] = task_losses.detach()
+    if epoch + 1 - synced < sync_interval and epoch + 1 < stage.num_epochs:
+      continue
+
+    # A single device to host copy of the losses since the last check
+    window = history[synced:epoch + 1].tolist()
+    converged = set()
+    for i, row in enumerate(window):
+      checked = [task for task in active if id(task) not in converged]
+      losses = [row[columns[id(task)]] for task in checked]
+      for task, task_loss in zip(checked, losses):
+        if plateaus[id(task)].update(task_loss):
+          converged.add(id(task))
+      if profiler is not None:
+        profiler(stage.name, image_size, synced + i, losses)
+
+    synced = epoch + 1
+    for task in active:
+      iterations[id(task)] = synced
+      final_losses[id(task)] = window[-1][columns[id(task)]]
+
+    if converged:
+      active = [task for task in active if id(task) not in converged]
+      if not active:
+        break
+      cameras = _join_cameras(active, image_size)
+      active_columns = torch.tensor([columns[id(task)] for task in active], device=model_args.device)
+
+  wall_s = time.perf_counter() - start
+  for task in tasks:
+    task.stats['stages'].append({
+      'name': stage.name,
+      'image_size': list(image_size),
+      'iterations': iterations.get(id(task), 0),
+      'final_loss': final_losses.get(id(task)),
+      'wall_s': wall_s, # shared by all tasks fitted together
+    })
+
+# Fits K independent tasks in one optimisation loop. Every iteration renders all tasks' cameras
+# at once and reduces the losses per task, so the tasks don't affect each other: the parameters
+# are disjoint and Adam updates every parameter independently.
+# Returns the fitted mesh, the keypoints and the per-stage statistics of every task.
+# `profiler`, if given, is called after every iteration, see detail.metrics.IterationProfiler.
+def process_many(tasks: list[tuple[Predictions, ARKitSource]], profiler=None) -> list[tuple]:
+  fits = []
+  try:
+    for predictions, source_arkit in tasks:
+      fits.append(_Task(predictions, source_arkit))
+
+    for stage in get_stages():
+      params = [p for task in fits for p in task.model.get_params(stage.params)]
+      optimiser = _create_optimiser(params, stage.lr)
+
+      # Optimise coarse to fine, every level starting from the result of the previous one
+      for scale in stage.scales:
+        _run_level(stage, optimiser, fits, _scale_image_size(scale), profiler)
+
+    results = []
+    for task in fits:
+      with torch.no_grad():
+        mesh = task.model().scale_verts_(model_args.mesh_scale)
+        kps = _get_kps(task.model.kps_from_mesh(mesh), task.model.kp_labels)
+
+      task.stats['iterations'] = sum(s['iterations'] for s in task.stats['stages'])
+      task.stats['final_loss'] = task.stats['stages'][-1]['final_loss'] if task.stats['stages'] else None
+      task.stats['buffers'] = task.arena_usage.stats()
+      task.stats['batch_size'] = len(fits)
+      results.append((mesh, kps, task.stats))
+
+    return results
+  finally:
+    for task in fits:
+      _release_model(task.model)
+      buffer_pool.release(task.arena)
+
+def process(predictions: Predictions, source_arkit: ARKitSource, profiler=None):
+  return process_many([(predictions, source_arkit)], profiler)[0]
@@ -1,15 +1,30 @@
 import os
 import sys
+import copy
+import json
 import torch
+import asyncio
+import threading
 import runpod
 import numpy as np
 import logging
 from datetime import datetime
 
-from data import init_cloud, download_from_cloud
-from detail.config import FOUND_IMAGE_SIZE
+from data import init_cloud, init_cache, init_decoder, download_from_cloud, upload_result, fetch_args, get_source_bucket, SUPABASE_RESULT_BUCKET_ID
+from detail.fetch import list_content_hashes, list_image_names
+from detail.admission import DeviceScheduler, Job, BatchedStage
+from detail.cpu import configure_threads
+from detail.loader import ModelLoader, LoadTimer
+from detail.memory import get_free_memory
+from detail.metrics import Trace, TransferStats, JSONLExporter, IterationProfiler
+from detail.measure import calc_size
+from detail.mesh_codec import encode_mesh
+from detail.resolution import plan_resolutions
+from detail.schedule import STAGES, with_early_stopping
+from detail.results import ResultCache, SQLiteResultStore, make_record, RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL
+from detail.select_views import ViewSelectionArgs, select_views, subset_views
 
-import found, snu, sam
+import streaming
 
 # Configure logging
 logging.basicConfig(
@@ -40,52 +55,381 @@ SNU_P = '/app/surface_normal_uncertainty'
 SAM2_P = '/app/sam2'
 FILE_STORAGE_ROOT = '/app/temp'
 
+SAM2_WEIGHTS = 'sam2.1_hiera_large.pt'
+SAM2_CONFIG = 'sam2.1/sam2.1_hiera_l.yaml'
+SNU_WEIGHTS = 'synfoot_10k_gn.pt'
+FIND_DIR = 'data/find_nfap'
+ASSET_CACHE_MAX_BYTES = int(os.environ.get('ASSET_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+
 SUPABASE_URL = os.environ.get('SUPABASE_URL', '')
 SUPABASE_API_KEY = os.environ.get('SUPABASE_API_KEY', '')
 
-def calc_size(kps: dict) -> float:
-    logger.debug("Calculating foot size from keypoints")
-    big_toe = np.array(kps['big toe'])
-    heel = np.array(kps['heel'])
+# 'streaming' overlaps download, decoding, SNU and SAM per view, 'sequential' runs them one after another
+PIPELINE_MODE = os.environ.get('PIPELINE_MODE', 'streaming')
+stream_args = streaming.StreamArgs()
 
-    # As the foot points to +X, the foot size is determined by
-    # subtracting the X component of the farthest and the closest points.
-    foot_size = big_toe[0] - heel[0]
-    logger.debug(f"Calculated foot size: {foot_size}")
-    return foot_size
+# Resolution of SNU and SAM relative to the FOUND fit: 'low', 'medium' or 'high'
+RESOLUTION_QUALITY = os.environ.get('RESOLUTION_QUALITY', 'high')
+resolution = plan_resolutions(RESOLUTION_QUALITY)
 
-def pipeline(id: str) -> float:
-    logger.info(f"Starting pipeline for task ID: {id}")
-    
+# Per-request metrics are returned in the response and, if METRICS_JSONL_PATH is set, appended there
+METRICS_JSONL_PATH = os.environ.get('METRICS_JSONL_PATH', '')
+metrics_exporter = JSONLExporter(METRICS_JSONL_PATH) if METRICS_JSONL_PATH else None
+
+# Default sampling interval of the FOUND iteration profiler, which requests switch on with 'profile'
+PROFILE_EVERY = int(os.environ.get('PROFILE_EVERY', 10))
+
+# Results are cached under a hash of the task's input files and the pipeline version.
+# An empty RESULT_CACHE_PATH disables the cache.
+RESULT_CACHE_PATH = os.environ.get('RESULT_CACHE_PATH', os.path.join(FILE_STORAGE_ROOT, 'results.sqlite'))
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', RESULT_CACHE_MAX_ENTRIES))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', RESULT_CACHE_MAX_BYTES))
+RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', RESULT_CACHE_TTL))
+
+# Bump when a change to the pipeline changes its results or their format, so that cached
+# results are recomputed
+PIPELINE_VERSION = '2'
+
+result_cache: ResultCache = None
+
+# Jobs a worker runs at once. With more than one the handler is asynchronous: jobs overlap their
+# downloads and host processing, while their SNU, SAM and FOUND stages are admitted by the
+# device scheduler, in the order the jobs arrived and within its device memory budget.
+HANDLER_CONCURRENCY = int(os.environ.get('HANDLER_CONCURRENCY', 1))
+HOST_BYTES_PER_JOB = int(os.environ.get('HOST_BYTES_PER_JOB', 2 * 1024 ** 3))
+DEVICE_MEMORY_FRACTION = float(os.environ.get('DEVICE_MEMORY_FRACTION', 0.8))
+
+# Estimated device memory per view of the admitted stages. SNU measures its own on the first call.
+SAM_BYTES_PER_VIEW = int(os.environ.get('SAM_BYTES_PER_VIEW', 512 * 1024 ** 2))
+FOUND_BYTES_PER_VIEW = int(os.environ.get('FOUND_BYTES_PER_VIEW', 128 * 1024 ** 2))
+
+scheduler = DeviceScheduler()
+
+# Without a GPU the pipeline runs on the CPU, with these thread counts (None keeps PyTorch's
+# defaults) and model precisions, see detail.cpu. SAM2 defaults to int8 on the CPU.
+CPU_THREADS = int(os.environ['CPU_THREADS']) if os.environ.get('CPU_THREADS') else None
+CPU_INTEROP_THREADS = int(os.environ['CPU_INTEROP_THREADS']) if os.environ.get('CPU_INTEROP_THREADS') else None
+SNU_PRECISION = os.environ.get('SNU_PRECISION', 'fp32')
+SAM_PRECISION = os.environ.get('SAM_PRECISION', '')
+
+# FOUND optimisation loop, see found.FOUNDArgs: iterations between the loss read backs, the
+# autocast precision, torch.compile of the losses, the fraction of pixels they are evaluated
+# on (unset evaluates all of them), loss-plateau early stopping of the stages and fused Adam
+FOUND_SYNC_INTERVAL = int(os.environ.get('FOUND_SYNC_INTERVAL', 10))
+FOUND_PRECISION = os.environ.get('FOUND_PRECISION', 'fp32')
+FOUND_COMPILE = os.environ.get('FOUND_COMPILE', '0') == '1'
+FOUND_SAMPLING_RATIO = float(os.environ['FOUND_SAMPLING_RATIO']) if os.environ.get('FOUND_SAMPLING_RATIO') else None
+FOUND_EARLY_STOPPING = os.environ.get('FOUND_EARLY_STOPPING', '0') == '1'
+FOUND_FUSED_ADAM = os.environ.get('FOUND_FUSED_ADAM', '1') == '1'
+
+# Fits of concurrent jobs waiting for FOUND's admission at the same time are fitted together in
+# one optimisation loop, up to this many (4 on a GPU and 1 on the CPU by default), see
+# found.process_many
+FOUND_MAX_BATCH = int(os.environ['FOUND_MAX_BATCH']) if os.environ.get('FOUND_MAX_BATCH') else None
+
+# Set once the device is picked at startup
+device: torch.device = None
+
+# The models load concurrently in the background while the handler already accepts jobs.
+# The model modules are only imported by their loaders, which keeps the startup imports light.
+models = ModelLoader()
+
+# View selection, disabled unless MAX_VIEWS or MIN_RELATIVE_SHARPNESS is set
+view_selection = ViewSelectionArgs(
+    max_views=int(os.environ['MAX_VIEWS']) if os.environ.get('MAX_VIEWS') else None,
+    min_relative_sharpness=float(os.environ['MIN_RELATIVE_SHARPNESS']) if os.environ.get('MIN_RELATIVE_SHARPNESS') else None,
+)
+
+# Everything that changes the results of the pipeline is part of the result cache keys
+def _get_sam_precision() -> str:
+    return SAM_PRECISION or ('int8' if device.type == 'cpu' else 'bf16')
+
+def _get_result_version() -> str:
+    return json.dumps({
+        'pipeline': PIPELINE_VERSION,
+        'weights': [SAM2_WEIGHTS, SAM2_CONFIG, SNU_WEIGHTS, FIND_DIR],
+        'resolution': resolution._asdict(),
+        'view_selection': vars(view_selection),
+        'precision': {'snu': SNU_PRECISION, 'sam': _get_sam_precision(), 'found': FOUND_PRECISION},
+        'found_stages': [stage._asdict() for stage in with_early_stopping(STAGES, FOUND_EARLY_STOPPING)],
+        'found_sync_interval': FOUND_SYNC_INTERVAL,
+        'found_sampling_ratio': FOUND_SAMPLING_RATIO,
+        'found_compile': FOUND_COMPILE,
+        'found_fused_adam': FOUND_FUSED_ADAM,
+    }, sort_keys=True)
+
+def init_result_cache() -> None:
+    global result_cache
+    if not RESULT_CACHE_PATH:
+        logger.info("Result cache disabled")
+        return
+
+    os.makedirs(os.path.dirname(os.path.abspath(RESULT_CACHE_PATH)), exist_ok=True)
+    store = SQLiteResultStore(RESULT_CACHE_PATH, RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL)
+    result_cache = ResultCache(store, _get_result_version())
+
+# Returns a loaded model module, recording the time spent waiting if it is still loading
+def _get_model(name: str, trace: Trace):
+    if models.ready(name):
+        return models.get(name)
+
+    logger.info(f"Waiting for {name} to finish loading")
+    with trace.span('wait_model', model=name):
+        return models.get(name)
+
+def _load_sam(timer: LoadTimer):
+    with timer.phase('import'):
+        import sam
+
+    with timer.phase('load'):
+        sam.init_predictor(sam.SAM2Args(
+            root_p=SAM2_P,
+            weights_file_name=SAM2_WEIGHTS,
+            cfg_file_name=SAM2_CONFIG,
+            device=device,
+            batch_size=8,
+            precision=_get_sam_precision()
+        ))
+    return sam
+
+def _load_snu(timer: LoadTimer):
+    with timer.phase('import'):
+        import snu
+
+    with timer.phase('load'):
+        snu.init_model(snu.SNUArgs(
+            root_p=SNU_P,
+            weights_file_name=SNU_WEIGHTS,
+            sampling_ratio=0.4,
+            importance_ratio=0.7,
+            device=device,
+            image_size=resolution.model_size,
+            precision=SNU_PRECISION
+        ))
+    return snu
+
+def _load_found(timer: LoadTimer):
+    with timer.phase('import'):
+        import found
+
+    with timer.phase('load'):
+        found.init_renderer(found.FOUNDArgs(
+            root_p=FOUND_P,
+            find_dir=FIND_DIR,
+            device=device,
+            image_size=np.array(resolution.found_size[::-1]),
+            sync_interval=FOUND_SYNC_INTERVAL,
+            precision=FOUND_PRECISION,
+            compile=FOUND_COMPILE,
+            sampling_ratio=FOUND_SAMPLING_RATIO,
+            early_stopping=FOUND_EARLY_STOPPING,
+            fused_adam=FOUND_FUSED_ADAM
+        ))
+    return found
+
+def _report_startup() -> None:
+    summary = models.wait_all()
+    for name, timing in summary['models'].items():
+        logger.info(f"Startup: {name} " + ', '.join(f'{k} {v:.2f}' for k, v in timing.items()))
+    logger.info(f"Startup: all models loaded after {summary['wall_s']:.2f}s")
+
+    # The admitted stages share the device memory the models left free
+    if device is not None and device.type == 'cuda':
+        scheduler.set_capacity(int(get_free_memory(device) * DEVICE_MEMORY_FRACTION))
+        logger.info(f"Device scheduler capacity: {scheduler.capacity / 1024 ** 3:.2f} GiB")
+
+def _estimate_bytes(stage: str, num_views: int) -> int:
+    if stage == 'snu':
+        snu = sys.modules['snu']
+        return num_views * (snu.bytes_per_view or snu.DEFAULT_BYTES_PER_VIEW)
+    if stage == 'sam':
+        return num_views * SAM_BYTES_PER_VIEW
+    return num_views * FOUND_BYTES_PER_VIEW
+
+# Batched fits share the kernel launches of every iteration on the GPU, on the CPU they are
+# slower than fitting one after another
+def _get_found_max_batch() -> int:
+    return FOUND_MAX_BATCH or (4 if device.type == 'cuda' else 1)
+
+def _process_found_batch(tasks: list) -> list:
+    return models.get('found').process_many(tasks)
+
+# The batch size is set once the device is picked at startup
+found_batches = BatchedStage('found', _process_found_batch, max_batch=1)
+
+# Wraps a device stage taking a list of images, so that every call waits for its admission.
+# SNU measures the memory of a view on its first call, which runs alone on the device.
+def _admitted(job: Job, stage: str, fn):
+    def run(images):
+        exclusive = stage == 'snu' and sys.modules['snu'].measures_memory()
+        with job.admit(stage, _estimate_bytes(stage, len(images)), exclusive):
+            return fn(images)
+    return run
+
+def _run_sequential(id: str, trace: Trace, job: Job, request_fetch_args):
     # Download files from the cloud storage
     logger.debug("Downloading files from cloud storage")
-    source_images, source_arkit = download_from_cloud(id)
+    with trace.span('download') as span:
+        source_images, source_arkit = download_from_cloud(id, request_fetch_args)
+        span.set(images=len(source_images), **request_fetch_args.stats.as_dict())
     logger.debug(f"Downloaded {len(source_images)} images and ARKit data")
 
+    if view_selection.enabled:
+        with trace.span('select_views') as span:
+            indices = select_views(source_arkit, source_images, view_selection)
+            source_images, source_arkit = subset_views(indices, source_images, source_arkit)
+            span.set(images=len(indices))
+        logger.debug(f"Selected {len(indices)} views")
+
+    snu, sam = _get_model('snu', trace), _get_model('sam', trace)
+
     logger.debug("Processing with SNU model")
-    predictions = snu.process(source_images)
+    with trace.span('snu', images=len(source_images)):
+        predictions = _admitted(job, 'snu', snu.process)(source_images)
     logger.debug("Processing with SAM model")
-    predictions[:]['mask'] = sam.process(source_images)
+    with trace.span('sam', images=len(source_images)):
+        predictions['mask'] = _admitted(job, 'sam', sam.process)(source_images)
+
+    return source_images, predictions, source_arkit
+
+def _run_streaming(id: str, trace: Trace, job: Job, request_fetch_args):
+    snu, sam = _get_model('snu', trace), _get_model('sam', trace)
+
+    logger.debug("Streaming views through download, SNU and SAM")
+    # The stages overlap, so they share a span. Their busy and stall times are in 'stages'.
+    with trace.span('stream') as span:
+        source_images, predictions, source_arkit, stage_stats = streaming.stream_task(
+            id, _admitted(job, 'snu', snu.process), _admitted(job, 'sam', sam.process), stream_args, view_selection, request_fetch_args
+        )
+        span.set(images=len(source_images), stages=stage_stats, **request_fetch_args.stats.as_dict())
+    logger.info(f"Stage statistics for task {id}: {stage_stats}")
+
+    return source_images, predictions, source_arkit
+
+def _compute(id: str, trace: Trace, job: Job, profiler: IterationProfiler) -> dict:
+    # Per-request copy of the fetch settings, counting the bytes this task transfers
+    request_fetch_args = copy.copy(fetch_args)
+    request_fetch_args.stats = TransferStats()
+
+    if PIPELINE_MODE == 'sequential':
+        source_images, predictions, source_arkit = _run_sequential(id, trace, job, request_fetch_args)
+    else:
+        source_images, predictions, source_arkit = _run_streaming(id, trace, job, request_fetch_args)
+
+    # FOUND starts once the full camera set is assembled
+    found = _get_model('found', trace)
 
     logger.debug("Processing with FOUND model")
-    mesh, kps = found.process(predictions, source_arkit)
-    logger.debug("FOUND model processing completed")
+    with trace.span('found', images=len(source_arkit)) as span:
+        found_bytes = _estimate_bytes('found', len(source_arkit))
+        if profiler is None:
+            mesh, kps, found_stats = found_batches.run(job, (predictions, source_arkit), found_bytes)
+        else:
+            # The profiler follows the losses of a single fit
+            with job.admit('found', found_bytes):
+                mesh, kps, found_stats = found.process(predictions, source_arkit, profiler)
+        span.set(
+            iterations=found_stats['iterations'], final_loss=found_stats['final_loss'], stages=found_stats['stages'],
+            buffers=found_stats.get('buffers'), batch_size=found_stats.get('batch_size', 1)
+        )
+    logger.info(f"FOUND used {found_stats['iterations']} iterations, final loss {found_stats['final_loss']}")
+
+    # The mesh is stored as offsets from the FIND template, see detail.mesh_codec
+    with trace.span('encode_mesh') as span:
+        mesh_data = encode_mesh(mesh.verts_packed().detach().cpu().numpy(), template=found.mesh_template)
+        span.set(bytes=len(mesh_data))
+
+    with trace.span('calc_size'):
+        foot_size = calc_size(kps)
+
+    return make_record(foot_size, kps, mesh_data)
+
+# Hashes the content hashes of the task's images and ARKit sidecars, None if any is missing
+def _get_result_key(id: str) -> str:
+    hashes = list_content_hashes(get_source_bucket(), f'tasks/{id}/')
+    image_names = list_image_names(hashes)
+    names = image_names + [name.rsplit('.', 1)[0] + '.json' for name in image_names]
+    return result_cache.key({name: hashes.get(name) for name in names})
+
+# Returns the result record (foot size, keypoints and mesh) and where it came from:
+# 'hit', 'coalesced' (shared with an identical request in flight), 'miss' or 'disabled'
+def pipeline(id: str, trace: Trace, job: Job, profiler: IterationProfiler = None) -> tuple[dict, str]:
+    logger.info(f"Starting pipeline for task ID: {id}")
+
+    if result_cache is None:
+        return _compute(id, trace, job, profiler), 'disabled'
+
+    with trace.span('result_key') as span:
+        key = _get_result_key(id)
+        span.set(key=key)
 
-    # do something with mesh(upload it somewhere, idk..) and calculate the foot size
-    return calc_size(kps)
+    record, status = result_cache.get_or_compute(key, lambda: _compute(id, trace, job, profiler))
+    logger.info(f"Result cache {status} for task {id}")
+    return record, status
+
+
+# A request enables the FOUND profiler with 'profile': true, or with the sampling interval
+def _make_profiler(event_input: dict) -> IterationProfiler:
+    profile = event_input.get('profile')
+    if not profile:
+        return None
+
+    every = PROFILE_EVERY if profile is True else int(profile)
+    return IterationProfiler(every, device)
+
+def _get_metrics(trace: Trace, job: Job, profiler: IterationProfiler) -> dict:
+    metrics = trace.summary()
+    metrics['admission'] = {'waits': job.as_dict(), 'scheduler': scheduler.stats(), 'found_batches': found_batches.stats()}
+    if result_cache is not None:
+        metrics['result_cache'] = result_cache.stats()
+
+    # Batch buffer reuse of the worker so far, see detail.buffers
+    pools = {name: getattr(models.get(name), 'buffer_pool', None) for name in ('snu', 'found') if models.loaded(name)}
+    metrics['buffers'] = {name: pool.stats() for name, pool in pools.items() if pool is not None}
+
+    # With concurrent jobs the spans carry no device peak, the worker-wide one is reported instead
+    if trace.shared_device and device.type == 'cuda':
+        metrics['device'] = {'worker_peak_bytes': torch.cuda.max_memory_allocated(device)}
+    if profiler is not None:
+        metrics['profile'] = profiler.as_dict()
+    return metrics
 
 def runpod_handler(event):
     logger.info("Received new RunPod event")
     id: str = event['input']['id']
     
     logger.debug(f'Processing task {id}')
+    trace = Trace(id, device, shared_device=HANDLER_CONCURRENCY > 1)
+    job = scheduler.job(id)
+    profiler = _make_profiler(event['input'])
     try:
-        foot_size = pipeline(id)
-        logger.debug(f"Successfully completed task {id} with foot size: {foot_size}")
-        return {'status': 'completed', 'id': id, 'foot_size': foot_size}
+        record, cache_status = pipeline(id, trace, job, profiler)
+        logger.debug(f"Successfully completed task {id} with foot size: {record['foot_size']}")
+        response = {'status': 'completed', 'id': id, 'foot_size': record['foot_size'], 'cache': cache_status}
+
+        # Results served from the cache still need the template, if it was never uploaded
+        if SUPABASE_RESULT_BUCKET_ID:
+            with trace.span('upload') as span:
+                response['result'] = upload_result(id, record, lambda: _get_model('found', trace).mesh_template)
+                span.set(bytes=len(record['mesh'] or b''))
     except Exception as e:
         logger.error(f"Error processing task {id}: {str(e)}", exc_info=True)
-        return {'status': 'error', 'id': id, 'error': str(e)}
+        response = {'status': 'error', 'id': id, 'error': str(e)}
+
+    response['metrics'] = _get_metrics(trace, job, profiler)
+    if metrics_exporter is not None:
+        metrics_exporter.export({'status': response['status'], **response['metrics']})
+
+    return response
+
+# Runs the job in a thread, so that several jobs can be in progress in one worker
+async def async_runpod_handler(event):
+    return await asyncio.to_thread(runpod_handler, event)
+
+# Takes on up to HANDLER_CONCURRENCY jobs, as far as the free host memory allows
+def concurrency_modifier(current_concurrency: int) -> int:
+    free_jobs = get_free_memory(torch.device('cpu')) // HOST_BYTES_PER_JOB
+    return max(1, min(HANDLER_CONCURRENCY, current_concurrency + free_jobs))
 
 if __name__ == '__main__':
     logger.info("Initializing serverless environment")
@@ -94,42 +438,37 @@ if __name__ == '__main__':
         device = torch.device('cuda')
         logger.info(f"Using CUDA device: {torch.cuda.get_device_name(0)}")
     else:
-        logger.error("CUDA device not available")
-        raise RuntimeError('cuda device not available')
+        device = torch.device('cpu')
+        logger.warning("CUDA device not available, running on the CPU")
+        configure_threads(CPU_THREADS, CPU_INTEROP_THREADS)
+
+    found_batches.max_batch = _get_found_max_batch()
+    logger.info(f"FOUND fits up to {found_batches.max_batch} concurrent jobs together")
+
+    # SNU and SAM are needed first, FOUND only once a job's views have been segmented
+    logger.info("Loading SAM2, SNU and FOUND in the background, overlapping the rest of the startup")
+    models.submit('sam', _load_sam)
+    models.submit('snu', _load_snu)
+    models.submit('found', _load_found)
+    threading.Thread(target=_report_startup, daemon=True).start()
 
     logger.info("Initializing cloud storage connection")
     init_cloud(SUPABASE_URL, SUPABASE_API_KEY)
 
-    logger.info("Initializing SAM2 model")
-    sam2_args = sam.SAM2Args(
-        root_p=SAM2_P,
-        weights_file_name='sam2.1_hiera_large.pt',
-        cfg_p='sam2.1/sam2.1_hiera_l.yaml',
-        device=device
-    )
-    sam.init_predictor(sam2_args)
-    logger.info("SAM2 model initialized successfully")
-
-    logger.info("Initializing SNU model")
-    snu_args = snu.SNUArgs(
-        root_p=SNU_P,
-        weights_file_name='synfoot_10k_gn.pt',
-        sampling_ratio=0.4,
-        importance_ratio=0.7,
-        device=device
-    )
-    snu.init_model(snu_args)
-    logger.info("SNU model initialized successfully")
-
-    logger.info("Initializing FOUND model")
-    found_args = found.FOUNDArgs(
-        root_p=FOUND_P,
-        find_dir='data/find_nfap',
-        device=device,
-        image_size=FOUND_IMAGE_SIZE
-    )
-    found.init_renderer(found_args)
-    logger.info("FOUND model initialized successfully")
-
-    logger.info("Starting RunPod serverless handler")
-    runpod.serverless.start({'handler': runpod_handler})
\ No newline at end of file
+    logger.info("Initializing local asset cache")
+    init_cache(os.path.join(FILE_STORAGE_ROOT, 'assets'), ASSET_CACHE_MAX_BYTES)
+
+    logger.info(f"Resolution plan: {resolution}")
+
+    logger.info("Initializing result cache")
+    init_result_cache()
+
+    logger.info("Initializing image decoding")
+    init_decoder(resolution.model_size)
+
+    if HANDLER_CONCURRENCY > 1:
+        logger.info(f"Starting RunPod serverless handler, up to {HANDLER_CONCURRENCY} concurrent jobs")
+        runpod.serverless.start({'handler': async_runpod_handler, 'concurrency_modifier': concurrency_modifier})
+    else:
+        logger.info("Starting RunPod serverless handler")
+        runpod.serverless.start({'handler': runpod_handler})
\ No newline at end of file
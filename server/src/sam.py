@@ -6,12 +6,20 @@ from PIL import Image
 
 sys.path.append(os.path.dirname(__file__))
 
+from detail.config import IMAGE_SIZE
+from detail.loader import load_checkpoint
+from detail.cpu import check_precision, prepare_model, autocast
+
 from sam2.sam2.build_sam import build_sam2
 from sam2.sam2.sam2_image_predictor import SAM2ImagePredictor
 
+# Prompt point in the coordinates of an IMAGE_SIZE image, rescaled to the actual image size
 CENTER_POINT_POS = np.array([[500, 610]])
 CENTER_POINT_LABEL = np.array([1])
 
+# Number of views encoded by the image encoder at once in the batched mode
+DEFAULT_BATCH_SIZE = 8
+
 model = None
 model_args = None
 
@@ -27,29 +35,83 @@ class SAM2Args:
 
     self.device = kwargs['device']
 
+    # batched mode parameters
+    self.batched = kwargs.get('batched', True)
+    self.batch_size = kwargs.get('batch_size', DEFAULT_BATCH_SIZE)
+    if self.batch_size < 1:
+      raise Exception('invalid batch size provided')
+
+    # 'fp32', 'bf16' or 'int8' (CPU only), see detail.cpu
+    self.precision = check_precision(kwargs.get('precision', 'bf16'))
+    if self.precision == 'int8' and self.device.type != 'cpu':
+      raise Exception('int8 precision is only supported on the cpu')
+
 def init_predictor(args: SAM2Args) -> None:
+  # The checkpoint is memory-mapped and copied into the model on the device, rather than read
+  # into memory by build_sam2
+  sam2 = build_sam2(args.cfg_p, None, device=args.device)
+  sam2.load_state_dict(load_checkpoint(args.weights_p))
+  sam2.eval()
+
+  if args.device.type == 'cpu':
+    sam2 = prepare_model(sam2, args.precision)
+
   global model
-  model = SAM2ImagePredictor(build_sam2(args.cfg_p, args.weights_p))
+  model = SAM2ImagePredictor(sam2)
 
   global model_args
   model_args = args
 
-def process(source_images: list) -> torch.Tensor:
+def _get_point(image) -> np.ndarray:
+  # (W, H) of a PIL image or an (H, W, 3) array
+  size = image.size if isinstance(image, Image.Image) else np.asarray(image).shape[1::-1]
+  return CENTER_POINT_POS * (np.array(size) / IMAGE_SIZE)
+
+def _process_sequential(source_images: list) -> torch.Tensor:
   masks = []
 
-  with torch.inference_mode(), torch.autocast(model_args.device.type, dtype=torch.bfloat16):
-    for image in source_images:
-      model.set_image(image)
-      pred_masks, scores, _ = model.predict(
-        point_coords=CENTER_POINT_POS,
-        point_labels=CENTER_POINT_LABEL,
-        multimask_output=True,
-      )
-
-      sorted_ind = np.argsort(scores)[::-1]
-      pred_masks = pred_masks[sorted_ind] # (3, H, W)
-      best_mask = pred_masks[0] # (H, W)
-      
-      masks.append(best_mask.unsqueeze(-1).astype(np.uint8) * 255) # (H, W, 1)
-
-  return torch.stack(masks) # (B, H, W, 1)
\ No newline at end of file
+  for image in source_images:
+    model.set_image(image)
+    pred_masks, scores, _ = model.predict(
+      point_coords=_get_point(image),
+      point_labels=CENTER_POINT_LABEL,
+      multimask_output=True,
+    )
+
+    sorted_ind = np.argsort(scores)[::-1]
+    pred_masks = pred_masks[sorted_ind] # (3, H, W)
+    best_mask = torch.from_numpy(pred_masks[0]) # (H, W)
+
+    masks.append(best_mask.unsqueeze(-1).to(torch.uint8) * 255) # (H, W, 1)
+
+  return torch.stack(masks) # (B, H, W, 1)
+
+def _process_batched(source_images: list) -> torch.Tensor:
+  masks = []
+
+  for start in range(0, len(source_images), model_args.batch_size):
+    images = [np.asarray(image) for image in source_images[start:start + model_args.batch_size]]
+
+    # Run the image encoder once for the whole micro-batch
+    model.set_image_batch(images)
+    pred_masks, scores, _ = model.predict_batch(
+      point_coords_batch=[_get_point(image) for image in images],
+      point_labels_batch=[CENTER_POINT_LABEL] * len(images),
+      multimask_output=True,
+    )
+
+    # Pick the best scoring mask of every image at once
+    pred_masks = torch.from_numpy(np.stack(pred_masks)) # (b, 3, H, W)
+    best_ind = torch.from_numpy(np.stack(scores)).argmax(dim=1) # (b,)
+    best_masks = pred_masks[torch.arange(len(images)), best_ind] # (b, H, W)
+
+    masks.append(best_masks.unsqueeze(-1).to(torch.uint8) * 255) # (b, H, W, 1)
+
+  return torch.cat(masks) # (B, H, W, 1)
+
+def process(source_images: list) -> torch.Tensor:
+  with torch.inference_mode(), autocast(model_args.device, model_args.precision):
+    if model_args.batched:
+      return _process_batched(source_images)
+
+    return _process_sequential(source_images)
\ No newline at end of file
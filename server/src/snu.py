@@ -1,21 +1,31 @@
 import torch
+import numpy as np
+import torch.nn.functional as F
 
-from torchvision import transforms
-
+from detail.config import INTERMEDIATE_IMAGE_SIZE
+from detail.buffers import BufferArena, ArenaPool
+from detail.cpu import check_precision, prepare_model, autocast
+from detail.loader import load_checkpoint
+from detail.memory import determine_batch_size
 from detail.types import Predictions
 
 from surface_normal_uncertainty.src.models.NNET import NNET
-from surface_normal_uncertainty.src.utils import utils
 
-IMG_TRANSF = transforms.Compose([
-  transforms.Resize(),
-  transforms.ToTensor(),
-  transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-])
+IMG_MEAN = [0.485, 0.456, 0.406]
+IMG_STD = [0.229, 0.224, 0.225]
+
+# Rough device memory needed to run NNET on a single view, used until it is measured
+DEFAULT_BYTES_PER_VIEW = 1536 * 1024 ** 2
 
 model = None
 model_args = None
 
+# Measured peak device memory per view, filled in by the first automatically sized run
+bytes_per_view: int = None
+
+# Pinned staging and device buffers of the micro-batches, see detail.buffers
+buffer_pool: ArenaPool = None
+
 class SNUArgs:
   def __init__(self, **kwargs):
     self.root_p = kwargs['root_p']
@@ -29,29 +39,158 @@ class SNUArgs:
     weights_desc = self.weights_file_name.split('.')[0].split('_')
     if len(weights_desc) != 3:
       raise Exception('invalid checkpoint name format')
-    
-    self.architecture = weights_desc[2].toupper()
+
+    self.architecture = weights_desc[2].upper()
     if self.architecture not in ['BN', 'GN']:
       raise Exception('invalid architecture provided in the checkpoint name')
-    
+
     self.device = kwargs['device']
 
+    # (W, H) inference resolution, images of any other size are resized to it on the device
+    self.image_size = tuple(int(x) for x in kwargs.get('image_size', INTERMEDIATE_IMAGE_SIZE))
+
+    # micro-batch size, picked from the free device memory when not provided
+    self.batch_size = kwargs.get('batch_size', None)
+    if self.batch_size is not None and self.batch_size < 1:
+      raise Exception('invalid batch size provided')
+
+    # 'fp32', 'bf16' or 'int8', see detail.cpu. Only used on the CPU.
+    self.precision = check_precision(kwargs.get('precision', 'fp32'))
+
 def init_model(args: SNUArgs) -> None:
   global model_args
-  model_args = model_args
+  model_args = args
 
   # load checkpoint
-  weights_p = f'{args.root_p}/checkpoints/{args.weights_file_name}.pt'
+  weights_p = f'{args.root_p}/checkpoints/{args.weights_file_name}'
 
   global model
   model = NNET(args).to(args.device)
-  model = utils.load_checkpoint(weights_p, model)
+  model.load_state_dict(load_checkpoint(weights_p))
   model.eval()
 
+  if args.device.type == 'cpu':
+    model = prepare_model(model, args.precision)
+
+def _run_model(image_batch: torch.Tensor) -> torch.Tensor:
+  precision = model_args.precision if model_args.device.type == 'cpu' else 'fp32'
+  if precision == 'bf16':
+    image_batch = image_batch.contiguous(memory_format=torch.channels_last)
+
+  with autocast(model_args.device, precision):
+    norm_out_list, _, _ = model(image_batch)
+
+  # Only the final refinement output is kept, the intermediate ones are dropped right away
+  norm_out = norm_out_list[-1].float()
+  del norm_out_list
+
+  return norm_out.permute(0, 2, 3, 1) # (b, H, W, C)
+
+# Starts copying (H, W, 3) uint8 arrays or PIL images of the same size to the device as a uint8
+# batch, through the named pinned buffer of the arena on CUDA. The batch is ready once
+# `arena.wait(name)` is called.
+def _stage_batch(source_images: list, arena: BufferArena, name: str) -> torch.Tensor:
+  images = [np.asarray(img)[..., :3] for img in source_images]
+  if not arena.is_cuda:
+    return torch.from_numpy(np.stack(images))
+
+  host = arena.host(name, (len(images), *images[0].shape), torch.uint8)
+  for i, image in enumerate(images):
+    host[i].numpy()[...] = image
+  return arena.to_device(name, host)
+
+# Converts, resizes (only if the images aren't decoded at the inference size yet) and
+# normalises a uint8 (b, H, W, 3) batch on the device
+def _prepare_batch(image_batch: torch.Tensor) -> torch.Tensor:
+  image_batch = image_batch.permute(0, 3, 1, 2).float().div_(255) # (b, 3, H, W)
+
+  width, height = model_args.image_size
+  if image_batch.shape[2:] != (height, width):
+    image_batch = F.interpolate(image_batch, size=(height, width), mode='bilinear', align_corners=False, antialias=True)
+
+  mean = torch.tensor(IMG_MEAN, device=image_batch.device).view(1, 3, 1, 1)
+  std = torch.tensor(IMG_STD, device=image_batch.device).view(1, 3, 1, 1)
+  return (image_batch - mean) / std
+
+# Takes (H, W, 3) uint8 arrays or PIL images of the same size. They are copied to the device as
+# uint8 and converted, resized and normalised there.
+def load_batch(source_images: list, arena: BufferArena = None) -> torch.Tensor:
+  arena = arena or BufferArena(model_args.device)
+  image_batch = _stage_batch(source_images, arena, 'images')
+  arena.wait('images')
+  return _prepare_batch(image_batch)
+
+def _get_buffers() -> ArenaPool:
+  global buffer_pool
+  if buffer_pool is None or buffer_pool.device != model_args.device:
+    buffer_pool = ArenaPool(model_args.device)
+  return buffer_pool
+
+# Whether the next call measures the device memory of a view. The peak it reads is device wide,
+# so the call should run alone on the device.
+def measures_memory() -> bool:
+  return model_args.batch_size is None and bytes_per_view is None and model_args.device.type == 'cuda'
+
+def _measure_first_view(source_images: list) -> torch.Tensor:
+  # Run a single view to learn how much device memory one view takes
+  global bytes_per_view
+
+  if model_args.device.type != 'cuda':
+    return None
+
+  torch.cuda.synchronize(model_args.device)
+  torch.cuda.reset_peak_memory_stats(model_args.device)
+  start = torch.cuda.memory_allocated(model_args.device)
+
+  norms = _run_model(load_batch(source_images[:1]))
+
+  bytes_per_view = torch.cuda.max_memory_allocated(model_args.device) - start
+  return norms
+
 def process(source_images: list) -> Predictions:
-  image_batch = torch.stack([IMG_TRANSF(img).to(model_args.device) for img in source_images]) # (B, 3, H, W)
-  
-  norm_out_list, _, _ = model(image_batch)
-  norms = norm_out_list[-1].permute(0, 2, 3, 1) # (B, 3, H, W)
+  num_views = len(source_images)
+  norms = None
+  start = 0
+
+  with torch.inference_mode():
+    if model_args.batch_size is None and bytes_per_view is None:
+      first_norms = _measure_first_view(source_images)
+      if first_norms is not None:
+        norms = torch.empty((num_views, *first_norms.shape[1:]), dtype=first_norms.dtype, device=first_norms.device)
+        norms[:1] = first_norms
+        start = 1
+
+    batch_size = determine_batch_size(
+      num_views,
+      bytes_per_view or DEFAULT_BYTES_PER_VIEW,
+      model_args.device,
+      model_args.batch_size
+    )
+
+    # The next micro-batch is copied to the device while the model runs on the current one,
+    # the two alternate between a pair of buffers
+    starts = list(range(start, num_views, batch_size))
+    pool = _get_buffers()
+    arena = pool.acquire()
+    try:
+      staged = _stage_batch(source_images[starts[0]:starts[0] + batch_size], arena, 'images0') if starts else None
+      for i, start in enumerate(starts):
+        end = min(start + batch_size, num_views)
+        image_batch = staged
+        arena.wait(f'images{i % 2}')
+
+        if i + 1 < len(starts):
+          next_start = starts[i + 1]
+          staged = _stage_batch(source_images[next_start:next_start + batch_size], arena, f'images{(i + 1) % 2}')
+
+        norm_out = _run_model(_prepare_batch(image_batch))
+
+        # Write into a preallocated output instead of concatenating the micro-batches
+        if norms is None:
+          norms = torch.empty((num_views, *norm_out.shape[1:]), dtype=norm_out.dtype, device=norm_out.device)
+        norms[start:end] = norm_out
+        del norm_out
+    finally:
+      pool.release(arena)
 
-  return {'norm': norms, 'mask': []}
\ No newline at end of file
+  return {'norm': norms, 'mask': []}
@@ -0,0 +1,123 @@
+import logging
+import torch
+
+import data
+from detail.stages import Stage, StagePipeline
+from detail.fetch import FETCH_CONCURRENCY, FetchArgs, list_views, download_view, decode_view, fetch_sidecars
+from detail.select_views import ViewSelectionArgs, select_diverse_views, select_views
+from detail.types import ARKitSource, Predictions
+
+logger = logging.getLogger(__name__)
+
+class StreamArgs:
+  def __init__(self, **kwargs):
+    self.download_workers = kwargs.get('download_workers', FETCH_CONCURRENCY)
+    self.decode_workers = kwargs.get('decode_workers', 2)
+
+    # Model stages batch whatever views have arrived, up to the batch size
+    self.snu_batch_size = kwargs.get('snu_batch_size', 4)
+    self.sam_batch_size = kwargs.get('sam_batch_size', 4)
+    self.max_wait = kwargs.get('max_wait', 0.05) # seconds to wait for a batch to fill up
+
+    self.queue_size = kwargs.get('queue_size', 8)
+
+# Builds the per-view stages: download -> decode -> SNU -> SAM.
+# `snu_fn` and `sam_fn` follow the interface of `snu.process` and `sam.process`, so they can
+# be replaced with stub models. Every stage passes the view dict along, filling it in.
+def make_view_stages(bucket, folder_path: str, files: dict, snu_fn, sam_fn, decode, args: StreamArgs, sidecars: dict = None, fetch_args: FetchArgs = None) -> list[Stage]:
+  sidecars = sidecars or {}
+  fetch_args = fetch_args or data.fetch_args
+
+  def download(image_names: list[str]) -> list[dict]:
+    return [download_view(bucket, folder_path, files, name, fetch_args, sidecars.get(name)) for name in image_names]
+
+  def decode_views(views: list[dict]) -> list[dict]:
+    return [decode_view(view, decode, fetch_args) for view in views]
+
+  def segment_normals(views: list[dict]) -> list[dict]:
+    norms = snu_fn([view['image'] for view in views])['norm'] # (b, H, W, C)
+    for view, norm in zip(views, norms.unbind(0)):
+      view['norm'] = norm
+    return views
+
+  def segment_masks(views: list[dict]) -> list[dict]:
+    masks = sam_fn([view['image'] for view in views]) # (b, H, W, 1)
+    for view, mask in zip(views, masks.unbind(0)):
+      view['mask'] = mask
+    return views
+
+  return [
+    Stage('download', download, workers=args.download_workers, queue_size=args.queue_size),
+    Stage('decode', decode_views, workers=args.decode_workers, queue_size=args.queue_size),
+    Stage('snu', segment_normals, batch_size=args.snu_batch_size, max_wait=args.max_wait, queue_size=args.queue_size),
+    Stage('sam', segment_masks, batch_size=args.sam_batch_size, max_wait=args.max_wait, queue_size=args.queue_size),
+  ]
+
+# Stacks the per-view results, in the sorted image name order, into the inputs of FOUND
+def assemble_views(views: list[dict]) -> tuple[list, Predictions, ARKitSource]:
+  if not views:
+    raise Exception('no views to assemble')
+
+  images = [view['image'] for view in views]
+  predictions = {
+    'norm': torch.stack([view['norm'] for view in views]),
+    'mask': torch.stack([view['mask'] for view in views]),
+  }
+  source_arkit = data.parse_arkit([view['arkit'] for view in views])
+
+  return images, predictions, source_arkit
+
+# Streams all views of a folder through the stages and returns the assembled FOUND inputs
+# together with per-stage statistics (items, batches, busy and stall times, queue depths)
+# Fetches the ARKit sidecars up front and keeps only the most diverse poses, so that the
+# dropped views are never downloaded or run through the models
+def _preselect_views(bucket, folder_path: str, files: dict, image_names: list[str], selection: ViewSelectionArgs, fetch_args: FetchArgs) -> tuple[list[str], dict]:
+  sidecars = fetch_sidecars(bucket, folder_path, files, image_names, fetch_args)
+  indices = select_diverse_views(data.parse_arkit(sidecars), selection.max_views, selection.position_weight)
+  logger.debug(f"Selected {len(indices)} of {len(image_names)} views")
+
+  image_names = [image_names[i] for i in indices]
+  return image_names, {name: sidecars[i] for name, i in zip(image_names, indices)}
+
+# Selects among decoded views the way the sequential pipeline does, dropping the blurry views
+# before picking the most diverse poses
+def _select_decoded_views(views: list[dict], selection: ViewSelectionArgs) -> list[dict]:
+  source_arkit = data.parse_arkit([view['arkit'] for view in views])
+  indices = select_views(source_arkit, [view['image'] for view in views], selection)
+  logger.debug(f"Selected {len(indices)} of {len(views)} views")
+  return [views[i] for i in indices]
+
+def stream_views(bucket, folder_path: str, snu_fn, sam_fn, decode=None, args: StreamArgs = None, selection: ViewSelectionArgs = None, fetch_args: FetchArgs = None) -> tuple[list, Predictions, ARKitSource, dict]:
+  args = args or StreamArgs()
+  decode = decode or data.decode_image
+  fetch_args = fetch_args or data.fetch_args
+
+  files, image_names = list_views(bucket, folder_path)
+
+  # The sharpness filter needs the images, so every view is downloaded and decoded before the
+  # selection and only the selected ones run through the models. The poses alone are selected
+  # from the sidecars, before any image is downloaded.
+  if selection is not None and selection.min_relative_sharpness is not None:
+    stages = make_view_stages(bucket, folder_path, files, snu_fn, sam_fn, decode, args, None, fetch_args)
+    fetching, pipeline = StagePipeline(stages[:2]), StagePipeline(stages[2:])
+
+    logger.debug(f"Fetching {len(image_names)} views from {folder_path} for the view selection")
+    views = _select_decoded_views(fetching.run(image_names), selection)
+    views = pipeline.run(views)
+
+    images, predictions, source_arkit = assemble_views(views)
+    return images, predictions, source_arkit, {**fetching.summary(), **pipeline.summary()}
+
+  sidecars = None
+  if selection is not None and selection.max_views is not None:
+    image_names, sidecars = _preselect_views(bucket, folder_path, files, image_names, selection, fetch_args)
+
+  logger.debug(f"Streaming {len(image_names)} views from {folder_path}")
+  pipeline = StagePipeline(make_view_stages(bucket, folder_path, files, snu_fn, sam_fn, decode, args, sidecars, fetch_args))
+  views = pipeline.run(image_names)
+
+  images, predictions, source_arkit = assemble_views(views)
+  return images, predictions, source_arkit, pipeline.summary()
+
+def stream_task(id: str, snu_fn, sam_fn, args: StreamArgs = None, selection: ViewSelectionArgs = None, fetch_args: FetchArgs = None) -> tuple[list, Predictions, ARKitSource, dict]:
+  return stream_views(data.get_source_bucket(), f'tasks/{id}/', snu_fn, sam_fn, args=args, selection=selection, fetch_args=fetch_args)